@@ -21,16 +21,50 @@ class Config:
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASS = os.getenv("DB_PASS", "")
     DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URL = os.getenv(
+        "ASYNC_DATABASE_URL",
+        f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    )
+    
+    # نسخة القراءة (اختيارية) - شاشات العرض والتقارير فقط، وكل ما يغير الأرصدة يبقى على الأساسية
+    DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+    ASYNC_DATABASE_REPLICA_URL = os.getenv(
+        "ASYNC_DATABASE_REPLICA_URL",
+        DATABASE_REPLICA_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+    )
+    REPLICA_READ_YOUR_WRITES_SECONDS = float(os.getenv("REPLICA_READ_YOUR_WRITES_SECONDS", "10"))
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "5"))
+    # مفاتيح الكتابات الحديثة في Redis (REDIS_URL) مشتركة بين كل العمليات
+    REPLICA_REDIS_TIMEOUT = float(os.getenv("REPLICA_REDIS_TIMEOUT", "0.2"))
     
     # ========== WEBHOOKS ==========
     WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "https://yourdomain.com")
-    WEBHOOK_PATH = f"/bot/{BOT_TOKEN}"
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", f"/bot/{BOT_TOKEN}")
     WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+    # polling أو webhook (تيليجرام يرسل التحديثات إلى WEBHOOK_URL)
+    # أو shard_front و shard_worker لتوزيع المستخدمين على عدة عمليات (انظر SHARDING)
+    BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+    # يُرسل في X-Telegram-Bot-Api-Secret-Token مع كل تحديث (A-Z a-z 0-9 _ - حتى 256 حرف)
+    TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+    TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8002"))
+    TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+    TELEGRAM_UPDATE_QUEUE_MAX = int(os.getenv("TELEGRAM_UPDATE_QUEUE_MAX", "5000"))  # بعدها يُرد 503 ويعيد تيليجرام الإرسال
     
     ICHANCY_API_URL = os.getenv("ICHANCY_API_URL", "https://agents.ichancy.com/api")
     ICHANCY_USERNAME = os.getenv("ICHANCY_USERNAME")
     ICHANCY_PASSWORD = os.getenv("ICHANCY_PASSWORD")
     
+    # ========== SHARDING ==========
+    # الواجهة تضع كل تحديث في قائمة Redis للقسم telegram_id % SHARD_COUNT (utils/sharding.py)
+    # مطلوب في وضعي الأقسام ونفس القيمة في الواجهة وكل العمال (يُتحقق منها عبر Redis عند البدء)
+    SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+    # أقسام هذا العامل مثل "0,1" - فارغ = تشغيل كل الأقسام كعمليات على هذا الجهاز
+    BOT_SHARDS = os.getenv("BOT_SHARDS", "")
+    SHARD_REDIS_URL = os.getenv("SHARD_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    SHARD_QUEUE_MAX = int(os.getenv("SHARD_QUEUE_MAX", "5000"))  # لكل قسم، بعدها ترد الواجهة 503
+    SHARD_POP_BATCH = int(os.getenv("SHARD_POP_BATCH", "100"))
+    
     # ========== PAYMENT SETTINGS ==========
     SYRIATEL_CASH_CODES = {}  # سيتم تعبئته من قاعدة البيانات
     CHAM_CASH_SETTINGS = {}
@@ -57,21 +91,107 @@ class Config:
     # ========== PERFORMANCE ==========
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))  # 5 دقائق
-    MAX_CONCURRENT = int(os.getenv("MAX_CONCURRENT", "100"))
+    # ذاكرة المستخدمين (utils/cache.py): L1 داخل العملية + L2 في Redis بمهلة CACHE_TTL
+    USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").lower() == "true"
+    USER_CACHE_L1_SIZE = int(os.getenv("USER_CACHE_L1_SIZE", "10000"))
+    USER_CACHE_L1_TTL = float(os.getenv("USER_CACHE_L1_TTL", "30"))  # ثواني - حد التأخر إذا فات إبطال من عملية أخرى
+    USER_CACHE_REDIS_TIMEOUT = float(os.getenv("USER_CACHE_REDIS_TIMEOUT", "0.2"))
+    MAX_CONCURRENT = int(os.getenv("MAX_CONCURRENT", "100"))  # تحديثات تيليجرام المعالجة معاً
+    # تحديثات مقبولة بانتظار دورها (تحديثات المستخدم الواحد تُعالج بالترتيب)
+    MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", str(MAX_CONCURRENT * 10)))
+    
+    # ========== SEND QUEUE ==========
+    # حدود الإرسال إلى تيليجرام (utils/send_queue.py)
+    SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # رسالة/ثانية لكل البوت
+    SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # رسالة/ثانية لكل محادثة خاصة
+    SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+    SEND_GROUP_RATE_PER_MINUTE = float(os.getenv("SEND_GROUP_RATE_PER_MINUTE", "20"))  # المجموعات والقنوات
+    SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))  # إعادة المحاولة بعد 429
+    
+    # ========== BROADCAST ==========
+    # الرسائل الجماعية تُقرأ على نوافذ من users.id وتُحفظ بعد كل دفعة للاستئناف بعد إعادة التشغيل
+    BROADCAST_WINDOW = int(os.getenv("BROADCAST_WINDOW", "2000"))  # مستخدمون لكل استعلام
+    BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "100"))  # yield_per وحجم الدفعة بين نقاط الحفظ
+    BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "120"))
+    
+    # ========== PERSISTENCE ==========
+    # user_data وحالات المحادثات في Redis (utils/persistence.py) - مطلوب لتشغيل أكثر من نسخة
+    PERSISTENCE_ENABLED = os.getenv("PERSISTENCE_ENABLED", "true").lower() == "true"
+    PERSISTENCE_TTL = int(os.getenv("PERSISTENCE_TTL", str(2 * 86400)))  # حالة المستخدم غير النشط تُحذف بعدها
+    PERSISTENCE_REDIS_TIMEOUT = float(os.getenv("PERSISTENCE_REDIS_TIMEOUT", "0.5"))
+    PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "60"))  # الحفظ الدوري الاحتياطي
+    PERSISTENCE_KNOWN_KEYS = int(os.getenv("PERSISTENCE_KNOWN_KEYS", "20000"))
+    
+    # ========== IDEMPOTENCY ==========
+    # منع تنفيذ التحديث المعاد أو الضغط المزدوج مرتين (utils/idempotency.py)
+    UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", "3600"))  # ثواني بقاء update_id في Redis
+    UPDATE_DEDUP_LRU_SIZE = int(os.getenv("UPDATE_DEDUP_LRU_SIZE", "50000"))
+    IDEMPOTENCY_KEY_RETENTION_DAYS = int(os.getenv("IDEMPOTENCY_KEY_RETENTION_DAYS", "7"))
+    
+    # ========== SYRIATEL CODES ==========
+    # حجز سعة الكود لطلب الشحن حتى وصول التحويل (utils/syriatel_allocator.py)
+    SYRIATEL_RESERVATION_MINUTES = int(os.getenv("SYRIATEL_RESERVATION_MINUTES", "15"))
+    SYRIATEL_RESERVATION_RETENTION_DAYS = int(os.getenv("SYRIATEL_RESERVATION_RETENTION_DAYS", "7"))
+    
+    # ========== MAINTENANCE ==========
+    # مهام الصيانة الدورية داخل عملية البوت (utils/maintenance.py)
+    MAINTENANCE_JOBS_ENABLED = os.getenv("MAINTENANCE_JOBS_ENABLED", "true").lower() == "true"
+    
+    # ========== DATABASE POOL ==========
+    # لكل عملية (البوت وكل Webhook) مجمعها الخاص، والقيم الافتراضية تتبع MAX_CONCURRENT
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(5, MAX_CONCURRENT // 5))))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(10, MAX_CONCURRENT // 10))))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # ثواني انتظار الحصول على اتصال
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 30 دقيقة
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    
+    # ========== BALANCE LEDGER ==========
+    # كل تغيير في الرصيد يُسجل في balance_entries، واللقطات الدورية تختصر الجمع
+    # true (الافتراضي): الرصيد = آخر لقطة + القيود بعدها، ولا يُحدث users.balance مع كل عملية
+    # false: التعديل على صف users مع قيد في السجل (الوضع السابق، للرجوع المؤقت فقط)
+    BALANCE_LEDGER_AUTHORITATIVE = os.getenv("BALANCE_LEDGER_AUTHORITATIVE", "true").lower() == "true"
+    BALANCE_SNAPSHOT_INTERVAL_MINUTES = int(os.getenv("BALANCE_SNAPSHOT_INTERVAL_MINUTES", "10"))
+    # القيود الأحدث من هذا لا تدخل اللقطة (قد تُلتزم معاملة أقدم بمعرف أصغر بعدها)
+    BALANCE_SNAPSHOT_LAG_SECONDS = int(os.getenv("BALANCE_SNAPSHOT_LAG_SECONDS", "300"))
+    
+    # ========== LOG SINK ==========
+    # سجلات الإدمن والنظام تُكتب على دفعات (utils/log_sink.py)
+    LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "500"))
+    LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", "200"))
+    LOG_BUFFER_MAX = int(os.getenv("LOG_BUFFER_MAX", "10000"))  # أقصى عدد صفوف بانتظار الكتابة
+    
+    # ========== QUERY BUDGET ==========
+    # عد استعلامات كل تحديث/طلب وكشف التكرار (N+1)
+    QUERY_BUDGET_ENABLED = os.getenv("QUERY_BUDGET_ENABLED", "true").lower() == "true"
+    QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "15"))  # أقصى عدد استعلامات لكل تحديث/طلب
+    QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))  # تكرار نفس العبارة = N+1
+    QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() == "true"  # رفع استثناء (للاختبارات)
+    
+    # ========== PARTITIONING ==========
+    # تقسيم جدول المعاملات شهرياً (PostgreSQL فقط)
+    TRANSACTIONS_PARTITIONED = os.getenv("TRANSACTIONS_PARTITIONED", "false").lower() == "true"
+    PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))  # 0 = بدون أرشفة
+    PARTITION_ARCHIVE_SCHEMA = os.getenv("PARTITION_ARCHIVE_SCHEMA", "archive")
     
     # ========== TIMING ==========
     REPORT_TIME = "00:00"  # منتصف الليل
     BURN_CHECK_INTERVAL = timedelta(hours=6)
     BONUS_EXPIRY_DAYS = int(os.getenv("BONUS_EXPIRY_DAYS", "30"))
+    BONUS_RULES_TTL = int(os.getenv("BONUS_RULES_TTL", "300"))  # ثواني - إعادة تجميع قواعد البونص (utils/bonus_rules.py)
 
-# تكوين التسجيل
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# تكوين التسجيل - تستدعيه نقاط التشغيل (main_bot والـ Webhooks والسكربتات) وليس الاستيراد
+def setup_logging():
+    if logging.getLogger().handlers:
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            # delay: لا يُفتح الملف حتى أول سجل
+            logging.FileHandler('bot.log', encoding='utf-8', delay=True),
+            logging.StreamHandler()
+        ]
+    )
 
 logger = logging.getLogger(__name__)
\ No newline at end of file
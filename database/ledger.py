@@ -0,0 +1,146 @@
+"""
+لقطات الأرصدة الدورية من سجل القيود (balance_entries)
+
+الرصيد = آخر لقطة + القيود بعد last_entry_id، فتبقى القيود المجموعة عند القراءة قليلة.
+اللقطة لا تشمل القيود الأحدث من BALANCE_SNAPSHOT_LAG_SECONDS: معرفات القيود تُحجز
+عند الإدراج لا عند الالتزام، فقد يظهر قيد بمعرف أصغر بعد أخذ لقطة تتجاوزه.
+
+الاستخدام:
+    python -m database.ledger snapshot     # أخذ لقطة الآن
+    python -m database.ledger verify       # مقارنة users.balance مع السجل (قبل الترقية من وضع الصف)
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from config import Config
+from database.models import get_engine, User, BalanceEntry, BalanceSnapshot
+
+logger = logging.getLogger(__name__)
+
+# المفتاح الأول لـ pg_try_advisory_xact_lock (utils/balance.py يستخدم 7301)
+_LOCK_NAMESPACE = 7304
+
+
+def _insert(conn):
+    """INSERT يدعم ON CONFLICT حسب نوع قاعدة البيانات"""
+    if conn.dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
+
+
+def take_balance_snapshots(bind=None, refreshed: Optional[List[int]] = None) -> int:
+    """دمج القيود الجديدة في لقطات المستخدمين (مهمة صيانة دورية) - يرجع عدد المستخدمين المحدثين
+
+    refreshed: تُضاف إليها telegram_id للمستخدمين الذين تغير users.balance لديهم (لإبطال الكاش).
+    """
+    bind = bind or get_engine()
+    started_at = datetime.utcnow()
+    cutoff = started_at - timedelta(seconds=Config.BALANCE_SNAPSHOT_LAG_SECONDS)
+
+    with bind.begin() as conn:
+        # لقطتان معاً (مهمة الصيانة وأمر يدوي) تكرران نفس العمل - الثانية تتخطى
+        if conn.dialect.name == "postgresql" and not conn.scalar(
+            text("SELECT pg_try_advisory_xact_lock(:namespace, 0)"), {"namespace": _LOCK_NAMESPACE}
+        ):
+            return 0
+        horizon = conn.scalar(select(func.max(BalanceEntry.id)).where(BalanceEntry.created_at < cutoff))
+        # كل القيود حتى أعلى last_entry_id دخلت لقطة سابقة لكل المستخدمين (بافتراض مهلة LAG)
+        floor = conn.scalar(select(func.coalesce(func.max(BalanceSnapshot.last_entry_id), 0)))
+        if horizon is None or horizon <= floor:
+            return 0
+
+        tail = (
+            select(
+                BalanceEntry.user_id,
+                (func.coalesce(BalanceSnapshot.balance, 0) + func.sum(BalanceEntry.amount)).label("balance"),
+                func.max(BalanceEntry.id).label("last_entry_id")
+            )
+            .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == BalanceEntry.user_id)
+            .where(
+                BalanceEntry.id > floor,
+                BalanceEntry.id <= horizon,
+                BalanceEntry.id > func.coalesce(BalanceSnapshot.last_entry_id, 0)
+            )
+            .group_by(BalanceEntry.user_id, BalanceSnapshot.balance)
+        )
+        rows = conn.execute(tail).fetchall()
+        if not rows:
+            return 0
+
+        insert = _insert(conn)
+        statement = insert(BalanceSnapshot).values([
+            {
+                "user_id": row.user_id,
+                "balance": row.balance,
+                "last_entry_id": row.last_entry_id,
+                "updated_at": started_at
+            }
+            for row in rows
+        ])
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=[BalanceSnapshot.user_id],
+            set_={
+                "balance": statement.excluded.balance,
+                "last_entry_id": statement.excluded.last_entry_id,
+                "updated_at": statement.excluded.updated_at
+            }
+        ))
+
+        if Config.BALANCE_LEDGER_AUTHORITATIVE:
+            # users.balance نسخة عرض حتى آخر لقطة (الشاشات المهمة تقرأ السجل مباشرة)
+            telegram_ids = conn.execute(
+                update(User)
+                .where(User.id == BalanceSnapshot.user_id, BalanceSnapshot.updated_at == started_at)
+                .values(balance=BalanceSnapshot.balance)
+                .returning(User.telegram_id)
+            ).scalars().all()
+            if refreshed is not None:
+                refreshed.extend(telegram_ids)
+
+    logger.info(f"📸 لقطات الأرصدة: {len(rows)} مستخدم حتى القيد {horizon}")
+    return len(rows)
+
+
+def verify_balances(bind=None, limit: int = 100) -> List[Tuple[int, float, float]]:
+    """المستخدمون الذين يختلف users.balance لديهم عن (اللقطة + القيود) - (id, users.balance, السجل)"""
+    bind = bind or get_engine()
+    tail = select(func.coalesce(func.sum(BalanceEntry.amount), 0)).where(
+        BalanceEntry.user_id == User.id,
+        BalanceEntry.id > func.coalesce(BalanceSnapshot.last_entry_id, 0)
+    ).scalar_subquery()
+    ledger = func.coalesce(BalanceSnapshot.balance, 0) + tail
+
+    with bind.connect() as conn:
+        rows = conn.execute(
+            select(User.id, User.balance, ledger)
+            .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == User.id)
+            .where(func.abs(User.balance - ledger) > 0.005)
+            .order_by(User.id)
+            .limit(limit)
+        ).fetchall()
+    return [(row[0], row[1], row[2]) for row in rows]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from config import setup_logging
+
+    setup_logging()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "snapshot"
+
+    if command == "snapshot":
+        print(f"✅ تم تحديث {take_balance_snapshots()} لقطة")
+    elif command == "verify":
+        mismatches = verify_balances()
+        for user_id, balance, ledger_balance in mismatches:
+            print(f"❌ {user_id}: users.balance={balance:,.2f} السجل={ledger_balance:,.2f}")
+        print("✅ الأرصدة مطابقة" if not mismatches else f"⚠️ {len(mismatches)} اختلاف")
+    else:
+        print(__doc__)
+        sys.exit(1)
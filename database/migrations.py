@@ -0,0 +1,238 @@
+"""
+ترحيل مخطط قاعدة البيانات (PostgreSQL)
+
+create_tables() تنشئ الجداول والفهارس على قاعدة بيانات فارغة، أما قواعد البيانات
+القائمة فيتم تحديثها من هنا. كل ترحيل يُنفذ مرة واحدة ويُسجل في جدول schema_migrations.
+
+الاستخدام:
+    python -m database.migrations
+"""
+import logging
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from database.models import engine, UserStats, DailyStats, BalanceEntry, BalanceSnapshot, Broadcast, IdempotencyKey, SyriatelReservation
+
+logger = logging.getLogger(__name__)
+
+
+def _create_table(model) -> str:
+    """DDL الجدول من النموذج نفسه حتى لا يختلف الترحيل عن create_tables()"""
+    return str(CreateTable(model.__table__, if_not_exists=True).compile(dialect=postgresql.dialect()))
+
+
+def _create_indexes(model) -> List[str]:
+    return [
+        str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect()))
+        for index in sorted(model.__table__.indexes, key=lambda index: index.name)
+    ]
+
+
+# (المعرف، التعليمات، داخل معاملة؟)
+# CREATE INDEX CONCURRENTLY لا يعمل داخل معاملة لكنه لا يقفل الجدول أثناء البناء
+MIGRATIONS: List[Tuple[str, List[str], bool]] = [
+    (
+        "0001_hot_path_indexes",
+        [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_code_method_status "
+            "ON transactions (transaction_code, payment_method, status)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_user_created "
+            "ON transactions (user_id, created_at)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_type_status_created "
+            "ON transactions (transaction_type, status, created_at)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_pending "
+            "ON transactions (transaction_type, created_at) WHERE status = 'pending'",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_ichancy_account_id "
+            "ON users (ichancy_account_id)",
+            "ANALYZE transactions",
+            "ANALYZE users",
+        ],
+        False
+    ),
+    (
+        "0002_user_stats",
+        [
+            _create_table(UserStats),
+            # تعبئة الملخص من المعاملات المكتملة الحالية
+            "INSERT INTO user_stats (user_id, deposits_total, deposits_count, withdrawals_total, "
+            "withdrawals_count, bonuses_total, gifts_sent_total, gifts_received_total, "
+            "last_transaction_type, last_transaction_amount, last_transaction_at, updated_at) "
+            "SELECT t.user_id, "
+            "coalesce(sum(t.amount) FILTER (WHERE t.transaction_type = 'deposit'), 0), "
+            "count(*) FILTER (WHERE t.transaction_type = 'deposit'), "
+            "coalesce(sum(t.amount) FILTER (WHERE t.transaction_type = 'withdraw'), 0), "
+            "count(*) FILTER (WHERE t.transaction_type = 'withdraw'), "
+            "coalesce(sum(t.amount) FILTER (WHERE t.transaction_type = 'bonus'), 0), "
+            "0, "
+            "coalesce(sum(t.amount) FILTER (WHERE t.transaction_type = 'gift'), 0), "
+            "last.transaction_type, last.amount, last.completed_at, now() "
+            "FROM transactions t "
+            "JOIN (SELECT DISTINCT ON (user_id) user_id, transaction_type, amount, "
+            "coalesce(completed_at, created_at) AS completed_at "
+            "FROM transactions WHERE status = 'completed' "
+            "ORDER BY user_id, coalesce(completed_at, created_at) DESC) last ON last.user_id = t.user_id "
+            "WHERE t.status = 'completed' "
+            "GROUP BY t.user_id, last.transaction_type, last.amount, last.completed_at "
+            "ON CONFLICT (user_id) DO NOTHING",
+            # إهداءات الرصيد مسجلة في gift_transactions
+            "INSERT INTO user_stats (user_id, gifts_sent_total, deposits_total, deposits_count, "
+            "withdrawals_total, withdrawals_count, bonuses_total, gifts_received_total, updated_at) "
+            "SELECT sender_id, sum(amount), 0, 0, 0, 0, 0, 0, now() FROM gift_transactions GROUP BY sender_id "
+            "ON CONFLICT (user_id) DO UPDATE SET gifts_sent_total = EXCLUDED.gifts_sent_total",
+            "INSERT INTO user_stats (user_id, gifts_received_total, deposits_total, deposits_count, "
+            "withdrawals_total, withdrawals_count, bonuses_total, gifts_sent_total, updated_at) "
+            "SELECT receiver_id, sum(amount - coalesce(fee, 0)), 0, 0, 0, 0, 0, 0, now() "
+            "FROM gift_transactions GROUP BY receiver_id "
+            "ON CONFLICT (user_id) DO UPDATE SET "
+            "gifts_received_total = user_stats.gifts_received_total + EXCLUDED.gifts_received_total",
+        ],
+        True
+    ),
+    (
+        "0003_daily_stats",
+        [
+            _create_table(DailyStats),
+            # تعبئة التجميع من المعاملات المنتهية حسب يوم إنهائها
+            "INSERT INTO daily_stats (day, payment_method, transaction_type, completed_count, "
+            "completed_amount, completed_fee, rejected_count, rejected_amount, updated_at) "
+            "SELECT coalesce(completed_at, created_at)::date, coalesce(payment_method, 'unknown'), "
+            "transaction_type, "
+            "count(*) FILTER (WHERE status = 'completed'), "
+            "coalesce(sum(amount) FILTER (WHERE status = 'completed'), 0), "
+            "coalesce(sum(fee) FILTER (WHERE status = 'completed'), 0), "
+            "count(*) FILTER (WHERE status = 'rejected'), "
+            "coalesce(sum(amount) FILTER (WHERE status = 'rejected'), 0), "
+            "now() "
+            "FROM transactions WHERE status IN ('completed', 'rejected') "
+            "GROUP BY 1, 2, 3 "
+            "ON CONFLICT (day, payment_method, transaction_type) DO NOTHING",
+        ],
+        True
+    ),
+    (
+        "0004_balance_ledger",
+        [
+            _create_table(BalanceEntry),
+            *_create_indexes(BalanceEntry),
+            _create_table(BalanceSnapshot),
+            # اللقطة الافتتاحية = الرصيد الحالي، بعد أي قيود كُتبت قبل الترحيل (موجودة في users.balance)
+            "INSERT INTO balance_snapshots (user_id, balance, last_entry_id, updated_at) "
+            "SELECT id, coalesce(balance, 0), (SELECT coalesce(max(id), 0) FROM balance_entries), now() "
+            "FROM users "
+            "ON CONFLICT (user_id) DO NOTHING",
+        ],
+        True
+    ),
+    (
+        "0005_broadcasts",
+        [_create_table(Broadcast)],
+        True
+    ),
+    (
+        "0006_idempotency_keys",
+        [_create_table(IdempotencyKey), *_create_indexes(IdempotencyKey)],
+        True
+    ),
+    (
+        "0007_syriatel_reservations",
+        [
+            "ALTER TABLE syriatel_codes ADD COLUMN IF NOT EXISTS reserved_balance DOUBLE PRECISION DEFAULT 0",
+            _create_table(SyriatelReservation),
+            *_create_indexes(SyriatelReservation),
+        ],
+        True
+    ),
+    (
+        "0008_balance_ledger_authoritative",
+        [
+            # السجل أصبح المصدر افتراضياً: المستخدمون الذين لهم رصيد بدون لقطة ولا قيود (أرصدة كُتبت
+            # مباشرة في users) يأخذون لقطة بهذا الرصيد. last_entry_id لا يتجاوز أعلى لقطة حالية
+            # حتى لا تتخطى مهمة اللقطات قيود المستخدمين الآخرين.
+            "INSERT INTO balance_snapshots (user_id, balance, last_entry_id, updated_at) "
+            "SELECT u.id, u.balance, (SELECT coalesce(max(last_entry_id), 0) FROM balance_snapshots), now() "
+            "FROM users u "
+            "WHERE coalesce(u.balance, 0) <> 0 "
+            "AND NOT EXISTS (SELECT 1 FROM balance_snapshots s WHERE s.user_id = u.id) "
+            "AND NOT EXISTS (SELECT 1 FROM balance_entries e WHERE e.user_id = u.id) "
+            "ON CONFLICT (user_id) DO NOTHING",
+        ],
+        True
+    ),
+]
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version VARCHAR(100) PRIMARY KEY, "
+        "applied_at TIMESTAMP NOT NULL DEFAULT now())"
+    ))
+
+
+def _partitioned_tables(conn) -> set:
+    rows = conn.execute(text("SELECT relname FROM pg_class WHERE relkind = 'p'")).fetchall()
+    return {row[0] for row in rows}
+
+
+def _without_concurrently(statement: str, partitioned: set) -> str:
+    """CREATE INDEX CONCURRENTLY غير مدعوم على الجداول المقسمة (انظر database/partitions.py)"""
+    if "CONCURRENTLY" in statement and any(f" ON {table} " in statement for table in partitioned):
+        return statement.replace(" CONCURRENTLY", "")
+    return statement
+
+
+def applied_migrations(bind=None) -> set:
+    """المعرفات المطبقة مسبقاً"""
+    bind = bind or engine
+    with bind.begin() as conn:
+        _ensure_migrations_table(conn)
+        rows = conn.execute(text("SELECT version FROM schema_migrations")).fetchall()
+    return {row[0] for row in rows}
+
+
+def run_migrations(bind=None) -> List[str]:
+    """تطبيق الترحيلات غير المطبقة بالترتيب"""
+    bind = bind or engine
+    done = applied_migrations(bind)
+    applied = []
+    
+    for version, statements, transactional in MIGRATIONS:
+        if version in done:
+            continue
+        
+        logger.info(f"🔧 تطبيق الترحيل {version}...")
+        
+        if transactional:
+            with bind.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version) VALUES (:v)"),
+                    {"v": version}
+                )
+        else:
+            with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                partitioned = _partitioned_tables(conn)
+                for statement in statements:
+                    conn.execute(text(_without_concurrently(statement, partitioned)))
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version) VALUES (:v)"),
+                    {"v": version}
+                )
+        
+        applied.append(version)
+        logger.info(f"✅ تم تطبيق الترحيل {version}")
+    
+    return applied
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+    
+    setup_logging()
+    
+    result = run_migrations()
+    print(f"✅ تم تطبيق {len(result)} ترحيل" if result else "✅ قاعدة البيانات محدثة")
@@ -2,14 +2,80 @@
 نماذج قاعدة البيانات
 """
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, JSON, BigInteger
+from functools import lru_cache
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, Text, JSON, BigInteger, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from config import Config
+from database.pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool
 
 Base = declarative_base()
-engine = create_engine(Config.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# إعدادات مجمع الاتصالات المشتركة
+POOL_OPTIONS = {
+    "pool_size": Config.DB_POOL_SIZE,
+    "max_overflow": Config.DB_MAX_OVERFLOW,
+    "pool_timeout": Config.DB_POOL_TIMEOUT,
+    "pool_recycle": Config.DB_POOL_RECYCLE,
+    "pool_pre_ping": Config.DB_POOL_PRE_PING
+}
+
+# المحرك غير المتزامن - للبوت و الـ Webhooks حتى لا تحجب الاستعلامات حلقة الأحداث
+async_engine = create_async_engine(
+    Config.ASYNC_DATABASE_URL,
+    poolclass=InstrumentedAsyncQueuePool,
+    **POOL_OPTIONS
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# نسخة القراءة - بدونها تعود الجلسات للقاعدة الأساسية (التوجيه في database/routing.py)
+if Config.DATABASE_REPLICA_URL:
+    async_replica_engine = create_async_engine(
+        Config.ASYNC_DATABASE_REPLICA_URL,
+        poolclass=InstrumentedAsyncQueuePool,
+        **POOL_OPTIONS
+    )
+else:
+    async_replica_engine = async_engine
+
+AsyncReadSessionLocal = async_sessionmaker(
+    bind=async_replica_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# المحرك المتزامن - للسكربتات فقط (النسخ الاحتياطي، التقارير، الترحيل)
+# يُنشأ عند أول استخدام فلا يُحمّل psycopg2 ولا يُنشأ مجمع اتصالات في البوت والـ Webhooks
+@lru_cache(maxsize=None)
+def get_engine():
+    return create_engine(Config.DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+
+@lru_cache(maxsize=None)
+def get_replica_engine():
+    if not Config.DATABASE_REPLICA_URL:
+        return get_engine()
+    return create_engine(Config.DATABASE_REPLICA_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+
+_LAZY_SYNC = {
+    "engine": get_engine,
+    "replica_engine": get_replica_engine,
+    "SessionLocal": lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_engine()),
+    "ReadSessionLocal": lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_replica_engine())
+}
+
+def __getattr__(name):
+    """from database.models import engine / SessionLocal ... تعمل كما كانت (تُنشأ عند أول طلب)"""
+    if name not in _LAZY_SYNC:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = _LAZY_SYNC[name]()
+    return value
 
 class User(Base):
     __tablename__ = "users"
@@ -20,7 +86,7 @@ class User(Base):
     first_name = Column(String(100), nullable=False)
     last_name = Column(String(100), nullable=True)
     balance = Column(Float, default=0.0)
-    ichancy_account_id = Column(String(100), nullable=True)
+    ichancy_account_id = Column(String(100), nullable=True, index=True)
     ichancy_username = Column(String(100), nullable=True)
     referral_code = Column(String(20), unique=True, nullable=True)
     referred_by = Column(Integer, ForeignKey('users.id'), nullable=True)
@@ -37,7 +103,7 @@ class User(Base):
 class Transaction(Base):
     __tablename__ = "transactions"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     transaction_type = Column(String(20), nullable=False)  # deposit, withdraw, gift, bonus
     amount = Column(Float, nullable=False)
@@ -49,11 +115,31 @@ class Transaction(Base):
     admin_id = Column(Integer, nullable=True)  # إذا تمت يدوياً
     auto_verified = Column(Boolean, default=False)
     notes = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # في الجدول المقسم يجب أن يكون مفتاح التقسيم جزءاً من المفتاح الأساسي
+    created_at = Column(DateTime, default=datetime.utcnow, primary_key=Config.TRANSACTIONS_PARTITIONED)
     completed_at = Column(DateTime, nullable=True)
     
     # العلاقات
     user = relationship("User", back_populates="transactions")
+    
+    # فهارس مسارات الاستعلام الساخنة (راجع database/migrations.py)
+    __table_args__ = (
+        # مطابقة رسائل SMS والتحقق اليدوي
+        Index("ix_transactions_code_method_status", "transaction_code", "payment_method", "status"),
+        # سجل المستخدم
+        Index("ix_transactions_user_created", "user_id", "created_at"),
+        # لوحات الإدمن والتقارير
+        Index("ix_transactions_type_status_created", "transaction_type", "status", "created_at"),
+        # الطلبات المعلقة فقط - صغير ويبقى في الذاكرة
+        Index(
+            "ix_transactions_pending",
+            "transaction_type", "created_at",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'")
+        ),
+        # تقسيم شهري حسب created_at (PostgreSQL فقط، راجع database/partitions.py)
+        {"postgresql_partition_by": "RANGE (created_at)"} if Config.TRANSACTIONS_PARTITIONED else {},
+    )
 
 class Referral(Base):
     __tablename__ = "referrals"
@@ -104,11 +190,43 @@ class SyriatelCode(Base):
     id = Column(Integer, primary_key=True, index=True)
     code = Column(String(20), unique=True, nullable=False)
     current_balance = Column(Float, default=0.0)
+    reserved_balance = Column(Float, default=0.0)  # حجوزات طلبات لم يصل تحويلها (SyriatelReservation)
     max_balance = Column(Float, default=5400.0)
     is_active = Column(Boolean, default=True)
     last_used = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class SyriatelReservation(Base):
+    """سعة محجوزة على كود سيرياتيل لطلب شحن لم يصل تحويله بعد (utils/syriatel_allocator.py)"""
+    __tablename__ = "syriatel_reservations"
+    
+    id = Column(Integer, primary_key=True)
+    code_id = Column(Integer, ForeignKey('syriatel_codes.id'), nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    amount = Column(Float, nullable=False)
+    status = Column(String(20), default="active", nullable=False)  # active, consumed, released, expired
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        # تحرير الحجوزات المنتهية
+        Index(
+            "ix_syriatel_reservations_expiring",
+            "expires_at",
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'")
+        ),
+        # حجز المستخدم الحالي (إلغاء / استبدال / وصول التحويل)
+        Index(
+            "ix_syriatel_reservations_user_active",
+            "telegram_id",
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'")
+        ),
+        # حذف الحجوزات القديمة
+        Index("ix_syriatel_reservations_created", "created_at"),
+    )
+
 class Bonus(Base):
     __tablename__ = "bonuses"
     
@@ -157,14 +275,113 @@ class GiftTransaction(Base):
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
 
+class UserStats(Base):
+    """ملخص تراكمي لمعاملات المستخدم المكتملة - يُحدث مع كل معاملة (database/stats.py)"""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    deposits_total = Column(Float, default=0.0, nullable=False)
+    deposits_count = Column(Integer, default=0, nullable=False)
+    withdrawals_total = Column(Float, default=0.0, nullable=False)
+    withdrawals_count = Column(Integer, default=0, nullable=False)
+    bonuses_total = Column(Float, default=0.0, nullable=False)
+    gifts_sent_total = Column(Float, default=0.0, nullable=False)
+    gifts_received_total = Column(Float, default=0.0, nullable=False)
+    last_transaction_type = Column(String(20), nullable=True)
+    last_transaction_amount = Column(Float, nullable=True)
+    last_transaction_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DailyStats(Base):
+    """تجميع يومي للمعاملات حسب طريقة الدفع ونوع المعاملة - مصدر التقارير اليومية والشهرية"""
+    __tablename__ = "daily_stats"
+    
+    day = Column(Date, primary_key=True)
+    payment_method = Column(String(50), primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    completed_count = Column(Integer, default=0, nullable=False)
+    completed_amount = Column(Float, default=0.0, nullable=False)
+    completed_fee = Column(Float, default=0.0, nullable=False)
+    rejected_count = Column(Integer, default=0, nullable=False)
+    rejected_amount = Column(Float, default=0.0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BalanceEntry(Base):
+    """قيد رصيد - سجل إضافة فقط، لا يُعدل ولا يُحذف (utils/balance.py)"""
+    __tablename__ = "balance_entries"
+    
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    amount = Column(Float, nullable=False)  # موجب للإضافة وسالب للخصم
+    entry_type = Column(String(20), nullable=False)  # deposit, withdraw, bonus, gift_sent, gift_received, admin_add
+    reference_type = Column(String(30), nullable=True)  # transactions, gift_transactions
+    reference_id = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        # ذيل القيود بعد آخر لقطة
+        Index("ix_balance_entries_user_entry", "user_id", "id"),
+    )
+
+class BalanceSnapshot(Base):
+    """لقطة دورية لرصيد المستخدم حتى القيد last_entry_id (database/ledger.py)"""
+    __tablename__ = "balance_snapshots"
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    balance = Column(Float, default=0.0, nullable=False)
+    last_entry_id = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Broadcast(Base):
+    """رسالة جماعية لكل المستخدمين - تُستأنف من last_user_id بعد إعادة التشغيل (utils/broadcast.py)"""
+    __tablename__ = "broadcasts"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    admin_id = Column(Integer, nullable=False)  # users.id للإدمن (يستلم التقرير)
+    text = Column(Text, nullable=False)
+    status = Column(String(20), default="running", nullable=False)  # running, completed, canceled
+    last_user_id = Column(Integer, default=0, nullable=False)  # آخر users.id تمت معالجته
+    total = Column(Integer, default=0, nullable=False)  # عدد المستلمين عند البدء
+    sent = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    blocked = Column(Integer, default=0, nullable=False)  # حظروا البوت
+    lease_until = Column(DateTime, nullable=True)  # النسخة التي ترسل حالياً تجدده
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """مفتاح عملية مالية نُفذت - يُدرج في نفس معاملة العملية فلا تُنفذ مرتين (utils/idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+    
+    key = Column(String(128), primary_key=True)  # نوع العملية:رمز الطلب
+    telegram_id = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        # حذف المفاتيح المنتهية
+        Index("ix_idempotency_keys_created", "created_at"),
+    )
+
 # إنشاء الجداول
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    # الاستيراد يسجل مستمع after_create الذي ينشئ أقسام المعاملات مع الجدول
+    import database.partitions  # noqa: F401
+    Base.metadata.create_all(bind=get_engine())
 
 # جلسة قاعدة البيانات
 def get_db():
-    db = SessionLocal()
+    db = __getattr__("SessionLocal")()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# جلسة قاعدة البيانات غير المتزامنة (FastAPI)
+async def get_async_db():
+    db = AsyncSessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
\ No newline at end of file
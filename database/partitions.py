@@ -0,0 +1,284 @@
+"""
+إدارة أقسام جدول المعاملات (تقسيم شهري حسب created_at - PostgreSQL فقط)
+
+يُفعل عبر TRANSACTIONS_PARTITIONED=true. الاستعلامات المحددة بمدى زمني على created_at
+(التقارير والإحصائيات) تقرأ أقسام الفترة فقط بفضل partition pruning.
+
+الاستخدام:
+    python -m database.partitions ensure           # إنشاء أقسام الأشهر القادمة
+    python -m database.partitions list             # عرض الأقسام
+    python -m database.partitions archive          # أرشفة الأقسام الأقدم من PARTITION_RETENTION_MONTHS
+    python -m database.partitions convert          # تحويل جدول قائم غير مقسم (يتطلب توقف الكتابة)
+"""
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event, text
+
+from config import Config
+from database.models import get_engine, Transaction
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = Transaction.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+# قفل استشاري واحد لكل صيانة الأقسام (مهام الصيانة وأوامر هذا الملف من أي عملية)
+_LOCK_NAMESPACE = 7303
+
+
+def _add_months(day: date, months: int) -> date:
+    """إضافة عدد من الأشهر إلى أول الشهر"""
+    month_index = day.year * 12 + (day.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def partition_name(year: int, month: int) -> str:
+    return f"{PARENT_TABLE}_y{year}m{month:02d}"
+
+
+def month_bounds(year: int, month: int) -> Tuple[date, date]:
+    start = date(year, month, 1)
+    return start, _add_months(start, 1)
+
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is not None
+
+
+def create_month_partition(conn, year: int, month: int) -> str:
+    """إنشاء قسم شهر واحد إن لم يكن موجوداً
+
+    إذا وصلت صفوف هذا الشهر إلى القسم الافتراضي (نفدت الأقسام المنشأة مسبقاً) يرفض
+    PostgreSQL إنشاء القسم مباشرة، فتُنقل الصفوف إلى جدول جديد ثم يُربط بالجدول الأب.
+    """
+    name = partition_name(year, month)
+    if _table_exists(conn, name):
+        return name
+
+    start, end = month_bounds(year, month)
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    in_month = f"created_at >= '{start.isoformat()}' AND created_at < '{end.isoformat()}'"
+
+    stray = _table_exists(conn, DEFAULT_PARTITION) and conn.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_month})"
+    ))
+    if not stray:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} {bounds}"))
+        return name
+
+    # منع الإدخال في القسم الافتراضي حتى الربط، وإلا فشل ATTACH بسبب صفوف جديدة للشهر
+    conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE"))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_month} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    )).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} {bounds}"))
+    logger.warning(f"⚠️ تم نقل {moved} معاملة من {DEFAULT_PARTITION} إلى القسم الجديد {name}")
+    return name
+
+
+def create_default_partition(conn):
+    """قسم احتياطي للصفوف خارج الأشهر المنشأة، حتى لا يفشل الإدخال"""
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+    ))
+
+
+def ensure_partitions_on(conn, since: date, months_ahead: int) -> List[str]:
+    """إنشاء الأقسام من شهر since حتى months_ahead شهراً بعد الشهر الحالي"""
+    current = month_start(since)
+    last = _add_months(month_start(datetime.utcnow().date()), months_ahead)
+    created = []
+    while current <= last:
+        created.append(create_month_partition(conn, current.year, current.month))
+        current = _add_months(current, 1)
+    return created
+
+
+@contextmanager
+def partition_maintenance_lock(bind) -> Iterator[bool]:
+    """True إذا لم تكن عملية أخرى تعدل الأقسام الآن
+
+    DDL الأقسام (خاصة DETACH) يأخذ ACCESS EXCLUSIVE، فتنفيذه من عمليتين معاً يفشل أو ينتظر.
+    """
+    with bind.connect() as conn:
+        acquired = conn.scalar(text("SELECT pg_try_advisory_lock(:namespace, 0)"), {"namespace": _LOCK_NAMESPACE})
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:namespace, 0)"), {"namespace": _LOCK_NAMESPACE})
+                conn.commit()
+
+
+def ensure_future_partitions(bind=None, months_ahead: Optional[int] = None) -> List[str]:
+    """التأكد من وجود أقسام الشهر الحالي والأشهر القادمة (مهمة صيانة دورية)"""
+    bind = bind or get_engine()
+    months_ahead = Config.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    with partition_maintenance_lock(bind) as acquired:
+        if not acquired:
+            logger.info("⏭️ صيانة الأقسام تعمل في عملية أخرى")
+            return []
+        with bind.begin() as conn:
+            names = ensure_partitions_on(conn, datetime.utcnow().date(), months_ahead)
+    logger.info(f"✅ أقسام المعاملات جاهزة حتى {names[-1]}")
+    return names
+
+
+def list_partitions(bind=None) -> List[Tuple[str, str]]:
+    """الأقسام الحالية مع حدودها"""
+    bind = bind or get_engine()
+    with bind.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent "
+            "ORDER BY c.relname"
+        ), {"parent": PARENT_TABLE}).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def detach_partition(bind, year: int, month: int) -> str:
+    """فصل قسم شهر عن الجدول الأب (يبقى جدولاً مستقلاً)"""
+    name = partition_name(year, month)
+    # DETACH ... CONCURRENTLY غير ممكن بوجود القسم الافتراضي، لذا يُنفذ في وقت الصيانة الليلي
+    with bind.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+    logger.info(f"📦 تم فصل القسم {name}")
+    return name
+
+
+def archive_partition(bind, year: int, month: int, drop: bool = False) -> str:
+    """فصل قسم ثم نقله إلى مخطط الأرشيف أو حذفه"""
+    name = detach_partition(bind, year, month)
+    with bind.begin() as conn:
+        if drop:
+            conn.execute(text(f"DROP TABLE {name}"))
+            logger.info(f"🗑️ تم حذف القسم {name}")
+        else:
+            schema = Config.PARTITION_ARCHIVE_SCHEMA
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {schema}"))
+            logger.info(f"📦 تم نقل القسم {name} إلى {schema}")
+    return name
+
+
+def archive_old_partitions(bind=None, retention_months: Optional[int] = None, drop: bool = False) -> List[str]:
+    """أرشفة الأقسام الأقدم من فترة الاحتفاظ"""
+    bind = bind or get_engine()
+    retention_months = Config.PARTITION_RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return []
+
+    cutoff = _add_months(month_start(datetime.utcnow().date()), -retention_months)
+    archived = []
+
+    with partition_maintenance_lock(bind) as acquired:
+        if not acquired:
+            logger.info("⏭️ صيانة الأقسام تعمل في عملية أخرى")
+            return []
+        for name, _ in list_partitions(bind):
+            if name == DEFAULT_PARTITION:
+                continue
+            year, month = int(name[-7:-3]), int(name[-2:])
+            if date(year, month, 1) < cutoff:
+                archived.append(archive_partition(bind, year, month, drop=drop))
+
+    return archived
+
+
+def convert_to_partitioned(bind=None, keep_legacy: bool = True):
+    """
+    تحويل جدول transactions قائم إلى جدول مقسم.
+    ينسخ البيانات إلى الجدول الجديد، لذا يجب إيقاف الكتابة أثناء التنفيذ.
+    """
+    from database.migrations import run_migrations
+
+    if not Config.TRANSACTIONS_PARTITIONED:
+        raise RuntimeError("يجب تفعيل TRANSACTIONS_PARTITIONED قبل التحويل")
+
+    bind = bind or get_engine()
+    # الترحيلات التي تنشئ فهارس CONCURRENTLY لا تعمل على الجداول المقسمة
+    run_migrations(bind)
+    legacy = f"{PARENT_TABLE}_legacy"
+
+    with bind.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {PARENT_TABLE} IN ACCESS EXCLUSIVE MODE"))
+
+        # تحرير أسماء الفهارس والتسلسل للجدول الجديد
+        index_names = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :t AND indexname LIKE 'ix_%'"
+        ), {"t": PARENT_TABLE}).scalars().all()
+        for index_name in index_names:
+            conn.execute(text(f"DROP INDEX {index_name}"))
+
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {legacy}"))
+        conn.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {PARENT_TABLE}_pkey TO {legacy}_pkey"))
+        conn.execute(text(f"ALTER SEQUENCE {PARENT_TABLE}_id_seq RENAME TO {legacy}_id_seq"))
+
+        oldest = conn.execute(text(f"SELECT min(created_at) FROM {legacy}")).scalar()
+
+        # ينشئ الجدول المقسم والقسم الافتراضي وأقسام الأشهر القادمة
+        Transaction.__table__.create(conn)
+        if oldest:
+            ensure_partitions_on(conn, oldest.date(), Config.PARTITION_MONTHS_AHEAD)
+
+        columns = ", ".join(c.name for c in Transaction.__table__.columns)
+        conn.execute(text(
+            f"INSERT INTO {PARENT_TABLE} ({columns}) "
+            f"SELECT {columns} FROM {legacy} WHERE created_at IS NOT NULL"
+        ))
+        conn.execute(text(
+            f"SELECT setval('{PARENT_TABLE}_id_seq', "
+            f"(SELECT coalesce(max(id), 1) FROM {PARENT_TABLE}))"
+        ))
+
+        if not keep_legacy:
+            conn.execute(text(f"DROP TABLE {legacy}"))
+
+    with bind.begin() as conn:
+        conn.execute(text(f"ANALYZE {PARENT_TABLE}"))
+
+    logger.info("✅ تم تحويل جدول المعاملات إلى جدول مقسم")
+
+
+@event.listens_for(Transaction.__table__, "after_create")
+def _create_initial_partitions(target, connection, **kw):
+    """إنشاء القسم الافتراضي وأقسام الأشهر القادمة مع create_all"""
+    if not Config.TRANSACTIONS_PARTITIONED or connection.dialect.name != "postgresql":
+        return
+    create_default_partition(connection)
+    ensure_partitions_on(connection, datetime.utcnow().date(), Config.PARTITION_MONTHS_AHEAD)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from config import setup_logging
+
+    setup_logging()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "ensure"
+
+    if command == "ensure":
+        ensure_future_partitions()
+    elif command == "list":
+        for name, bound in list_partitions():
+            print(f"{name}: {bound}")
+    elif command == "archive":
+        print(f"✅ تمت أرشفة: {archive_old_partitions(drop='--drop' in sys.argv)}")
+    elif command == "convert":
+        convert_to_partitioned(keep_legacy='--drop-legacy' not in sys.argv)
+    else:
+        print(__doc__)
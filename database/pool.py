@@ -0,0 +1,91 @@
+"""
+مراقبة مجمع اتصالات قاعدة البيانات
+"""
+import time
+import threading
+from typing import Dict, Any
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+class PoolMetrics:
+    """عدادات انتظار الحصول على اتصال من المجمع"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+    
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            self.last_wait = wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_wait += wait
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / attempts * 1000, 3) if attempts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "last_wait_ms": round(self.last_wait * 1000, 3)
+            }
+
+
+class _TimedCheckoutMixin:
+    """قياس زمن انتظار كل عملية checkout"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+    
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    """مجمع اتصالات متزامن مع قياس الانتظار"""
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    """مجمع اتصالات غير متزامن مع قياس الانتظار"""
+
+
+def pool_status(engine) -> Dict[str, Any]:
+    """القراءات الحية لمجمع الاتصالات"""
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__}
+    
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # القيمة سالبة طالما لم يُستهلك كامل الحجم الأساسي
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout()
+        })
+    
+    metrics = getattr(pool, "metrics", None)
+    if metrics:
+        status["wait"] = metrics.snapshot()
+    
+    return status
@@ -0,0 +1,184 @@
+"""
+ميزانية الاستعلامات لكل تحديث تيليجرام أو طلب HTTP
+
+كل نطاق (track_queries) يعد عبارات SQL التي نُفذت داخله ووقتها، ويحدد العبارات
+المتكررة بنفس النص (نمط N+1 مثل التحميل الكسول لـ t.user داخل حلقة).
+عند تجاوز QUERY_BUDGET أو QUERY_REPEAT_THRESHOLD يُسجل تحذير، وفي وضع
+QUERY_BUDGET_STRICT (للاختبارات) يُرفع QueryBudgetExceeded.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """تجاوز عدد الاستعلامات المسموح أو اكتشاف نمط N+1 (وضع الاختبار فقط)"""
+
+
+class QueryStats:
+    """استعلامات نطاق واحد (تحديث أو طلب)"""
+
+    def __init__(self, name: str, budget: int):
+        self.name = name
+        self.budget = budget
+        self.count = 0
+        self.total_time = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """العبارات المتكررة بما يكفي لاعتبارها N+1"""
+        return [
+            (statement, times) for statement, times in self.statements.most_common()
+            if times >= Config.QUERY_REPEAT_THRESHOLD
+        ]
+
+    def problems(self) -> List[str]:
+        issues = []
+        if self.count > self.budget:
+            issues.append(f"{self.count} استعلام (الحد {self.budget})")
+        for statement, times in self.repeated():
+            issues.append(f"N+1: تكرر {times} مرة: {' '.join(statement.split())[:200]}")
+        return issues
+
+
+class _HandlerTotals:
+    """إجمالي الاستعلامات لكل معالج منذ بدء العملية"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, stats: QueryStats, flagged: bool):
+        with self._lock:
+            totals = self._totals.setdefault(stats.name, {
+                "calls": 0, "queries": 0, "max_queries": 0, "time": 0.0, "flagged": 0
+            })
+            totals["calls"] += 1
+            totals["queries"] += stats.count
+            totals["max_queries"] = max(totals["max_queries"], stats.count)
+            totals["time"] += stats.total_time
+            totals["flagged"] += int(flagged)
+
+    def snapshot(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """المعالجات الأعلى في متوسط عدد الاستعلامات"""
+        with self._lock:
+            rows = [
+                {
+                    "name": name,
+                    "calls": totals["calls"],
+                    "avg_queries": round(totals["queries"] / totals["calls"], 1),
+                    "max_queries": totals["max_queries"],
+                    "avg_time_ms": round(totals["time"] / totals["calls"] * 1000, 2),
+                    "flagged": totals["flagged"]
+                }
+                for name, totals in self._totals.items()
+            ]
+        rows.sort(key=lambda row: row["avg_queries"], reverse=True)
+        return rows[:limit]
+
+
+handler_totals = _HandlerTotals()
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries(name: str, budget: Optional[int] = None):
+    """عد استعلامات النطاق - يعمل داخل الدوال المتزامنة وغير المتزامنة"""
+    if not Config.QUERY_BUDGET_ENABLED:
+        yield None
+        return
+
+    stats = QueryStats(name, budget if budget is not None else Config.QUERY_BUDGET)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+    problems = stats.problems()
+    handler_totals.add(stats, bool(problems))
+
+    if problems:
+        summary = f"⚠️ ميزانية الاستعلامات [{stats.name}] {stats.total_time * 1000:.1f}ms: " + " | ".join(problems)
+        if Config.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(summary)
+        logger.warning(summary)
+
+
+def query_budget(name: Optional[str] = None, budget: Optional[int] = None):
+    """Decorator لدالة غير متزامنة (معالج أو مهمة)"""
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_queries(label, budget):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def update_label(update) -> str:
+    """اسم مختصر لتحديث تيليجرام لتجميع الإحصائيات حسب المعالج"""
+    if update.callback_query and update.callback_query.data:
+        # بدون المعرفات والمؤشرات في نهاية callback_data
+        parts = []
+        for part in update.callback_query.data.split("_"):
+            if any(ch.isdigit() for ch in part) or part in ("n", "p"):
+                break
+            parts.append(part)
+        return "callback:" + ("_".join(parts) or "?")
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        return "command:" + update.message.text.split()[0].split("@")[0]
+    if update.message:
+        return "message"
+    return "update"
+
+
+def install_http_middleware(app):
+    """تتبع استعلامات كل طلب في تطبيق FastAPI"""
+    @app.middleware("http")
+    async def _track_request_queries(request, call_next):
+        with track_queries(f"{request.method} {request.url.path}") as stats:
+            response = await call_next(request)
+            # قالب المسار بعد التوجيه حتى لا تتفرق الإحصائيات حسب المعرفات
+            route = request.scope.get("route")
+            if stats is not None and route is not None:
+                stats.name = f"{request.method} {route.path}"
+            return response
+
+
+# ========== عد العبارات ==========
+# على صنف Engine لتشمل كل المحركات (المتزامنة، وsync_engine للمحركات غير المتزامنة)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_budget_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get("query_budget_start")
+    if stats is None or not starts:
+        return
+    stats.record(statement, time.perf_counter() - starts.pop())
@@ -0,0 +1,203 @@
+"""
+توجيه القراءة إلى نسخة القراءة (read replica)
+
+شاشات العرض والتقارير تقرأ من النسخة، وكل ما يغير الأرصدة يبقى على AsyncSessionLocal.
+حماية التأخر (staleness guard):
+- المستخدم الذي كتب حديثاً يقرأ من الأساسية فيرى عمليته، أياً كانت العملية التي كتبت
+  (البوت، SMS webhook، عمال الأقسام، نسخ الـ Webhook): بعد commit يُكتب مفتاح rw:user:<id>
+  في Redis بمهلة max(REPLICA_READ_YOUR_WRITES_SECONDS, REPLICA_MAX_LAG_SECONDS)، مع نسخة
+  محلية تغني عن Redis لكتابات نفس العملية. إذا تعذر Redis تذهب القراءات للأساسية.
+- إذا تجاوز تأخر النسخة REPLICA_MAX_LAG_SECONDS أو تعذر قياسه، تذهب كل القراءات للأساسية.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from database.models import (
+    AsyncSessionLocal, AsyncReadSessionLocal, async_replica_engine, User
+)
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ENABLED = bool(Config.DATABASE_REPLICA_URL)
+
+# users.id -> وقت آخر كتابة في هذه العملية (time.monotonic)
+_recent_writes: Dict[int, float] = {}
+
+_WRITE_KEY = "rw:user:{}"
+_redis = None
+_redis_down_until = 0.0
+
+_lag_checked_at = 0.0
+_replica_healthy = False
+
+
+def _write_window() -> float:
+    return max(Config.REPLICA_READ_YOUR_WRITES_SECONDS, Config.REPLICA_MAX_LAG_SECONDS)
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        from redis.asyncio import Redis
+
+        _redis = Redis.from_url(
+            Config.REDIS_URL,
+            socket_timeout=Config.REPLICA_REDIS_TIMEOUT,
+            socket_connect_timeout=Config.REPLICA_REDIS_TIMEOUT
+        )
+    return _redis
+
+
+def _redis_failed(e: Exception):
+    global _redis_down_until
+    if time.monotonic() >= _redis_down_until:
+        logger.warning(f"⚠️ تعذر Redis لتتبع الكتابات - القراءة من الأساسية لمدة 30 ثانية: {e}")
+    _redis_down_until = time.monotonic() + 30
+
+
+async def _publish_writes(user_ids: Iterable[int]):
+    """نشر الكتابات لباقي العمليات"""
+    if time.monotonic() < _redis_down_until:
+        return
+    window_ms = int(_write_window() * 1000)
+    try:
+        async with _client().pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.set(_WRITE_KEY.format(user_id), 1, px=window_ms)
+            await pipe.execute()
+    except Exception as e:
+        _redis_failed(e)
+
+
+def mark_user_written(*user_ids: int):
+    """تسجيل كتابة لمستخدمين حتى تُقرأ بياناتهم من الأساسية لفترة قصيرة (في كل العمليات)"""
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if not REPLICA_ENABLED or not user_ids:
+        return
+
+    now = time.monotonic()
+    for user_id in user_ids:
+        _recent_writes[user_id] = now
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # سكربتات متزامنة: حماية التأخر وحدها تغطي قراءات العمليات الأخرى
+        loop = None
+    if loop is not None:
+        loop.create_task(_publish_writes(user_ids))
+
+    # تنظيف القيم المنتهية حتى لا يكبر القاموس
+    if len(_recent_writes) > 10000:
+        cutoff = now - _write_window()
+        for key in [k for k, v in _recent_writes.items() if v < cutoff]:
+            _recent_writes.pop(key, None)
+
+
+def mark_user_write_pending(db: AsyncSession, user_id: int):
+    """تسجيل كتابة لا تمر عبر ORM (مثل UPDATE ... RETURNING) - تُعتمد بعد commit"""
+    if REPLICA_ENABLED and user_id is not None:
+        db.info.setdefault("written_user_ids", set()).add(user_id)
+
+
+async def written_recently(user_id: Optional[int]) -> bool:
+    """هل كتب المستخدم حديثاً في هذه العملية أو غيرها"""
+    if user_id is None:
+        return False
+    written_at = _recent_writes.get(user_id)
+    if written_at is not None and time.monotonic() - written_at < _write_window():
+        return True
+    if time.monotonic() < _redis_down_until:
+        return True
+    try:
+        return bool(await _client().exists(_WRITE_KEY.format(user_id)))
+    except Exception as e:
+        _redis_failed(e)
+        return True
+
+
+async def close():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+
+async def _replica_is_fresh() -> bool:
+    """قياس تأخر النسخة (مخزن مؤقتاً لـ REPLICA_LAG_CHECK_INTERVAL ثانية)"""
+    global _lag_checked_at, _replica_healthy
+
+    now = time.monotonic()
+    if now - _lag_checked_at < Config.REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_healthy
+
+    _lag_checked_at = now
+    try:
+        async with async_replica_engine.connect() as conn:
+            # 0 إذا طبقت النسخة كل ما استلمته (تجنب تأخر وهمي عند خمول الأساسية)
+            lag = await conn.scalar(text(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+            ))
+        _replica_healthy = lag is not None and float(lag) <= Config.REPLICA_MAX_LAG_SECONDS
+        if not _replica_healthy:
+            logger.warning(f"⚠️ تأخر نسخة القراءة {lag} ثانية - القراءة من الأساسية")
+    except Exception as e:
+        _replica_healthy = False
+        logger.error(f"❌ تعذر فحص نسخة القراءة: {e}")
+
+    return _replica_healthy
+
+
+async def read_session(user_id: Optional[int] = None) -> AsyncSession:
+    """جلسة لشاشات القراءة فقط - لا تستخدمها لتعديل البيانات"""
+    if not REPLICA_ENABLED or await written_recently(user_id) or not await _replica_is_fresh():
+        return AsyncSessionLocal()
+    return AsyncReadSessionLocal()
+
+
+async def get_async_read_db():
+    """Dependency لـ FastAPI لنقاط القراءة فقط"""
+    db = await read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+# ========== تتبع الكتابات ==========
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_users(session, flush_context):
+    """جمع المستخدمين الذين تغيرت بياناتهم في هذه الجلسة"""
+    if not REPLICA_ENABLED:
+        return
+
+    written = session.info.setdefault("written_user_ids", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            written.add(obj.id)
+        else:
+            for attribute in ("user_id", "sender_id", "receiver_id", "referrer_id", "referred_user_id"):
+                value = getattr(obj, attribute, None)
+                if value is not None:
+                    written.add(value)
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_written_users(session):
+    written = session.info.pop("written_user_ids", None)
+    if written:
+        mark_user_written(*written)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_written_users(session):
+    session.info.pop("written_user_ids", None)
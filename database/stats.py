@@ -0,0 +1,139 @@
+"""
+الملخصات التراكمية للمعاملات
+
+تُحدث في نفس معاملة قاعدة البيانات التي تكمل العملية (قبل commit)، فتقرأ الشاشات
+صفاً واحداً بدلاً من SUM/COUNT على كامل سجل المستخدم، وتقرأ التقارير من daily_stats
+بدلاً من مسح المعاملات.
+"""
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Transaction, UserStats, DailyStats
+
+# نوع المعاملة -> (عمود المجموع، عمود العدد)
+USER_STATS_COLUMNS = {
+    "deposit": ("deposits_total", "deposits_count"),
+    "withdraw": ("withdrawals_total", "withdrawals_count"),
+    "bonus": ("bonuses_total", None),
+    "gift": ("gifts_received_total", None),
+}
+
+
+def _insert(db: AsyncSession):
+    """INSERT يدعم ON CONFLICT حسب نوع قاعدة البيانات"""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
+
+
+async def _bump_user_stats(
+    db: AsyncSession,
+    user_id: int,
+    increments: Dict[str, float],
+    last_type: str,
+    last_amount: float,
+    last_at: datetime
+):
+    """إضافة القيم إلى صف المستخدم ذرياً (upsert) دون قراءته أولاً"""
+    table = UserStats.__table__
+    now = datetime.utcnow()
+
+    statement = _insert(db)(table).values(
+        user_id=user_id,
+        last_transaction_type=last_type,
+        last_transaction_amount=last_amount,
+        last_transaction_at=last_at,
+        updated_at=now,
+        **increments
+    )
+
+    updates = {column: table.c[column] + statement.excluded[column] for column in increments}
+    updates.update(
+        last_transaction_type=statement.excluded.last_transaction_type,
+        last_transaction_amount=statement.excluded.last_transaction_amount,
+        last_transaction_at=statement.excluded.last_transaction_at,
+        updated_at=now
+    )
+
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_=updates
+    ))
+
+
+async def _bump_daily_stats(db: AsyncSession, transaction: Transaction, increments: Dict[str, float]):
+    """إضافة المعاملة إلى تجميع يوم إنهائها"""
+    table = DailyStats.__table__
+    now = datetime.utcnow()
+
+    statement = _insert(db)(table).values(
+        day=(transaction.completed_at or now).date(),
+        payment_method=transaction.payment_method or "unknown",
+        transaction_type=transaction.transaction_type,
+        updated_at=now,
+        **increments
+    )
+
+    updates = {column: table.c[column] + statement.excluded[column] for column in increments}
+    updates["updated_at"] = now
+
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.payment_method, table.c.transaction_type],
+        set_=updates
+    ))
+
+
+async def record_transaction_completed(db: AsyncSession, transaction: Transaction):
+    """تسجيل معاملة مكتملة في الملخصات - يُستدعى قبل commit"""
+    total_column, count_column = USER_STATS_COLUMNS.get(transaction.transaction_type, (None, None))
+
+    increments = {}
+    if total_column:
+        increments[total_column] = transaction.amount
+    if count_column:
+        increments[count_column] = 1
+
+    await _bump_user_stats(
+        db,
+        transaction.user_id,
+        increments,
+        transaction.transaction_type,
+        transaction.amount,
+        transaction.completed_at or datetime.utcnow()
+    )
+
+    # صف اليوم مشترك بين كل المعاملات، لذا يُحدث أخيراً ليبقى قفله أقصر ما يمكن
+    await _bump_daily_stats(db, transaction, {
+        "completed_count": 1,
+        "completed_amount": transaction.amount,
+        "completed_fee": transaction.fee or 0
+    })
+
+
+async def record_transaction_rejected(db: AsyncSession, transaction: Transaction):
+    """تسجيل معاملة مرفوضة في التجميع اليومي (لحساب معدل النجاح) - يُستدعى قبل commit"""
+    await _bump_daily_stats(db, transaction, {
+        "rejected_count": 1,
+        "rejected_amount": transaction.amount
+    })
+
+
+async def record_gift(
+    db: AsyncSession,
+    sender_id: int,
+    receiver_id: int,
+    amount: float,
+    net_amount: float
+):
+    """تسجيل إهداء رصيد بين مستخدمين - يُستدعى قبل commit"""
+    now = datetime.utcnow()
+    rows = [
+        (sender_id, {"gifts_sent_total": amount}, "gift_sent", amount),
+        (receiver_id, {"gifts_received_total": net_amount}, "gift_received", net_amount),
+    ]
+    # ترتيب ثابت للأقفال حتى لا يتعارض إهداءان متعاكسان (deadlock)
+    for user_id, increments, last_type, last_amount in sorted(rows, key=lambda row: row[0]):
+        await _bump_user_stats(db, user_id, increments, last_type, last_amount, now)
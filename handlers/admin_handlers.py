@@ -3,28 +3,57 @@
 """
 import logging
 import asyncio
+import html
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import json
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc, asc, or_, and_
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select, func, or_, and_, String
 from sqlalchemy.exc import IntegrityError
 
 from database.models import (
-    SessionLocal, User, Transaction, Referral, 
+    AsyncSessionLocal, User, Transaction, Referral, 
     GiftCode, PaymentMethod, SyriatelCode, Bonus,
-    AdminLog, SystemLog, GiftTransaction
+    SystemLog, GiftTransaction, UserStats
 )
+from database.stats import record_transaction_completed, record_transaction_rejected
+from database.routing import read_session
+from utils.pagination import fetch_transactions_page, NEXT, PREV
 from config import Config
 from utils.security import SecurityUtils
 from utils.payments import payment_processor
-from webhook.ichancy_webhook import ichancy_webhook
+from utils.balance import balance_service
+from utils.log_sink import log_sink
+from utils.broadcast import broadcaster
+from utils.idempotency import new_operation_token, claim_operation, claim_transaction
+from utils.router import Router
 
 logger = logging.getLogger(__name__)
 
+# لوحة ثابتة تُبنى مرة واحدة
+ADMIN_PANEL_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("👥 إدارة المستخدمين", callback_data="admin_users"),
+        InlineKeyboardButton("💳 إدارة المعاملات", callback_data="admin_transactions")
+    ],
+    [
+        InlineKeyboardButton("⚙️ الإعدادات العامة", callback_data="admin_settings"),
+        InlineKeyboardButton("💰 إدارة الدفع", callback_data="admin_payments")
+    ],
+    [
+        InlineKeyboardButton("🎁 أكواد الهدايا", callback_data="admin_gift_codes"),
+        InlineKeyboardButton("👥 نظام الاحالات", callback_data="admin_referrals")
+    ],
+    [
+        InlineKeyboardButton("📊 التقارير والإحصائيات", callback_data="admin_reports"),
+        InlineKeyboardButton("📝 سجلات النظام", callback_data="admin_logs")
+    ],
+    [InlineKeyboardButton("🏠 الخروج للقائمة الرئيسية", callback_data="user_main_menu")]
+])
+
 class AdminHandlers:
     
     async def show_admin_panel(
@@ -38,35 +67,39 @@ class AdminHandlers:
             await update.message.reply_text("❌ ليس لديك صلاحية الدخول هنا")
             return
         
-        db = SessionLocal()
+        db = await read_session()
         try:
-            # إحصائيات سريعة
-            total_users = db.query(User).count()
-            active_today = db.query(User).filter(
-                User.updated_at >= datetime.utcnow() - timedelta(hours=24)
-            ).count()
-            
-            total_deposits = db.query(func.sum(Transaction.amount)).filter(
-                Transaction.transaction_type == "deposit",
-                Transaction.status == "completed",
-                Transaction.created_at >= datetime.utcnow() - timedelta(days=1)
-            ).scalar() or 0
-            
-            total_withdrawals = db.query(func.sum(Transaction.amount)).filter(
-                Transaction.transaction_type == "withdraw",
+            # إحصائيات سريعة - استعلامان مجمعان بدلاً من ستة
+            since = datetime.utcnow() - timedelta(hours=24)
+            total_users, active_today = (await db.execute(select(
+                func.count(User.id),
+                func.count(User.id).filter(User.updated_at >= since)
+            ))).one()
+            
+            completed_today = and_(
                 Transaction.status == "completed",
                 Transaction.created_at >= datetime.utcnow() - timedelta(days=1)
-            ).scalar() or 0
+            )
+            totals = (await db.execute(select(
+                func.sum(Transaction.amount).filter(
+                    Transaction.transaction_type == "deposit", completed_today
+                ),
+                func.sum(Transaction.amount).filter(
+                    Transaction.transaction_type == "withdraw", completed_today
+                ),
+                func.count(Transaction.id).filter(
+                    Transaction.transaction_type == "deposit", Transaction.status == "pending"
+                ),
+                func.count(Transaction.id).filter(
+                    Transaction.transaction_type == "withdraw", Transaction.status == "pending"
+                )
+            ).where(
+                or_(Transaction.status == "pending", completed_today)
+            ))).one()
             
-            pending_deposits = db.query(Transaction).filter(
-                Transaction.transaction_type == "deposit",
-                Transaction.status == "pending"
-            ).count()
-            
-            pending_withdrawals = db.query(Transaction).filter(
-                Transaction.transaction_type == "withdraw",
-                Transaction.status == "pending"
-            ).count()
+            total_deposits, total_withdrawals, pending_deposits, pending_withdrawals = totals
+            total_deposits = total_deposits or 0
+            total_withdrawals = total_withdrawals or 0
             
             message = f"""
 🛡️ <b>لوحة تحكم الإدمن</b>
@@ -85,27 +118,7 @@ class AdminHandlers:
 🔽 <b>اختر من القائمة:</b>
             """
             
-            keyboard = [
-                [
-                    InlineKeyboardButton("👥 إدارة المستخدمين", callback_data="admin_users"),
-                    InlineKeyboardButton("💳 إدارة المعاملات", callback_data="admin_transactions")
-                ],
-                [
-                    InlineKeyboardButton("⚙️ الإعدادات العامة", callback_data="admin_settings"),
-                    InlineKeyboardButton("💰 إدارة الدفع", callback_data="admin_payments")
-                ],
-                [
-                    InlineKeyboardButton("🎁 أكواد الهدايا", callback_data="admin_gift_codes"),
-                    InlineKeyboardButton("👥 نظام الاحالات", callback_data="admin_referrals")
-                ],
-                [
-                    InlineKeyboardButton("📊 التقارير والإحصائيات", callback_data="admin_reports"),
-                    InlineKeyboardButton("📝 سجلات النظام", callback_data="admin_logs")
-                ],
-                [InlineKeyboardButton("🏠 الخروج للقائمة الرئيسية", callback_data="user_main_menu")]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ADMIN_PANEL_KEYBOARD
             
             if update.callback_query:
                 await update.callback_query.message.edit_text(
@@ -131,11 +144,11 @@ class AdminHandlers:
             logger.error(f"خطأ في show_admin_panel: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض لوحة التحكم")
         finally:
-            db.close()
+            await db.close()
     
     async def show_user_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """إدارة المستخدمين"""
-        db = SessionLocal()
+        db = await read_session()
         try:
             message = """
 👥 <b>إدارة المستخدمين</b>
@@ -197,7 +210,7 @@ class AdminHandlers:
             logger.error(f"خطأ في show_user_management: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض إدارة المستخدمين")
         finally:
-            db.close()
+            await db.close()
     
     async def search_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """البحث عن مستخدم"""
@@ -227,19 +240,19 @@ class AdminHandlers:
         search_term: str
     ):
         """معالجة بحث المستخدم"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
             # البحث بعدة طرق
-            users = db.query(User).filter(
+            users = (await db.scalars(select(User).where(
                 or_(
-                    User.telegram_id.cast(db.String).like(f"%{search_term}%"),
+                    User.telegram_id.cast(String).like(f"%{search_term}%"),
                     User.username.ilike(f"%{search_term}%"),
                     User.first_name.ilike(f"%{search_term}%"),
                     User.last_name.ilike(f"%{search_term}%"),
                     User.ichancy_account_id.ilike(f"%{search_term}%"),
                     User.referral_code.ilike(f"%{search_term}%")
                 )
-            ).limit(20).all()
+            ).limit(20))).all()
             
             if not users:
                 await update.message.reply_text(
@@ -285,7 +298,7 @@ class AdminHandlers:
             logger.error(f"خطأ في process_user_search: {e}")
             await update.message.reply_text("❌ حدث خطأ في البحث")
         finally:
-            db.close()
+            await db.close()
             context.user_data.pop('admin_action', None)
             context.user_data.pop('awaiting_input', None)
     
@@ -296,39 +309,28 @@ class AdminHandlers:
         user: User
     ):
         """عرض تفاصيل مستخدم"""
-        db = SessionLocal()
+        db = await read_session(user.id)
         try:
-            # إحصائيات المستخدم
-            total_deposits = db.query(func.sum(Transaction.amount)).filter(
-                Transaction.user_id == user.id,
-                Transaction.transaction_type == "deposit",
-                Transaction.status == "completed"
-            ).scalar() or 0
-            
-            total_withdrawals = db.query(func.sum(Transaction.amount)).filter(
-                Transaction.user_id == user.id,
-                Transaction.transaction_type == "withdraw",
-                Transaction.status == "completed"
-            ).scalar() or 0
+            # إحصائيات المستخدم (صف واحد من الملخص التراكمي)
+            stats = await db.get(UserStats, user.id)
+            total_deposits = stats.deposits_total if stats else 0
+            total_withdrawals = stats.withdrawals_total if stats else 0
+            await balance_service.get_balance(db, user)
             
-            referrals_count = db.query(Referral).filter(
+            referrals_count = await db.scalar(select(func.count(Referral.id)).where(
                 Referral.referrer_id == user.id
-            ).count()
+            ))
             
-            active_referrals = db.query(Referral).filter(
+            active_referrals = await db.scalar(select(func.count(Referral.id)).where(
                 Referral.referrer_id == user.id,
                 Referral.is_active == True
-            ).count()
-            
-            # آخر معاملة
-            last_transaction = db.query(Transaction).filter(
-                Transaction.user_id == user.id
-            ).order_by(desc(Transaction.created_at)).first()
+            ))
             
+            # آخر معاملة مكتملة
             last_transaction_text = ""
-            if last_transaction:
-                icon = "💳" if last_transaction.transaction_type == "deposit" else "💰"
-                last_transaction_text = f"{icon} {last_transaction.amount:,.0f} ليرة - {last_transaction.created_at.strftime('%d/%m %H:%M')}"
+            if stats and stats.last_transaction_at:
+                icon = "💳" if stats.last_transaction_type == "deposit" else "💰"
+                last_transaction_text = f"{icon} {stats.last_transaction_amount:,.0f} ليرة - {stats.last_transaction_at.strftime('%d/%m %H:%M')}"
             
             message = f"""
 👤 <b>تفاصيل المستخدم</b>
@@ -403,20 +405,22 @@ class AdminHandlers:
             logger.error(f"خطأ في show_user_details: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض تفاصيل المستخدم")
         finally:
-            db.close()
+            await db.close()
     
     async def add_user_balance(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
         """إضافة رصيد لمستخدم"""
         context.user_data['admin_action'] = 'add_balance'
         context.user_data['target_user_id'] = user_id
         context.user_data['awaiting_input'] = True
+        new_operation_token(context.user_data, "add_balance")
         
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
-            user = db.query(User).filter(User.id == user_id).first()
+            user = await db.get(User, user_id)
             if not user:
                 await update.callback_query.answer("❌ المستخدم غير موجود")
                 return
+            await balance_service.get_balance(db, user)
             
             keyboard = [[InlineKeyboardButton("🔙 إلغاء", callback_data=f"admin_user_details_{user_id}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -435,7 +439,7 @@ class AdminHandlers:
             logger.error(f"خطأ في add_user_balance: {e}")
             await update.callback_query.answer("❌ حدث خطأ")
         finally:
-            db.close()
+            await db.close()
     
     async def process_add_balance(
         self, 
@@ -445,14 +449,14 @@ class AdminHandlers:
         amount: float
     ):
         """معالجة إضافة الرصيد"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
             user_id = context.user_data.get('target_user_id')
             if not user_id:
                 await update.message.reply_text("❌ لم يتم تحديد مستخدم!")
                 return
             
-            user = db.query(User).filter(User.id == user_id).first()
+            user = await db.get(User, user_id)
             if not user:
                 await update.message.reply_text("❌ المستخدم غير موجود!")
                 return
@@ -461,10 +465,11 @@ class AdminHandlers:
                 await update.message.reply_text("❌ المبلغ يجب أن يكون أكبر من الصفر!")
                 return
             
-            # إضافة الرصيد
-            old_balance = user.balance
-            user.balance += amount
-            user.updated_at = datetime.utcnow()
+            # إرسال المبلغ مرتين لا يضيف الرصيد مرتين
+            token = context.user_data.get('add_balance_token') or f"{user_id}:{update.message.message_id}"
+            if not await claim_operation(db, f"admin_add:{token}", admin_user.telegram_id):
+                await update.message.reply_text("⚠️ تمت إضافة هذا الرصيد مسبقاً")
+                return
             
             # تسجيل المعاملة
             transaction = Transaction(
@@ -483,7 +488,14 @@ class AdminHandlers:
             )
             
             db.add(transaction)
-            db.commit()
+            await db.flush()
+            
+            # إضافة الرصيد
+            new_balance = await balance_service.credit(db, user.id, amount, "admin_add", transaction)
+            old_balance = new_balance - amount
+            
+            await record_transaction_completed(db, transaction)
+            await db.commit()
             
             # إشعار المستخدم
             await self.notify_user_balance_added(context, user, amount, old_balance)
@@ -516,40 +528,131 @@ class AdminHandlers:
             context.user_data.pop('admin_action', None)
             context.user_data.pop('target_user_id', None)
             context.user_data.pop('awaiting_input', None)
+            context.user_data.pop('add_balance_token', None)
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في process_add_balance: {e}")
             await update.message.reply_text("❌ حدث خطأ في إضافة الرصيد")
         finally:
-            db.close()
+            await db.close()
+    
+    async def ask_broadcast_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """طلب نص الرسالة الجماعية"""
+        context.user_data['admin_action'] = 'broadcast_text'
+        context.user_data['awaiting_input'] = True
+        
+        keyboard = [[InlineKeyboardButton("🔙 إلغاء", callback_data="admin_users")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.callback_query.message.edit_text(
+            "📨 <b>رسالة لكل المستخدمين</b>\n\n"
+            "📝 <b>أرسل نص الرسالة:</b>\n"
+            "<i>ستظهر معاينة قبل الإرسال</i>",
+            parse_mode='HTML',
+            reply_markup=reply_markup
+        )
+    
+    async def preview_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+        """معاينة الرسالة الجماعية وعدد المستلمين قبل التأكيد"""
+        db = AsyncSessionLocal()
+        try:
+            recipients = await broadcaster.count_recipients(db)
+            context.user_data['broadcast_text'] = text
+            context.user_data.pop('admin_action', None)
+            context.user_data.pop('awaiting_input', None)
+            
+            keyboard = [
+                [InlineKeyboardButton("✅ إرسال", callback_data="admin_broadcast_confirm")],
+                [InlineKeyboardButton("🔙 إلغاء", callback_data="admin_users")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await update.message.reply_text(
+                f"📨 <b>معاينة الرسالة الجماعية</b>\n\n"
+                f"👥 <b>المستلمون:</b> {recipients:,}\n"
+                f"⏱️ <b>المدة التقريبية:</b> {recipients / Config.SEND_GLOBAL_RATE / 60:,.0f} دقيقة\n\n"
+                f"{html.escape(text)}",
+                parse_mode='HTML',
+                reply_markup=reply_markup
+            )
+        finally:
+            await db.close()
+    
+    async def start_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_user: User):
+        """بدء إرسال الرسالة الجماعية بعد التأكيد"""
+        text = context.user_data.pop('broadcast_text', None)
+        if not text:
+            await update.callback_query.answer("❌ انتهت صلاحية المعاينة")
+            return
+        
+        broadcast = await broadcaster.create(admin_user.id, text)
+        broadcaster.start(context.bot, broadcast.id)
+        
+        await self.log_admin_action(
+            admin_user.id,
+            "broadcast",
+            {"broadcast_id": broadcast.id, "total": broadcast.total}
+        )
+        await self.show_broadcast_status(update, context, broadcast.id)
+    
+    async def show_broadcast_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE, broadcast_id: int):
+        """تقدم الرسالة الجماعية"""
+        progress = await broadcaster.progress(broadcast_id)
+        if progress is None:
+            await update.callback_query.answer("❌ الرسالة غير موجودة")
+            return
+        
+        status_names = {"running": "🔄 قيد الإرسال", "completed": "✅ مكتملة", "canceled": "⛔ ملغاة"}
+        keyboard = []
+        if progress['status'] == 'running':
+            keyboard.append([
+                InlineKeyboardButton("🔄 تحديث", callback_data=f"admin_broadcast_status_{broadcast_id}"),
+                InlineKeyboardButton("⛔ إيقاف", callback_data=f"admin_broadcast_cancel_{broadcast_id}")
+            ])
+        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_users")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        eta = f"{progress['eta_seconds'] // 60} دقيقة" if progress['eta_seconds'] is not None else "-"
+        await update.callback_query.message.edit_text(
+            f"📨 <b>الرسالة الجماعية #{broadcast_id}</b>\n\n"
+            f"📌 <b>الحالة:</b> {status_names.get(progress['status'], progress['status'])}\n"
+            f"📊 <b>التقدم:</b> {progress['processed']:,} / {progress['total']:,}\n"
+            f"• تم الإرسال: {progress['sent']:,}\n"
+            f"• حظروا البوت: {progress['blocked']:,}\n"
+            f"• فشل: {progress['failed']:,}\n"
+            f"⚡ <b>المعدل:</b> {progress['rate']} رسالة/ثانية\n"
+            f"⏱️ <b>المتبقي:</b> {eta}",
+            parse_mode='HTML',
+            reply_markup=reply_markup
+        )
     
     async def show_transaction_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """إدارة المعاملات"""
-        db = SessionLocal()
+        db = await read_session()
         try:
             # إحصائيات سريعة
-            pending_deposits = db.query(Transaction).filter(
+            pending_deposits = await db.scalar(select(func.count(Transaction.id)).where(
                 Transaction.transaction_type == "deposit",
                 Transaction.status == "pending"
-            ).count()
+            ))
             
-            pending_withdrawals = db.query(Transaction).filter(
+            pending_withdrawals = await db.scalar(select(func.count(Transaction.id)).where(
                 Transaction.transaction_type == "withdraw",
                 Transaction.status == "pending"
-            ).count()
+            ))
             
-            today_deposits = db.query(func.sum(Transaction.amount)).filter(
+            today_deposits = await db.scalar(select(func.sum(Transaction.amount)).where(
                 Transaction.transaction_type == "deposit",
                 Transaction.status == "completed",
                 Transaction.created_at >= datetime.utcnow().date()
-            ).scalar() or 0
+            )) or 0
             
-            today_withdrawals = db.query(func.sum(Transaction.amount)).filter(
+            today_withdrawals = await db.scalar(select(func.sum(Transaction.amount)).where(
                 Transaction.transaction_type == "withdraw",
                 Transaction.status == "completed",
                 Transaction.created_at >= datetime.utcnow().date()
-            ).scalar() or 0
+            )) or 0
             
             message = f"""
 💳 <b>إدارة المعاملات</b>
@@ -599,20 +702,36 @@ class AdminHandlers:
             logger.error(f"خطأ في show_transaction_management: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض إدارة المعاملات")
         finally:
-            db.close()
+            await db.close()
     
-    async def show_pending_deposits(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_pending_deposits(
+        self, 
+        update: Update, 
+        context: ContextTypes.DEFAULT_TYPE,
+        direction: str = NEXT,
+        cursor: str = None
+    ):
         """عرض طلبات الإيداع المعلقة"""
-        db = SessionLocal()
+        db = await read_session()
         try:
-            deposits = db.query(Transaction).filter(
-                Transaction.transaction_type == "deposit",
-                Transaction.status == "pending"
-            ).options(joinedload(Transaction.user)).order_by(
-                asc(Transaction.created_at)
-            ).limit(50).all()
+            page = await fetch_transactions_page(
+                db,
+                select(Transaction).where(
+                    Transaction.transaction_type == "deposit",
+                    Transaction.status == "pending"
+                ).options(joinedload(Transaction.user)),
+                cursor=cursor,
+                direction=direction,
+                page_size=50,
+                newest_first=False
+            )
+            deposits = page.items
             
             if not deposits:
+                if context.user_data.get('admin_action') == 'awaiting_deposit_action':
+                    context.user_data.pop('pending_deposits', None)
+                    context.user_data.pop('admin_action', None)
+                    context.user_data.pop('awaiting_input', None)
                 await update.callback_query.message.edit_text(
                     "✅ <b>لا توجد طلبات إيداع معلقة</b>\n\n"
                     "جميع طلبات الإيداع تمت معالجتها.",
@@ -645,16 +764,30 @@ class AdminHandlers:
 مثال: "1 ✅" أو "2 ❌"
 
 💡 <b>معلومات:</b>
-• يتم عرض آخر 50 طلب فقط
+• 50 طلب في كل صفحة
 • الطلبات مرتبة من الأقدم للأحدث
             """
             
             context.user_data['pending_deposits'] = {
                 str(i): deposit.id for i, deposit in enumerate(deposits, 1)
             }
-            context.user_data['awaiting_deposit_action'] = True
-            
-            keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_transactions")]]
+            # النص "1 ✅" يصل إلى process_admin_input عبر بوابة awaiting_input في main_bot
+            context.user_data['admin_action'] = 'awaiting_deposit_action'
+            context.user_data['awaiting_input'] = True
+            
+            keyboard = []
+            navigation = []
+            if page.prev_cursor:
+                navigation.append(InlineKeyboardButton(
+                    "⬅️ السابق", callback_data=f"admin_pending_deposits_{PREV}_{page.prev_cursor}"
+                ))
+            if page.next_cursor:
+                navigation.append(InlineKeyboardButton(
+                    "التالي ➡️", callback_data=f"admin_pending_deposits_{NEXT}_{page.next_cursor}"
+                ))
+            if navigation:
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_transactions")])
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await update.callback_query.message.edit_text(
@@ -667,7 +800,7 @@ class AdminHandlers:
             logger.error(f"خطأ في show_pending_deposits: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض طلبات الإيداع")
         finally:
-            db.close()
+            await db.close()
     
     async def process_deposit_action(
         self,
@@ -697,26 +830,31 @@ class AdminHandlers:
             
             deposit_id = deposits_map[deposit_num]
             
-            db = SessionLocal()
+            db = AsyncSessionLocal()
             try:
-                deposit = db.query(Transaction).filter(Transaction.id == deposit_id).first()
+                deposit = await db.scalar(select(Transaction).where(
+                    Transaction.id == deposit_id
+                ).options(joinedload(Transaction.user)))
                 if not deposit or deposit.status != "pending":
                     await update.message.reply_text("❌ الطلب غير موجود أو تمت معالجته مسبقاً")
                     return
                 
                 user = deposit.user
                 
+                # الحالة تتغير ذرياً: إدمن آخر أو SMS قد يعالج نفس الطلب الآن
+                new_status = "completed" if action == "✅" else "rejected"
+                if not await claim_transaction(
+                    db, deposit, new_status, admin_id=admin_user.id, completed_at=datetime.utcnow()
+                ):
+                    await update.message.reply_text("❌ الطلب غير موجود أو تمت معالجته مسبقاً")
+                    return
+                
                 if action == "✅":
-                    # تأكيد الطلب
-                    deposit.status = "completed"
-                    deposit.admin_id = admin_user.id
-                    deposit.completed_at = datetime.utcnow()
+                    # تأكيد الطلب: تحديث رصيد المستخدم
+                    await balance_service.credit(db, user.id, deposit.net_amount, "deposit", deposit)
                     
-                    # تحديث رصيد المستخدم
-                    user.balance += deposit.net_amount
-                    user.updated_at = datetime.utcnow()
-                    
-                    db.commit()
+                    await record_transaction_completed(db, deposit)
+                    await db.commit()
                     
                     # إشعار المستخدم
                     await self.notify_user_deposit_confirmed(context, user, deposit)
@@ -744,11 +882,8 @@ class AdminHandlers:
                     
                 else:  # ❌
                     # رفض الطلب
-                    deposit.status = "rejected"
-                    deposit.admin_id = admin_user.id
-                    deposit.completed_at = datetime.utcnow()
-                    
-                    db.commit()
+                    await record_transaction_rejected(db, deposit)
+                    await db.commit()
                     
                     # إشعار المستخدم
                     await self.notify_user_deposit_rejected(context, user, deposit)
@@ -774,10 +909,11 @@ class AdminHandlers:
                 
                 # تنظيف البيانات
                 context.user_data.pop('pending_deposits', None)
-                context.user_data.pop('awaiting_deposit_action', None)
+                context.user_data.pop('admin_action', None)
+                context.user_data.pop('awaiting_input', None)
                 
             finally:
-                db.close()
+                await db.close()
                 
         except Exception as e:
             logger.error(f"خطأ في process_deposit_action: {e}")
@@ -841,26 +977,31 @@ class AdminHandlers:
     
     async def show_payment_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """إدارة الدفع"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
-            payment_methods = db.query(PaymentMethod).order_by(PaymentMethod.id).all()
+            payment_methods = (await db.scalars(select(PaymentMethod).order_by(PaymentMethod.id))).all()
             
             methods_text = ""
             for method in payment_methods:
                 status = "✅" if method.is_active else "❌"
                 methods_text += f"{status} <b>{method.display_name}</b> ({method.name})\n"
             
-            syriatel_codes = db.query(SyriatelCode).filter(
+            syriatel_codes = await db.scalar(select(func.count(SyriatelCode.id)).where(
                 SyriatelCode.is_active == True
-            ).count()
+            ))
             
-            total_syriatel_balance = db.query(func.sum(SyriatelCode.current_balance)).filter(
+            total_syriatel_balance = await db.scalar(select(func.sum(SyriatelCode.current_balance)).where(
                 SyriatelCode.is_active == True
-            ).scalar() or 0
+            )) or 0
             
-            total_syriatel_capacity = db.query(func.sum(SyriatelCode.max_balance)).filter(
+            total_syriatel_capacity = await db.scalar(select(func.sum(SyriatelCode.max_balance)).where(
                 SyriatelCode.is_active == True
-            ).scalar() or 0
+            )) or 0
+            
+            # طلبات شحن عُرض فيها الكود ولم يصل تحويلها بعد
+            total_syriatel_reserved = await db.scalar(select(func.sum(SyriatelCode.reserved_balance)).where(
+                SyriatelCode.is_active == True
+            )) or 0
             
             message = f"""
 💰 <b>إدارة الدفع</b>
@@ -871,8 +1012,9 @@ class AdminHandlers:
 📱 <b>سيرياتيل كاش:</b>
 • عدد الأكواد النشطة: <b>{syriatel_codes}</b>
 • إجمالي الرصيد المستخدم: <b>{total_syriatel_balance:,.0f}</b> ليرة
+• المحجوز لطلبات جارية: <b>{total_syriatel_reserved:,.0f}</b> ليرة
 • السعة الإجمالية: <b>{total_syriatel_capacity:,.0f}</b> ليرة
-• السعة المتبقية: <b>{(total_syriatel_capacity - total_syriatel_balance):,.0f}</b> ليرة
+• السعة المتبقية: <b>{(total_syriatel_capacity - total_syriatel_balance - total_syriatel_reserved):,.0f}</b> ليرة
 
 🔽 <b>اختر من القائمة:</b>
             """
@@ -912,52 +1054,51 @@ class AdminHandlers:
             logger.error(f"خطأ في show_payment_management: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض إدارة الدفع")
         finally:
-            db.close()
+            await db.close()
     
-    async def handle_admin_callback(
-        self,
-        update: Update,
-        context: ContextTypes.DEFAULT_TYPE,
-        query_data: str,
-        admin_user: User
-    ):
-        """معالجة استعلامات الإدمن"""
-        try:
-            if query_data == "admin_panel":
-                await self.show_admin_panel(update, context, admin_user)
-            elif query_data == "admin_users":
-                await self.show_user_management(update, context)
-            elif query_data == "admin_transactions":
-                await self.show_transaction_management(update, context)
-            elif query_data == "admin_settings":
-                await self.show_settings_management(update, context)
-            elif query_data == "admin_payments":
-                await self.show_payment_management(update, context)
-            elif query_data == "admin_gift_codes":
-                await self.show_gift_codes_management(update, context)
-            elif query_data == "admin_referrals":
-                await self.show_referral_management(update, context)
-            elif query_data == "admin_reports":
-                await self.show_reports_management(update, context)
-            elif query_data == "admin_logs":
-                await self.show_logs_management(update, context)
-            elif query_data == "admin_search_user":
-                await self.search_user(update, context)
-            elif query_data == "admin_pending_deposits":
-                await self.show_pending_deposits(update, context)
-            elif query_data.startswith("admin_addbal_"):
-                user_id = int(query_data.replace("admin_addbal_", ""))
-                await self.add_user_balance(update, context, user_id)
-            elif query_data == "user_main_menu":
-                from main_bot import IChancyBot
-                bot = IChancyBot()
-                await bot.show_main_menu(update, context, admin_user)
-            else:
-                await update.callback_query.answer("❌ الأمر غير معروف")
-                
-        except Exception as e:
-            logger.error(f"خطأ في handle_admin_callback: {e}")
-            await update.callback_query.answer("❌ حدث خطأ")
+    def register_routes(self, router: Router):
+        """تسجيل callbacks الإدمن في جدول التوجيه (admin_only)"""
+        def screen(method):
+            # شاشات لا تحتاج كائن الإدمن
+            async def handler(update, context, admin_user):
+                return await method(update, context)
+            return handler
+        
+        async def pending_deposits_page(update, context, admin_user, data):
+            # admin_pending_deposits_<n|p>_<cursor>
+            direction, cursor = data.replace("admin_pending_deposits_", "").split("_", 1)
+            await self.show_pending_deposits(update, context, direction, cursor)
+        
+        async def add_balance(update, context, admin_user, data):
+            await self.add_user_balance(update, context, int(data.replace("admin_addbal_", "")))
+        
+        router.callback("admin_panel", self.show_admin_panel, admin_only=True)
+        router.callback("admin_users", screen(self.show_user_management), admin_only=True)
+        router.callback("admin_transactions", screen(self.show_transaction_management), admin_only=True)
+        router.callback("admin_settings", screen(self.show_settings_management), admin_only=True)
+        router.callback("admin_payments", screen(self.show_payment_management), admin_only=True)
+        router.callback("admin_gift_codes", screen(self.show_gift_codes_management), admin_only=True)
+        router.callback("admin_referrals", screen(self.show_referral_management), admin_only=True)
+        router.callback("admin_reports", screen(self.show_reports_management), admin_only=True)
+        router.callback("admin_logs", screen(self.show_logs_management), admin_only=True)
+        router.callback("admin_search_user", screen(self.search_user), admin_only=True)
+        router.callback("admin_pending_deposits", screen(self.show_pending_deposits), admin_only=True)
+        router.callback_prefix("admin_pending_deposits_", pending_deposits_page, admin_only=True)
+        router.callback_prefix("admin_addbal_", add_balance, admin_only=True)
+        
+        async def broadcast_status(update, context, admin_user, data):
+            await self.show_broadcast_status(update, context, int(data.replace("admin_broadcast_status_", "")))
+        
+        async def broadcast_cancel(update, context, admin_user, data):
+            broadcast_id = int(data.replace("admin_broadcast_cancel_", ""))
+            if await broadcaster.cancel(broadcast_id):
+                await self.log_admin_action(admin_user.id, "broadcast_cancel", {"broadcast_id": broadcast_id})
+            await self.show_broadcast_status(update, context, broadcast_id)
+        
+        router.callback("admin_send_message", screen(self.ask_broadcast_text), admin_only=True)
+        router.callback("admin_broadcast_confirm", self.start_broadcast, admin_only=True)
+        router.callback_prefix("admin_broadcast_status_", broadcast_status, admin_only=True)
+        router.callback_prefix("admin_broadcast_cancel_", broadcast_cancel, admin_only=True)
     
     async def process_admin_input(
         self,
@@ -978,6 +1119,8 @@ class AdminHandlers:
                     await self.process_add_balance(update, context, admin_user, amount)
                 except ValueError:
                     await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
+            elif action == 'broadcast_text':
+                await self.preview_broadcast(update, context, text)
             elif action == 'awaiting_deposit_action':
                 await self.process_deposit_action(update, context, admin_user, text)
             elif 'awaiting_user_selection' in context.user_data:
@@ -999,13 +1142,13 @@ class AdminHandlers:
             
             user_id = users_map[selection]
             
-            db = SessionLocal()
+            db = AsyncSessionLocal()
             try:
-                user = db.query(User).filter(User.id == user_id).first()
+                user = await db.get(User, user_id)
                 if user:
                     await self.show_user_details(update, context, user)
             finally:
-                db.close()
+                await db.close()
             
             # تنظيف البيانات
             context.user_data.pop('search_results', None)
@@ -1113,21 +1256,11 @@ class AdminHandlers:
         action_type: str,
         details: Dict
     ):
-        """تسجيل إجراء الإدمن"""
-        db = SessionLocal()
+        """تسجيل إجراء الإدمن (يُكتب على دفعات عبر log_sink)"""
         try:
-            log = AdminLog(
-                admin_id=admin_id,
-                action_type=action_type,
-                details=details,
-                created_at=datetime.utcnow()
-            )
-            db.add(log)
-            db.commit()
+            log_sink.admin(admin_id, action_type, details)
         except Exception as e:
             logger.error(f"خطأ في log_admin_action: {e}")
-        finally:
-            db.close()
     
     async def send_error_message(self, update: Update, message: str):
         """إرسال رسالة خطأ"""
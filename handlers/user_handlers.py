@@ -9,17 +9,30 @@ from decimal import Decimal
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc, and_, or_
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select, func, desc, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models import (
-    SessionLocal, User, Transaction, Referral, 
-    GiftCode, GiftTransaction, PaymentMethod
+    AsyncSessionLocal, User, Transaction, Referral, 
+    GiftCode, GiftTransaction, PaymentMethod, UserStats
 )
+from database.routing import read_session
+from utils.pagination import fetch_transactions_page, NEXT, PREV
 from config import Config
 from utils.security import SecurityUtils
 from utils.payments import payment_processor
-from webhook.ichancy_webhook import ichancy_webhook
+from utils.balance import balance_service
+from utils.log_sink import log_sink
+from utils.router import Router
+from utils.send_queue import send_to_many, PRIORITY_ADMIN
+from utils.idempotency import new_operation_token
+from utils.keyboards import (
+    BTN_REFERRALS, BTN_GIFT_CODE, BTN_GIFT_BALANCE, BTN_CONTACT, BTN_SUPPORT,
+    BTN_HISTORY, BTN_TUTORIALS, BTN_BETS, BTN_SETTINGS
+)
+from webhook.ichancy_client import ichancy_webhook
+from utils.services import services
 
 logger = logging.getLogger(__name__)
 
@@ -32,23 +45,23 @@ class UserHandlers:
         user: User
     ):
         """عرض قائمة نظام الاحالات"""
-        db = SessionLocal()
+        db = await read_session(user.id)
         try:
             # حساب الإحالات
-            referrals = db.query(Referral).filter(
+            referrals = (await db.scalars(select(Referral).where(
                 Referral.referrer_id == user.id
-            ).all()
+            ))).all()
             
-            active_referrals = db.query(Referral).filter(
+            active_referrals = await db.scalar(select(func.count(Referral.id)).where(
                 Referral.referrer_id == user.id,
                 Referral.is_active == True
-            ).count()
+            ))
             
             # حساب إجمالي الحرق من الإحالات النشطة
-            total_burned = db.query(func.sum(Referral.total_burned)).filter(
+            total_burned = await db.scalar(select(func.sum(Referral.total_burned)).where(
                 Referral.referrer_id == user.id,
                 Referral.is_active == True
-            ).scalar() or 0
+            )) or 0
             
             # حساب المكافآت المستقبلية
             potential_bonus = total_burned * (Config.REFERRAL_BONUS_PERCENT / 100)
@@ -104,7 +117,7 @@ class UserHandlers:
             logger.error(f"خطأ في show_referral_menu: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض نظام الاحالات")
         finally:
-            db.close()
+            await db.close()
     
     async def ask_gift_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """طلب إدخال كود الهدية"""
@@ -124,7 +137,7 @@ class UserHandlers:
         code: str
     ):
         """معالجة كود الهدية"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
             success, message, amount = await payment_processor.process_gift_code(db, user.id, code)
             
@@ -147,7 +160,7 @@ class UserHandlers:
             logger.error(f"خطأ في process_gift_code: {e}")
             await update.message.reply_text("❌ حدث خطأ في معالجة الكود")
         finally:
-            db.close()
+            await db.close()
             context.user_data.pop('awaiting_gift_code', None)
     
     async def ask_gift_recipient(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
@@ -185,6 +198,7 @@ class UserHandlers:
             context.user_data['gift_recipient_id'] = telegram_id
             context.user_data.pop('awaiting_gift_recipient', None)
             context.user_data['awaiting_gift_amount'] = True
+            new_operation_token(context.user_data, "gift")
             
             await update.message.reply_text(
                 f"✅ <b>تم تحديد المستخدم المستقبل</b>\n\n"
@@ -207,21 +221,22 @@ class UserHandlers:
         amount: float
     ):
         """معالجة مبلغ الإهداء"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
             recipient_id = context.user_data.get('gift_recipient_id')
             if not recipient_id:
                 await update.message.reply_text("❌ لم يتم تحديد مستلم!")
                 return
             
-            # التحقق من الرصيد
-            if user.balance < amount:
+            # التحقق من الرصيد (الخصم نفسه يتحقق ذرياً)
+            if await balance_service.get_balance(db, user) < amount:
                 await update.message.reply_text("❌ رصيدك غير كافي!")
                 return
             
-            # معالجة الإهداء
+            # معالجة الإهداء (مرة واحدة لكل طلب مهما تكرر إرسال المبلغ)
+            token = context.user_data.get('gift_token') or f"{user.id}:{update.message.message_id}"
             success, message = await payment_processor.process_gift_balance(
-                db, user.id, recipient_id, amount
+                db, user.id, recipient_id, amount, operation_key=f"gift:{token}"
             )
             
             if success:
@@ -244,10 +259,11 @@ class UserHandlers:
             logger.error(f"خطأ في process_gift_amount: {e}")
             await update.message.reply_text("❌ حدث خطأ في معالجة الإهداء")
         finally:
-            db.close()
+            await db.close()
             # تنظيف البيانات المؤقتة
             context.user_data.pop('gift_recipient_id', None)
             context.user_data.pop('awaiting_gift_amount', None)
+            context.user_data.pop('gift_token', None)
     
     async def show_contact_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض معلومات التواصل"""
@@ -339,20 +355,13 @@ class UserHandlers:
                 parse_mode='HTML'
             )
             
-            # تسجيل في قاعدة البيانات
-            db = SessionLocal()
-            try:
-                from database.models import SystemLog
-                log = SystemLog(
-                    log_level="INFO",
-                    module="support",
-                    message=f"رسالة دعم من {user.telegram_id}",
-                    data={"message": message[:200]}
-                )
-                db.add(log)
-                db.commit()
-            finally:
-                db.close()
+            # تسجيل في قاعدة البيانات (على دفعات)
+            log_sink.system(
+                "INFO",
+                "support",
+                f"رسالة دعم من {user.telegram_id}",
+                {"message": message[:200]}
+            )
             
         except Exception as e:
             logger.error(f"خطأ في process_support_message: {e}")
@@ -362,7 +371,7 @@ class UserHandlers:
     
     async def show_transaction_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض سجل المعاملات"""
-        db = SessionLocal()
+        db = await read_session(user.id)
         try:
             keyboard = [
                 [
@@ -380,9 +389,13 @@ class UserHandlers:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # الحصول على أحدث المعاملات
-            recent = db.query(Transaction).filter(
+            recent = (await db.scalars(select(Transaction).where(
                 Transaction.user_id == user.id
-            ).order_by(desc(Transaction.created_at)).limit(5).all()
+            ).order_by(desc(Transaction.created_at)).limit(5))).all()
+            
+            total_deposits = await self._get_total_deposits(db, user.id)
+            total_withdrawals = await self._get_total_withdrawals(db, user.id)
+            await balance_service.get_balance(db, user)
             
             recent_text = ""
             for t in recent:
@@ -394,8 +407,8 @@ class UserHandlers:
 📋 <b>سجل المعاملات</b>
 
 💰 <b>رصيدك الحالي:</b> {user.balance:,.0f} ليرة
-📊 <b>إجمالي الإيداعات:</b> {self._get_total_deposits(db, user.id):,.0f} ليرة
-📊 <b>إجمالي السحوبات:</b> {self._get_total_withdrawals(db, user.id):,.0f} ليرة
+📊 <b>إجمالي الإيداعات:</b> {total_deposits:,.0f} ليرة
+📊 <b>إجمالي السحوبات:</b> {total_withdrawals:,.0f} ليرة
 
 🕐 <b>أحدث المعاملات:</b>
 {recent_text if recent_text else "لا توجد معاملات سابقة"}
@@ -413,7 +426,7 @@ class UserHandlers:
             logger.error(f"خطأ في show_transaction_history: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض السجل")
         finally:
-            db.close()
+            await db.close()
     
     async def show_tutorials(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض الشروحات"""
@@ -460,7 +473,7 @@ class UserHandlers:
     
     async def show_betting_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض سجل الرهانات"""
-        db = SessionLocal()
+        db = await read_session(user.id)
         try:
             if not user.ichancy_account_id:
                 await update.message.reply_text(
@@ -536,7 +549,7 @@ class UserHandlers:
             logger.error(f"خطأ في show_betting_history: {e}")
             await self.send_error_message(update, "حدث خطأ في عرض سجل الرهانات")
         finally:
-            db.close()
+            await db.close()
     
     async def show_settings_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض قائمة الإعدادات"""
@@ -574,36 +587,34 @@ class UserHandlers:
             reply_markup=reply_markup
         )
     
-    async def handle_callback_query(
-        self, 
-        update: Update, 
-        context: ContextTypes.DEFAULT_TYPE, 
-        query_data: str,
-        user: User
-    ):
-        """معالجة استعلامات Callback"""
-        try:
-            if query_data.startswith("history_"):
-                await self.handle_history_callback(update, context, query_data, user)
-            elif query_data.startswith("tutorial_"):
-                await self.handle_tutorial_callback(update, context, query_data)
-            elif query_data == "refresh_referrals":
-                await self.show_referral_menu(update, context, user)
-            elif query_data == "list_referrals":
-                await self.show_referral_list(update, context, user)
-            elif query_data == "refresh_bets":
-                await self.show_betting_history(update, context, user)
-            elif query_data == "cancel_support":
-                context.user_data.pop('awaiting_support_message', None)
-                await update.callback_query.message.edit_text("❌ تم إلغاء رسالة الدعم")
-            elif query_data == "main_menu":
-                await self.show_main_menu(update, context, user)
-            else:
-                await update.callback_query.answer("❌ الأمر غير معروف")
-                
-        except Exception as e:
-            logger.error(f"خطأ في handle_callback_query: {e}")
-            await update.callback_query.answer("❌ حدث خطأ")
+    def register_routes(self, router: Router):
+        """تسجيل أزرار القائمة و callbacks المستخدم في جدول التوجيه"""
+        router.text(BTN_REFERRALS, self.show_referral_menu)
+        router.text(BTN_GIFT_CODE, self.ask_gift_code)
+        router.text(BTN_GIFT_BALANCE, self.ask_gift_recipient)
+        router.text(BTN_CONTACT, self.show_contact_info)
+        router.text(BTN_SUPPORT, self.ask_support_message)
+        router.text(BTN_HISTORY, self.show_transaction_history)
+        router.text(BTN_TUTORIALS, self.show_tutorials)
+        router.text(BTN_BETS, self.show_betting_history)
+        router.text(BTN_SETTINGS, self.show_settings_menu)
+        
+        async def history(update, context, user, data):
+            await self.handle_history_callback(update, context, data, user)
+        
+        async def tutorial(update, context, user, data):
+            await self.handle_tutorial_callback(update, context, data)
+        
+        async def cancel_support(update, context, user):
+            context.user_data.pop('awaiting_support_message', None)
+            await update.callback_query.message.edit_text("❌ تم إلغاء رسالة الدعم")
+        
+        router.callback_prefix("history_", history)
+        router.callback_prefix("tutorial_", tutorial)
+        router.callback("refresh_referrals", self.show_referral_menu)
+        router.callback("list_referrals", self.show_referral_list)
+        router.callback("refresh_bets", self.show_betting_history)
+        router.callback("cancel_support", cancel_support)
     
     async def handle_history_callback(
         self, 
@@ -613,9 +624,12 @@ class UserHandlers:
         user: User
     ):
         """معالجة callback السجل"""
-        db = SessionLocal()
+        db = await read_session(user.id)
         try:
-            type_filter = query_data.replace("history_", "")
+            # history_<type> أو history_<type>_<n|p>_<cursor>
+            parts = query_data.replace("history_", "").split("_")
+            type_filter = parts[0]
+            direction, cursor = (parts[1], parts[2]) if len(parts) == 3 else (NEXT, None)
             
             filters = {"user_id": user.id}
             if type_filter != "all":
@@ -628,9 +642,14 @@ class UserHandlers:
                 elif type_filter == "bonuses":
                     filters["transaction_type"] = "bonus"
             
-            transactions = db.query(Transaction).filter_by(**filters).order_by(
-                desc(Transaction.created_at)
-            ).limit(20).all()
+            page = await fetch_transactions_page(
+                db,
+                select(Transaction).filter_by(**filters),
+                cursor=cursor,
+                direction=direction,
+                page_size=20
+            )
+            transactions = page.items
             
             if not transactions:
                 await update.callback_query.message.edit_text(
@@ -668,11 +687,21 @@ class UserHandlers:
 
 📜 <b>المعاملات:</b>
 {transactions_text}
-
-⚠️ <i>عرض آخر 20 معاملة فقط</i>
             """
             
-            keyboard = [[InlineKeyboardButton("🔙 رجوع للسجل", callback_data="back_to_history")]]
+            keyboard = []
+            navigation = []
+            if page.prev_cursor:
+                navigation.append(InlineKeyboardButton(
+                    "⬅️ الأحدث", callback_data=f"history_{type_filter}_{PREV}_{page.prev_cursor}"
+                ))
+            if page.next_cursor:
+                navigation.append(InlineKeyboardButton(
+                    "الأقدم ➡️", callback_data=f"history_{type_filter}_{NEXT}_{page.next_cursor}"
+                ))
+            if navigation:
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton("🔙 رجوع للسجل", callback_data="back_to_history")])
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await update.callback_query.message.edit_text(
@@ -685,15 +714,15 @@ class UserHandlers:
             logger.error(f"خطأ في handle_history_callback: {e}")
             await update.callback_query.message.edit_text("❌ حدث خطأ في عرض السجل")
         finally:
-            db.close()
+            await db.close()
     
     async def show_referral_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض قائمة الإحالات"""
-        db = SessionLocal()
+        db = await read_session(user.id)
         try:
-            referrals = db.query(Referral).filter(
+            referrals = (await db.scalars(select(Referral).where(
                 Referral.referrer_id == user.id
-            ).options(joinedload(Referral.referred_user)).all()
+            ).options(joinedload(Referral.referred_user)))).all()
             
             if not referrals:
                 await update.callback_query.message.edit_text(
@@ -745,7 +774,7 @@ class UserHandlers:
             logger.error(f"خطأ في show_referral_list: {e}")
             await update.callback_query.message.edit_text("❌ حدث خطأ في عرض قائمة الإحالات")
         finally:
-            db.close()
+            await db.close()
     
     async def handle_tutorial_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query_data: str):
         """معالجة callback الشروحات"""
@@ -828,29 +857,20 @@ class UserHandlers:
     
     async def show_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض القائمة الرئيسية (منفصلة عن main_bot)"""
-        from main_bot import IChancyBot
-        bot = IChancyBot()
-        await bot.show_main_menu(update, context, user)
+        await services.bot.show_main_menu(update, context, user)
     
     # ========== دوال مساعدة ==========
     
-    def _get_total_deposits(self, db: Session, user_id: int) -> float:
+    async def _get_total_deposits(self, db: AsyncSession, user_id: int) -> float:
         """الحصول على إجمالي الإيداعات"""
-        total = db.query(func.sum(Transaction.amount)).filter(
-            Transaction.user_id == user_id,
-            Transaction.transaction_type == "deposit",
-            Transaction.status == "completed"
-        ).scalar()
-        return total or 0
+        stats = await db.get(UserStats, user_id)
+        return stats.deposits_total if stats else 0
     
-    def _get_total_withdrawals(self, db: Session, user_id: int) -> float:
+    async def _get_total_withdrawals(self, db: AsyncSession, user_id: int) -> float:
         """الحصول على إجمالي السحوبات"""
-        total = db.query(func.sum(Transaction.amount)).filter(
-            Transaction.user_id == user_id,
-            Transaction.transaction_type == "withdraw",
-            Transaction.status == "completed"
-        ).scalar()
-        return total or 0
+        # db.get يعيد الصف من identity map إن قُرئ في نفس الجلسة
+        stats = await db.get(UserStats, user_id)
+        return stats.withdrawals_total if stats else 0
     
     def _get_transaction_icon(self, transaction_type: str) -> str:
         """الحصول على أيقونة المعاملة"""
@@ -874,16 +894,10 @@ class UserHandlers:
         return icons.get(status, "❓")
     
     async def _notify_admins(self, message: str, context: ContextTypes.DEFAULT_TYPE):
-        """إرسال إشعار للإدمن"""
-        try:
-            for admin_id in Config.ADMIN_IDS:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=message,
-                    parse_mode='HTML'
-                )
-        except Exception as e:
-            logger.error(f"خطأ في إرسال إشعار للإدمن: {e}")
+        """إرسال إشعار للإدمن في الخلفية (بعد ردود المستخدمين في طابور الإرسال)"""
+        context.application.create_task(
+            send_to_many(context.bot, Config.ADMIN_IDS, message, PRIORITY_ADMIN, parse_mode='HTML')
+        )
     
     async def send_error_message(self, update: Update, message: str):
         """إرسال رسالة خطأ"""
@@ -3,6 +3,8 @@
 """
 import asyncio
 import logging
+import multiprocessing
+import signal
 from typing import Optional
 from datetime import datetime
 
@@ -10,8 +12,6 @@ from telegram import (
     Update, 
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
-    ReplyKeyboardMarkup,
-    KeyboardButton,
     ReplyKeyboardRemove
 )
 from telegram.ext import (
@@ -24,12 +24,28 @@ from telegram.ext import (
     ConversationHandler
 )
 
-from config import Config, logger
-from database.models import SessionLocal, User, Transaction, PaymentMethod
+from sqlalchemy import select
+
+from config import Config, setup_logging, logger
+from database.models import AsyncSessionLocal, async_engine, User, Transaction, PaymentMethod
+from database.pool import pool_status
+from database import routing
+from database.query_budget import track_queries, update_label, handler_totals
 from utils.security import generate_referral_code, encrypt_data, decrypt_data
-from utils.payments import PaymentProcessor
-from handlers.user_handlers import UserHandlers
-from handlers.admin_handlers import AdminHandlers
+from utils.balance import balance_service
+from utils.log_sink import log_sink
+from utils.cache import user_cache
+from utils.router import Router
+from utils.send_queue import send_queue, send_to_many, PRIORITY_ADMIN
+from utils.broadcast import broadcaster
+from utils.persistence import RedisPersistence, redis_persistence
+from utils.sharding import consume
+from utils.idempotency import update_deduplicator, new_operation_token, claim_operation
+from utils.syriatel_allocator import syriatel_allocator
+from utils.maintenance import maintenance
+from utils.keyboards import MAIN_MENU_KEYBOARD, BTN_ICHANCY, BTN_DEPOSIT
+from utils.update_processor import PerUserUpdateProcessor
+from utils.services import services
 
 # حالات المحادثة
 (
@@ -44,21 +60,42 @@ from handlers.admin_handlers import AdminHandlers
     ADMIN_PANEL
 ) = range(9)
 
+class QueryTrackedApplication(Application):
+    """تطبيق يعد استعلامات قاعدة البيانات لكل تحديث (ميزانية الاستعلامات و N+1)"""
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            return await super().process_update(update)
+        if await update_deduplicator.seen(update.update_id):
+            # إعادة إرسال من تيليجرام أو من نسخة أخرى - عولج من قبل
+            return
+        with track_queries(update_label(update)):
+            if isinstance(self.persistence, RedisPersistence):
+                # حالة المستخدم قد تكون تغيرت في نسخة أخرى من البوت
+                await self.persistence.load_update(self, update)
+                try:
+                    await super().process_update(update)
+                finally:
+                    await self.persistence.save_update(self, update)
+            else:
+                await super().process_update(update)
+
 class IChancyBot:
     def __init__(self):
         self.application = None
-        self.user_handlers = UserHandlers()
-        self.admin_handlers = AdminHandlers()
-        self.payment_processor = PaymentProcessor()
+        self.router = None
+        self.user_handlers = services.user_handlers
+        self.admin_handlers = services.admin_handlers
+        self.payment_processor = services.payment_processor
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالجة أمر /start"""
         user = update.effective_user
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         
         try:
             # التحقق إذا كان المستخدم موجوداً
-            existing_user = db.query(User).filter(User.telegram_id == user.id).first()
+            existing_user = await db.scalar(select(User).where(User.telegram_id == user.id))
             
             if not existing_user:
                 # إنشاء مستخدم جديد
@@ -72,7 +109,7 @@ class IChancyBot:
                     created_at=datetime.utcnow()
                 )
                 db.add(new_user)
-                db.commit()
+                await db.commit()
                 
                 # إرسال رسالة ترحيب للمستخدم الجديد
                 welcome_message = self._get_welcome_message(new_user)
@@ -86,7 +123,7 @@ class IChancyBot:
                 existing_user.first_name = user.first_name
                 existing_user.last_name = user.last_name
                 existing_user.updated_at = datetime.utcnow()
-                db.commit()
+                await db.commit()
             
             # عرض القائمة الرئيسية
             await self.show_main_menu(update, context, existing_user or new_user)
@@ -95,7 +132,7 @@ class IChancyBot:
             logger.error(f"خطأ في أمر start: {e}")
             await update.message.reply_text("❌ حدث خطأ في النظام. الرجاء المحاولة لاحقاً.")
         finally:
-            db.close()
+            await db.close()
         
         return MAIN_MENU
     
@@ -113,16 +150,14 @@ class IChancyBot:
     
     async def show_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض القائمة الرئيسية"""
-        keyboard = [
-            [KeyboardButton("👤 Ichancy"), KeyboardButton("💳 شحن رصيد")],
-            [KeyboardButton("💰 سحب رصيد"), KeyboardButton("👥 نظام الاحالات")],
-            [KeyboardButton("🎁 كود هدية"), KeyboardButton("🎁 اهداء رصيد")],
-            [KeyboardButton("📞 تواصل معنا"), KeyboardButton("🆘 تواصل مع الدعم")],
-            [KeyboardButton("📋 السجل"), KeyboardButton("📚 الشروحات")],
-            [KeyboardButton("⚡ سجل الرهانات"), KeyboardButton("⚙️ الإعدادات")]
-        ]
+        reply_markup = MAIN_MENU_KEYBOARD
         
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        # user قد يأتي من الكاش، والرصيد من السجل إذا كان هو المصدر
+        db = AsyncSessionLocal()
+        try:
+            balance = await balance_service.get_balance(db, user)
+        finally:
+            await db.close()
         
         # رسالة القائمة
         menu_message = f"""
@@ -130,7 +165,7 @@ class IChancyBot:
 
 🕐 {datetime.now().strftime("%H:%M")}
 👤 <b>المستخدم:</b> {user.username or user.first_name}
-💰 <b>الرصيد:</b> {user.balance:,.0f} ليرة سورية
+💰 <b>الرصيد:</b> {balance:,.0f} ليرة سورية
 
 🔽 <b>اختر من القائمة:</b>
         """
@@ -149,52 +184,33 @@ class IChancyBot:
         if text.startswith('/'):
             return MAIN_MENU
         
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = await user_cache.get_user(db, user_id)
             if not user:
                 await update.message.reply_text("❌ لم يتم العثور على حسابك. استخدم /start")
                 return MAIN_MENU
             
-            # توجيه الرسالة حسب النص
-            if text == "👤 Ichancy":
-                return await self.show_ichancy_menu(update, context, user)
-            elif text == "💳 شحن رصيد":
-                return await self.show_deposit_methods(update, context, user)
-            elif text == "💰 سحب رصيد":
-                return await self.show_withdraw_methods(update, context, user)
-            elif text == "👥 نظام الاحالات":
-                return await self.show_referral_menu(update, context, user)
-            elif text == "🎁 كود هدية":
-                return await self.ask_gift_code(update, context, user)
-            elif text == "🎁 اهداء رصيد":
-                return await self.ask_gift_recipient(update, context, user)
-            elif text == "📞 تواصل معنا":
-                return await self.show_contact_info(update, context, user)
-            elif text == "🆘 تواصل مع الدعم":
-                return await self.ask_support_message(update, context, user)
-            elif text == "📋 السجل":
-                return await self.show_transaction_history(update, context, user)
-            elif text == "📚 الشروحات":
-                return await self.show_tutorials(update, context, user)
-            elif text == "⚡ سجل الرهانات":
-                return await self.show_betting_history(update, context, user)
-            elif text == "⚙️ الإعدادات":
-                return await self.show_settings_menu(update, context, user)
-            else:
+            found, state = await self.router.dispatch_text(text, update, context, user)
+            if not found and context.user_data.get('awaiting_input') and user.telegram_id in Config.ADMIN_IDS:
+                # إدخال نصي تنتظره شاشة إدمن (بحث، مبلغ، رسالة جماعية...)
+                await self.admin_handlers.process_admin_input(update, context, user, text)
+                return MAIN_MENU
+            if not found:
                 await update.message.reply_text("❌ أمر غير معروف. استخدم الأزرار أدناه.")
                 return MAIN_MENU
+            return state if state is not None else MAIN_MENU
                 
         except Exception as e:
             logger.error(f"خطأ في handle_message: {e}")
             await update.message.reply_text("❌ حدث خطأ في النظام.")
             return MAIN_MENU
         finally:
-            db.close()
+            await db.close()
     
     async def show_ichancy_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """قائمة Ichancy"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
             has_account = bool(user.ichancy_account_id)
             
@@ -223,16 +239,16 @@ class IChancyBot:
             return MAIN_MENU
             
         finally:
-            db.close()
+            await db.close()
     
     async def show_deposit_methods(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
         """عرض طرق الشحن"""
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
-            methods = db.query(PaymentMethod).filter(
+            methods = (await db.scalars(select(PaymentMethod).where(
                 PaymentMethod.type.in_(["deposit", "both"]),
                 PaymentMethod.is_active == True
-            ).all()
+            ))).all()
             
             if not methods:
                 await update.message.reply_text("❌ لا توجد طرق دفع متاحة حالياً.")
@@ -256,7 +272,7 @@ class IChancyBot:
             return DEPOSIT_MENU
             
         finally:
-            db.close()
+            await db.close()
     
     async def callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالجة Callback Queries"""
@@ -266,30 +282,44 @@ class IChancyBot:
         data = query.data
         user_id = query.from_user.id
         
-        # توجيه الـ callback حسب البيانات
-        if data == "main_menu":
-            db = SessionLocal()
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            await self.show_main_menu(update, context, user)
-            db.close()
+        db = AsyncSessionLocal()
+        try:
+            user = await user_cache.get_user(db, user_id)
+            if not user:
+                await query.message.reply_text("❌ لم يتم العثور على حسابك. استخدم /start")
+                return MAIN_MENU
+            
+            found, state = await self.router.dispatch_callback(data, update, context, user)
+            if not found:
+                logger.warning(f"callback غير معروف: {data}")
+            return state if state is not None else MAIN_MENU
+            
+        except Exception as e:
+            logger.error(f"خطأ في callback_handler ({data}): {e}")
             return MAIN_MENU
+        finally:
+            await db.close()
+    
+    def _register_routes(self, router: Router):
+        """مسارات البوت الرئيسي - باقي المسارات يسجلها UserHandlers و AdminHandlers"""
+        async def deposit_method(update, context, user, data):
+            return await self.ask_deposit_amount(update, context, int(data.replace("deposit_method_", "")))
         
-        elif data.startswith("deposit_method_"):
-            method_id = int(data.split("_")[2])
-            await self.ask_deposit_amount(update, context, method_id)
-            return DEPOSIT_MENU
-        
-        elif data == "ichancy_create":
+        async def ichancy_create(update, context, user):
             await self.create_ichancy_account(update, context)
             return MAIN_MENU
         
-        # ... (سيتم إكمال باقي الـ callbacks في الأجزاء القادمة)
-        
-        return MAIN_MENU
+        router.text(BTN_ICHANCY, self.show_ichancy_menu)
+        router.text(BTN_DEPOSIT, self.show_deposit_methods)
+        router.callback("main_menu", self.show_main_menu)
+        router.callback("user_main_menu", self.show_main_menu, admin_only=True)
+        router.callback_prefix("deposit_method_", deposit_method)
+        router.callback("ichancy_create", ichancy_create)
     
     async def ask_deposit_amount(self, update: Update, context: ContextTypes.DEFAULT_TYPE, method_id: int):
         """طلب مبلغ الشحن"""
         context.user_data['deposit_method'] = method_id
+        new_operation_token(context.user_data, "deposit")
         
         await update.callback_query.message.edit_text(
             "💰 <b>أدخل المبلغ المراد شحنه:</b>\n"
@@ -301,10 +331,10 @@ class IChancyBot:
     async def create_ichancy_account(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """إنشاء حساب Ichancy"""
         user_id = update.callback_query.from_user.id
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = await db.scalar(select(User).where(User.telegram_id == user_id))
             if not user:
                 await update.callback_query.message.edit_text("❌ لم يتم العثور على حسابك.")
                 return MAIN_MENU
@@ -323,7 +353,7 @@ class IChancyBot:
             
             user.ichancy_account_id = account_id
             user.ichancy_username = username
-            db.commit()
+            await db.commit()
             
             await update.callback_query.message.edit_text(
                 f"✅ <b>تم إنشاء حساب Ichancy بنجاح!</b>\n\n"
@@ -346,24 +376,91 @@ class IChancyBot:
             logger.error(f"خطأ في إنشاء حساب Ichancy: {e}")
             await update.callback_query.message.edit_text("❌ فشل في إنشاء الحساب. حاول لاحقاً.")
         finally:
-            db.close()
+            await db.close()
     
     async def _notify_admins(self, message: str, context: ContextTypes.DEFAULT_TYPE):
-        """إرسال إشعار للإدمن"""
-        for admin_id in Config.ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=message,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                logger.error(f"فشل إرسال إشعار للإدمن {admin_id}: {e}")
+        """إرسال إشعار للإدمن في الخلفية (بعد ردود المستخدمين في طابور الإرسال)"""
+        context.application.create_task(
+            send_to_many(context.bot, Config.ADMIN_IDS, message, PRIORITY_ADMIN, parse_mode='HTML')
+        )
     
-    def run(self):
-        """تشغيل البوت"""
-        # إنشاء التطبيق
-        self.application = Application.builder().token(Config.BOT_TOKEN).build()
+    async def show_pool_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """عرض حالة مجمع اتصالات قاعدة البيانات للإدمن"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        status = pool_status(async_engine)
+        wait = status.get("wait", {})
+        
+        heaviest = "\n".join(
+            f"• <code>{row['name']}</code>: {row['avg_queries']} (أقصى {row['max_queries']}, N+1/تجاوز {row['flagged']})"
+            for row in handler_totals.snapshot(5)
+        ) or "• لا توجد بيانات بعد"
+        updates = context.application.update_processor.stats()
+        cache = user_cache.stats()
+        sending = send_queue.stats()
+        
+        await update.message.reply_text(
+            f"🗄️ <b>مجمع اتصالات قاعدة البيانات</b>\n\n"
+            f"• الحجم: <b>{status.get('size', '-')}</b> (+{status.get('max_overflow', '-')} إضافي)\n"
+            f"• المستخدمة: <b>{status.get('checked_out', '-')}</b>\n"
+            f"• المتاحة: <b>{status.get('checked_in', '-')}</b>\n"
+            f"• الإضافية الحالية: <b>{status.get('overflow', '-')}</b>\n\n"
+            f"⏱️ <b>الانتظار:</b>\n"
+            f"• متوسط: <b>{wait.get('avg_wait_ms', 0)}</b> ms\n"
+            f"• أقصى: <b>{wait.get('max_wait_ms', 0)}</b> ms\n"
+            f"• مرات انتهاء المهلة: <b>{wait.get('timeouts', 0)}</b>\n\n"
+            f"📨 <b>التحديثات:</b>\n"
+            f"• مستخدمون قيد المعالجة: <b>{updates['users_in_progress']}</b> (الحد {updates['workers']})\n"
+            f"• بانتظار تحديث سابق لنفس المستخدم: <b>{updates['queued_behind_same_user']}</b>\n\n"
+            f"⚡ <b>ذاكرة المستخدمين:</b>\n"
+            f"• نسبة الإصابة: <b>{cache['hit_rate']:.0%}</b> (L1 {cache['l1_hits']} / Redis {cache['l2_hits']} / قاعدة البيانات {cache['misses']})\n"
+            f"• Redis: <b>{'✅' if cache['redis'] else '❌'}</b>\n\n"
+            f"📤 <b>طابور الإرسال:</b>\n"
+            f"• بالانتظار: مستخدمون <b>{sending['depth']['user']}</b> / إدارة <b>{sending['depth']['admin']}</b> / جماعي <b>{sending['depth']['bulk']}</b>\n"
+            f"• متوسط الانتظار: <b>{sending['avg_wait_ms']}</b> ms | 429: <b>{sending['flood_waits']}</b>\n\n"
+            f"🔎 <b>الأكثر استعلامات (متوسط لكل تحديث):</b>\n{heaviest}",
+            parse_mode='HTML'
+        )
+    
+    async def on_startup(self, application: Application):
+        """استئناف الرسائل الجماعية التي توقفت قبل اكتمالها وتشغيل مهام الصيانة"""
+        await broadcaster.resume(application.bot)
+        maintenance.start()
+    
+    async def on_stop(self, application: Application):
+        """إيقاف الرسائل الجماعية قبل إغلاق اتصال تيليجرام (تُستأنف عند التشغيل التالي)"""
+        await maintenance.close()
+        await broadcaster.close()
+    
+    async def on_shutdown(self, application: Application):
+        """كتابة السجلات المتبقية في المخزن قبل الإيقاف"""
+        await log_sink.close()
+        await user_cache.close()
+        await routing.close()
+        await update_deduplicator.close()
+        await services.ichancy.close()
+    
+    def build_application(self) -> Application:
+        """إنشاء التطبيق وتسجيل الـ Handlers (مشترك بين polling و webhook)"""
+        self.router = Router()
+        self._register_routes(self.router)
+        self.user_handlers.register_routes(self.router)
+        self.admin_handlers.register_routes(self.router)
+        
+        builder = (
+            Application.builder()
+            .token(Config.BOT_TOKEN)
+            .application_class(QueryTrackedApplication)
+            .concurrent_updates(PerUserUpdateProcessor(Config.MAX_CONCURRENT, Config.MAX_PENDING_UPDATES))
+            .rate_limiter(send_queue)
+            .post_init(self.on_startup)
+            .post_stop(self.on_stop)
+            .post_shutdown(self.on_shutdown)
+        )
+        if Config.PERSISTENCE_ENABLED:
+            builder.persistence(redis_persistence)
+        self.application = builder.build()
         
         # إضافة Handlers
         conv_handler = ConversationHandler(
@@ -380,14 +477,68 @@ class IChancyBot:
                 # ... (سيتم إضافة باقي الـ states)
             },
             fallbacks=[CommandHandler('cancel', self.cancel)],
+            name="main",
+            persistent=Config.PERSISTENCE_ENABLED,
         )
         
         self.application.add_handler(conv_handler)
+        self.application.add_handler(CommandHandler('db_pool', self.show_pool_status))
+        return self.application
+    
+    def run(self):
+        """تشغيل البوت"""
+        if Config.BOT_MODE == "webhook":
+            # التحديثات تصل عبر webhook/telegram_webhook.py (يمكن تشغيل عدة نسخ خلف موزع الحمل)
+            import uvicorn
+            from webhook.telegram_webhook import app
+            
+            logger.info("🤖 بدء تشغيل البوت (webhook)...")
+            uvicorn.run(app, host="0.0.0.0", port=Config.TELEGRAM_WEBHOOK_PORT, log_config=None)
+            return
+        
+        if Config.BOT_MODE in ("shard_front", "shard_worker") and Config.SHARD_COUNT <= 0:
+            raise RuntimeError("SHARD_COUNT مطلوب في وضع الأقسام (نفس القيمة في الواجهة وكل العمال)")
+        
+        if Config.BOT_MODE == "shard_front":
+            import uvicorn
+            from webhook.telegram_front import app
+            
+            logger.info(f"🤖 بدء تشغيل واجهة الأقسام ({Config.SHARD_COUNT} أقسام)...")
+            uvicorn.run(app, host="0.0.0.0", port=Config.TELEGRAM_WEBHOOK_PORT, log_config=None)
+            return
+        
+        if Config.BOT_MODE == "shard_worker":
+            shards = [int(shard) for shard in Config.BOT_SHARDS.split(",") if shard.strip()]
+            if len(shards) == 1:
+                asyncio.run(self.run_shard_worker(shards[0]))
+            else:
+                run_shard_workers(shards or list(range(Config.SHARD_COUNT)))
+            return
         
-        # تشغيل البوت
+        self.build_application()
         logger.info("🤖 بدء تشغيل البوت...")
         self.application.run_polling(allowed_updates=Update.ALL_UPDATES)
     
+    async def run_shard_worker(self, shard: int):
+        """عامل قسم واحد: نفس التطبيق والـ Handlers، والتحديثات من قائمة القسم في Redis"""
+        application = self.build_application()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        
+        await application.initialize()
+        # post_init و post_stop تُستدعى تلقائياً في run_polling فقط
+        await self.on_startup(application)
+        await application.start()
+        try:
+            await consume(application, shard, stop)
+        finally:
+            await application.stop()
+            await self.on_stop(application)
+            await application.shutdown()
+            await self.on_shutdown(application)
+    
     async def process_deposit_amount(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالجة مبلغ الشحن"""
         try:
@@ -409,9 +560,11 @@ class IChancyBot:
             # حفظ المبلغ مؤقتاً
             context.user_data['deposit_amount'] = amount
             
-            db = SessionLocal()
-            method = db.query(PaymentMethod).filter(PaymentMethod.id == method_id).first()
-            db.close()
+            db = AsyncSessionLocal()
+            try:
+                method = await db.get(PaymentMethod, method_id)
+            finally:
+                await db.close()
             
             if not method:
                 await update.message.reply_text("❌ طريقة الدفع غير موجودة.")
@@ -437,14 +590,20 @@ class IChancyBot:
     
     async def process_syriatel_deposit(self, update: Update, context: ContextTypes.DEFAULT_TYPE, method: PaymentMethod, amount: float):
         """معالجة شحن سيرياتيل كاش"""
+        token = context.user_data.get('deposit_token') or new_operation_token(context.user_data, "deposit")
+        
         # البحث عن كود سيرياتيل مناسب
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         try:
-            # البحث عن كود متاح
-            available_code = db.query(SyriatelCode).filter(
-                SyriatelCode.is_active == True,
-                SyriatelCode.max_balance - SyriatelCode.current_balance >= amount
-            ).first()
+            # نفس الطلب بنفس المبلغ (ضغط مزدوج أو تحديث معاد): نفس الكود بدون حجز سعة جديدة
+            if not await claim_operation(db, f"syriatel_reserve:{token}:{amount:g}", update.effective_user.id):
+                code = context.user_data.get('syriatel_code')
+                if code:
+                    await update.message.reply_text(self._syriatel_instructions(code, amount), parse_mode='HTML')
+                return
+            
+            # حجز سعة على كود متاح (يحرر حجز الطلب السابق، وينتهي بعد SYRIATEL_RESERVATION_MINUTES)
+            available_code = await syriatel_allocator.reserve(db, update.effective_user.id, amount)
             
             if not available_code:
                 await update.message.reply_text(
@@ -453,43 +612,81 @@ class IChancyBot:
                 )
                 return
             
-            # عرض الكود للمستخدم
-            message = f"""
+            # الحجز مع مفتاح الطلب في نفس المعاملة، ويُرسل الكود بعد الالتزام
+            # (current_balance يزيد عند وصول التحويل فقط)
+            await db.commit()
+            
+            # حفظ الكود في السياق
+            context.user_data['syriatel_code'] = available_code.code
+            context.user_data['syriatel_code_id'] = available_code.id
+            
+            await update.message.reply_text(
+                self._syriatel_instructions(available_code.code, amount),
+                parse_mode='HTML'
+            )
+            
+        finally:
+            await db.close()
+    
+    def _syriatel_instructions(self, code: str, amount: float) -> str:
+        """رسالة تعليمات التحويل إلى كود سيرياتيل"""
+        return f"""
 💳 <b>تفاصيل التحويل - سيرياتيل كاش</b>
 
 💰 <b>المبلغ:</b> {amount:,.0f} ليرة سورية
-🔢 <b>كود السيرياتيل:</b> <code>{available_code.code}</code>
+🔢 <b>كود السيرياتيل:</b> <code>{code}</code>
 
 📋 <b>تعليمات:</b>
 1. قم بتحويل المبلغ إلى الرقم أعلاه
 2. احفظ <b>رقم العملية</b>
 3. أرسل رقم العملية هنا
 
-⚠️ <i>يجب أن يتم التحويل خلال 15 دقيقة</i>
+⚠️ <i>يجب أن يتم التحويل خلال {Config.SYRIATEL_RESERVATION_MINUTES} دقيقة</i>
             """
-            
-            # حفظ الكود في السياق
-            context.user_data['syriatel_code'] = available_code.code
-            context.user_data['syriatel_code_id'] = available_code.id
-            
-            await update.message.reply_text(message, parse_mode='HTML')
-            
-            # تحديث الكود بأنه قيد الاستخدام
-            available_code.current_balance += amount
-            db.commit()
-            
-        finally:
-            db.close()
     
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """إلغاء العملية الحالية"""
+        if context.user_data.pop('syriatel_code_id', None):
+            # تحرير سعة الكود المحجوزة لطلب الشحن
+            context.user_data.pop('syriatel_code', None)
+            db = AsyncSessionLocal()
+            try:
+                await syriatel_allocator.release(db, update.effective_user.id)
+                await db.commit()
+            finally:
+                await db.close()
+        
         await update.message.reply_text(
             "تم الإلغاء. استخدم /start للبدء من جديد.",
             reply_markup=ReplyKeyboardRemove()
         )
         return ConversationHandler.END
 
+def _run_shard(shard: int):
+    setup_logging()
+    asyncio.run(services.provide("bot", IChancyBot()).run_shard_worker(shard))
+
+def run_shard_workers(shards):
+    """تشغيل عدة أقسام على هذا الجهاز - عملية لكل قسم لاستخدام كل الأنوية"""
+    processes = [
+        multiprocessing.Process(target=_run_shard, args=(shard,), name=f"shard-{shard}")
+        for shard in shards
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"🤖 تم تشغيل {len(processes)} عامل: {shards}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
 # نقطة الدخول الرئيسية
 if __name__ == "__main__":
-    bot = IChancyBot()
+    setup_logging()
+    # نفس النسخة للمعالجات (بدونها يُستورد main_bot مرة ثانية باسمه)
+    bot = services.provide("bot", IChancyBot())
     bot.run()
\ No newline at end of file
@@ -11,11 +11,11 @@ from typing import Dict, List, Optional
 import os
 from pathlib import Path
 
+from sqlalchemy import func, desc
 from sqlalchemy.orm import Session
 from telegram import Bot
-import pandas as pd
 
-from database.models import SessionLocal, User, Transaction, SystemLog
+from database.models import SessionLocal, ReadSessionLocal, User, Transaction, SystemLog, DailyStats
 from config import Config
 from utils.security import SecurityUtils
 
@@ -190,45 +190,48 @@ class BackupManager:
     async def generate_daily_report(self) -> Optional[str]:
         """توليد تقرير يومي"""
         try:
-            today = datetime.now().date()
+            # أيام UTC مثل created_at و DailyStats.day (يوم completed_at)، لا يوم الخادم المحلي
+            today = datetime.utcnow().date()
             yesterday = today - timedelta(days=1)
             
-            db = SessionLocal()
+            # مدى زمني بدلاً من func.date() حتى يمكن استخدام الفهارس
+            day_start = datetime.combine(yesterday, datetime.min.time())
+            day_end = datetime.combine(today, datetime.min.time())
+            
+            db = ReadSessionLocal()
             try:
                 # إحصائيات المستخدمين
                 new_users = db.query(User).filter(
-                    func.date(User.created_at) == yesterday
+                    User.created_at >= day_start,
+                    User.created_at < day_end
                 ).count()
                 
                 active_users = db.query(User).filter(
-                    User.updated_at >= datetime.combine(yesterday, datetime.min.time())
+                    User.updated_at >= day_start
                 ).count()
                 
-                # إحصائيات المعاملات
-                deposits = db.query(Transaction).filter(
-                    Transaction.transaction_type == "deposit",
-                    Transaction.status == "completed",
-                    func.date(Transaction.created_at) == yesterday
-                ).all()
+                # إحصائيات المعاملات من التجميع اليومي (صفوف قليلة لكل طريقة دفع)
+                day_rows = db.query(DailyStats).filter(DailyStats.day == yesterday).all()
                 
-                withdrawals = db.query(Transaction).filter(
-                    Transaction.transaction_type == "withdraw",
-                    Transaction.status == "completed",
-                    func.date(Transaction.created_at) == yesterday
-                ).all()
-                
-                total_deposits = sum(d.amount for d in deposits)
-                total_withdrawals = sum(w.amount for w in withdrawals)
+                deposits_count = sum(r.completed_count for r in day_rows if r.transaction_type == "deposit")
+                withdrawals_count = sum(r.completed_count for r in day_rows if r.transaction_type == "withdraw")
+                total_deposits = sum(r.completed_amount for r in day_rows if r.transaction_type == "deposit")
+                total_withdrawals = sum(r.completed_amount for r in day_rows if r.transaction_type == "withdraw")
                 
                 # حسب طريقة الدفع
                 payment_stats = {}
-                for deposit in deposits:
-                    method = deposit.payment_method or "unknown"
-                    payment_stats[method] = payment_stats.get(method, 0) + deposit.amount
+                for row in day_rows:
+                    if row.transaction_type == "deposit" and row.completed_count:
+                        payment_stats[row.payment_method] = payment_stats.get(row.payment_method, 0) + row.completed_amount
+                
+                # معدل النجاح من المعاملات المنتهية (مكتملة أو مرفوضة) خلال اليوم
+                completed_total = sum(r.completed_count for r in day_rows)
+                finalized_total = completed_total + sum(r.rejected_count for r in day_rows)
                 
                 # إنشاء التقرير
                 report = {
                     "date": yesterday.isoformat(),
+                    "timezone": "UTC",
                     "users": {
                         "new": new_users,
                         "active": active_users,
@@ -236,23 +239,20 @@ class BackupManager:
                     },
                     "transactions": {
                         "deposits": {
-                            "count": len(deposits),
+                            "count": deposits_count,
                             "total_amount": total_deposits,
-                            "average_amount": total_deposits / len(deposits) if deposits else 0
+                            "average_amount": total_deposits / deposits_count if deposits_count else 0
                         },
                         "withdrawals": {
-                            "count": len(withdrawals),
+                            "count": withdrawals_count,
                             "total_amount": total_withdrawals,
-                            "average_amount": total_withdrawals / len(withdrawals) if withdrawals else 0
+                            "average_amount": total_withdrawals / withdrawals_count if withdrawals_count else 0
                         }
                     },
                     "payment_methods": payment_stats,
                     "summary": {
                         "net_flow": total_deposits - total_withdrawals,
-                        "success_rate": (len(deposits) + len(withdrawals)) / 
-                                       (db.query(Transaction).filter(
-                                           func.date(Transaction.created_at) == yesterday
-                                       ).count() or 1) * 100
+                        "success_rate": completed_total / (finalized_total or 1) * 100
                     }
                 }
                 
@@ -279,7 +279,7 @@ class BackupManager:
         try:
             message = f"""
 📊 <b>التقرير اليومي</b>
-📅 <b>التاريخ:</b> {report_date.strftime('%Y-%m-%d')}
+📅 <b>التاريخ:</b> {report_date.strftime('%Y-%m-%d')} (UTC)
 
 👥 <b>المستخدمين:</b>
 • 👤 جديد: <b>{report['users']['new']}</b>
@@ -320,13 +320,14 @@ class BackupManager:
     async def generate_monthly_report(self, year: int = None, month: int = None):
         """توليد تقرير شهري"""
         try:
-            now = datetime.now()
+            # الشهر بتوقيت UTC مثل DailyStats.day و created_at
+            now = datetime.utcnow()
             if not year:
                 year = now.year
             if not month:
                 month = now.month
             
-            db = SessionLocal()
+            db = ReadSessionLocal()
             try:
                 # حساب الفترة
                 start_date = datetime(year, month, 1)
@@ -341,21 +342,20 @@ class BackupManager:
                     User.created_at < end_date
                 ).count()
                 
-                total_deposits = db.query(func.sum(Transaction.amount)).filter(
-                    Transaction.transaction_type == "deposit",
-                    Transaction.status == "completed",
-                    Transaction.created_at >= start_date,
-                    Transaction.created_at < end_date
-                ).scalar() or 0
+                totals = dict(db.query(
+                    DailyStats.transaction_type,
+                    func.sum(DailyStats.completed_amount)
+                ).filter(
+                    DailyStats.day >= start_date.date(),
+                    DailyStats.day < end_date.date()
+                ).group_by(
+                    DailyStats.transaction_type
+                ).all())
                 
-                total_withdrawals = db.query(func.sum(Transaction.amount)).filter(
-                    Transaction.transaction_type == "withdraw",
-                    Transaction.status == "completed",
-                    Transaction.created_at >= start_date,
-                    Transaction.created_at < end_date
-                ).scalar() or 0
+                total_deposits = totals.get("deposit") or 0
+                total_withdrawals = totals.get("withdraw") or 0
                 
-                # أعلى 10 مستخدمين
+                # أعلى 10 مستخدمين (يقرأ أقسام الشهر فقط عبر فهرس النوع والحالة والتاريخ)
                 top_users = db.query(
                     User.username,
                     User.first_name,
@@ -380,7 +380,8 @@ class BackupManager:
                         "year": year,
                         "month": month,
                         "start_date": start_date.isoformat(),
-                        "end_date": end_date.isoformat()
+                        "end_date": end_date.isoformat(),
+                        "timezone": "UTC"
                     },
                     "users": {
                         "new": new_users,
@@ -454,7 +455,7 @@ async def schedule_backups():
         lambda: asyncio.create_task(backup_manager.create_database_backup())
     )
     
-    # تقرير يومي في منتصف الليل
+    # تقرير يومي في منتصف الليل (المحلي): يغطي آخر يوم UTC مكتمل في أي منطقة زمنية
     schedule.every().day.at("00:00").do(
         lambda: asyncio.create_task(backup_manager.generate_daily_report())
     )
@@ -474,6 +475,9 @@ async def schedule_backups():
 if __name__ == "__main__":
     # اختبار النسخ الاحتياطي
     import asyncio
+    from config import setup_logging
+    
+    setup_logging()
     
     async def test():
         manager = BackupManager()
@@ -0,0 +1,83 @@
+"""
+قياس حساب البونص: القواعد المجمعة (utils/bonus_rules.py) مقابل المرور الخطي على البونصات
+
+بدون قاعدة بيانات: بونصات عشوائية في الذاكرة، ويُتحقق أولاً أن النتيجتين متطابقتان:
+    python -m scripts.benchmark_bonus_rules
+    python -m scripts.benchmark_bonus_rules --bonuses 10 100 1000 --lookups 200000
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+from utils.bonus_rules import BonusRules
+
+
+def generate_bonuses(count: int, methods: int, rng: random.Random) -> List[SimpleNamespace]:
+    return [
+        SimpleNamespace(
+            id=index + 1,
+            bonus_type="conditional" if rng.random() < 0.7 else "normal",
+            percentage=float(rng.choice([2, 5, 10, 15, 20])),
+            min_amount=float(rng.randrange(0, 50000, 500)),
+            payment_method_id=None if rng.random() < 0.2 else rng.randint(1, methods)
+        )
+        for index in range(count)
+    ]
+
+
+def linear_bonus(bonuses: List[SimpleNamespace], amount: float, payment_method_id: Optional[int]) -> float:
+    """نفس المرور الخطي الذي كان في PaymentProcessor.calculate_bonus (بترتيب id)"""
+    for bonus in bonuses:
+        if bonus.bonus_type == "normal" and bonus.payment_method_id == payment_method_id:
+            return round(amount * (bonus.percentage / 100), 2)
+        if bonus.bonus_type == "conditional" and amount >= bonus.min_amount:
+            if bonus.payment_method_id is None or bonus.payment_method_id == payment_method_id:
+                return round(amount * (bonus.percentage / 100), 2)
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس حساب البونص")
+    parser.add_argument("--bonuses", type=int, nargs="*", default=[10, 100, 1000])
+    parser.add_argument("--methods", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'bonuses':>8} {'compile ms':>11} {'linear us':>10} {'compiled us':>12} {'speedup':>8}")
+    for count in args.bonuses:
+        bonuses = generate_bonuses(count, args.methods, rng)
+        lookups = [
+            (float(rng.randrange(500, 60000, 100)), rng.choice([None, *range(1, args.methods + 2)]))
+            for _ in range(args.lookups)
+        ]
+
+        started = time.perf_counter()
+        rules = BonusRules(bonuses)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        mismatches = [
+            (amount, method_id) for amount, method_id in lookups[:5000]
+            if rules.bonus_for(amount, method_id) != linear_bonus(bonuses, amount, method_id)
+        ]
+        if mismatches:
+            raise SystemExit(f"❌ نتائج مختلفة عند {count} بونص: {mismatches[:5]}")
+
+        started = time.perf_counter()
+        for amount, method_id in lookups:
+            linear_bonus(bonuses, amount, method_id)
+        linear_us = (time.perf_counter() - started) / len(lookups) * 1e6
+
+        started = time.perf_counter()
+        for amount, method_id in lookups:
+            rules.bonus_for(amount, method_id)
+        compiled_us = (time.perf_counter() - started) / len(lookups) * 1e6
+
+        print(f"{count:8} {compile_ms:11.2f} {linear_us:10.2f} {compiled_us:12.2f} {linear_us / compiled_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+قياس زمن الاستعلامات خلف الشاشات الرئيسية على بيانات scripts/seed_data.py
+
+كل حالة تنفذ نفس استعلامات الشاشة (وعبر نفس الدوال المساعدة حيث توجد) لمستخدمين
+عشوائيين، وتعرض p50/p95/p99 وعدد العبارات لكل استدعاء. يعمل على PostgreSQL أو SQLite:
+    python -m scripts.db_benchmark --database-url sqlite:///bench.db
+    python -m scripts.db_benchmark --database-url postgresql://postgres@localhost/bench --runs 500 --json before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+
+from database.models import User, Transaction, Referral, UserStats, DailyStats
+from database.query_budget import track_queries
+from utils.balance import balance_service
+from utils.pagination import fetch_transactions_page
+
+
+class BenchContext:
+    """معاملات عشوائية لكل استدعاء (مستخدم موجود، رقم عملية موجود)"""
+
+    def __init__(self, max_user_id: int, max_telegram_id: int, codes: List[Tuple[str, str]], seed: int):
+        self.rng = random.Random(seed)
+        self.max_user_id = max_user_id
+        self.max_telegram_id = max_telegram_id
+        self.codes = codes
+
+    def user_id(self) -> int:
+        # نفس انحياز النشاط في seed_data: المستخدمون الأقدم أكثر نشاطاً
+        return 1 + int(self.max_user_id * (self.rng.random() ** 2.5)) % self.max_user_id
+
+    def code(self) -> Tuple[str, str]:
+        return self.rng.choice(self.codes) if self.codes else ("000000000000", "syriatel_cash")
+
+
+# ========== الحالات ==========
+
+async def start_lookup(db: AsyncSession, ctx: BenchContext):
+    """/start والرسائل: المستخدم حسب telegram_id"""
+    await db.scalar(select(User).where(User.telegram_id == ctx.max_telegram_id - ctx.user_id() + 1))
+
+
+async def history_first_page(db: AsyncSession, ctx: BenchContext):
+    """السجل: الصفحة الأولى"""
+    query = select(Transaction).where(Transaction.user_id == ctx.user_id())
+    await fetch_transactions_page(db, query, page_size=10)
+
+
+async def history_second_page(db: AsyncSession, ctx: BenchContext):
+    """السجل: صفحة تالية عبر المؤشر"""
+    query = select(Transaction).where(Transaction.user_id == ctx.user_id())
+    page = await fetch_transactions_page(db, query, page_size=10)
+    if page.next_cursor:
+        await fetch_transactions_page(db, query, cursor=page.next_cursor, page_size=10)
+
+
+async def user_totals(db: AsyncSession, ctx: BenchContext):
+    """إجمالي الإيداعات والسحوبات (user_stats)"""
+    await db.get(UserStats, ctx.user_id())
+
+
+async def ledger_balance(db: AsyncSession, ctx: BenchContext):
+    """الرصيد من السجل (آخر لقطة + القيود)"""
+    await balance_service.ledger_balance(db, ctx.user_id())
+
+
+async def referral_list(db: AsyncSession, ctx: BenchContext):
+    """قائمة الإحالات"""
+    await db.scalars(select(Referral).where(
+        Referral.referrer_id == ctx.user_id()
+    ).options(joinedload(Referral.referred_user)))
+
+
+async def admin_panel(db: AsyncSession, ctx: BenchContext):
+    """لوحة الإدمن: عدادات اليوم والطلبات المعلقة"""
+    since = datetime.utcnow() - timedelta(hours=24)
+    await db.execute(select(
+        func.count(User.id),
+        func.count(User.id).filter(User.updated_at >= since)
+    ))
+    completed_today = and_(Transaction.status == "completed", Transaction.created_at >= since)
+    await db.execute(select(
+        func.sum(Transaction.amount).filter(Transaction.transaction_type == "deposit", completed_today),
+        func.sum(Transaction.amount).filter(Transaction.transaction_type == "withdraw", completed_today),
+        func.count(Transaction.id).filter(
+            Transaction.transaction_type == "deposit", Transaction.status == "pending"
+        ),
+        func.count(Transaction.id).filter(
+            Transaction.transaction_type == "withdraw", Transaction.status == "pending"
+        )
+    ).where(or_(Transaction.status == "pending", completed_today)))
+
+
+async def pending_deposits(db: AsyncSession, ctx: BenchContext):
+    """طلبات الإيداع المعلقة (الأقدم أولاً)"""
+    query = select(Transaction).where(
+        Transaction.transaction_type == "deposit",
+        Transaction.status == "pending"
+    ).options(joinedload(Transaction.user))
+    await fetch_transactions_page(db, query, page_size=50, newest_first=False)
+
+
+async def sms_match(db: AsyncSession, ctx: BenchContext):
+    """مطابقة رسالة SMS برقم العملية"""
+    code, method = ctx.code()
+    await db.scalar(select(Transaction).where(
+        Transaction.transaction_code == code,
+        Transaction.payment_method == method,
+        Transaction.status == "pending"
+    ).limit(1))
+
+
+async def daily_report(db: AsyncSession, ctx: BenchContext):
+    """التقرير اليومي (daily_stats)"""
+    yesterday = (datetime.utcnow() - timedelta(days=1)).date()
+    await db.scalars(select(DailyStats).where(DailyStats.day == yesterday))
+
+
+async def monthly_report(db: AsyncSession, ctx: BenchContext):
+    """التقرير الشهري: المجاميع حسب النوع (daily_stats)"""
+    today = datetime.utcnow().date()
+    await db.execute(select(
+        DailyStats.transaction_type,
+        func.sum(DailyStats.completed_count),
+        func.sum(DailyStats.completed_amount)
+    ).where(
+        DailyStats.day >= today.replace(day=1), DailyStats.day <= today
+    ).group_by(DailyStats.transaction_type))
+
+
+CASES: List[Tuple[str, Callable[[AsyncSession, BenchContext], Awaitable]]] = [
+    ("start: user by telegram_id", start_lookup),
+    ("history: first page", history_first_page),
+    ("history: next page (cursor)", history_second_page),
+    ("user totals (user_stats)", user_totals),
+    ("balance (ledger)", ledger_balance),
+    ("referral list", referral_list),
+    ("admin panel", admin_panel),
+    ("pending deposits page", pending_deposits),
+    ("sms match", sms_match),
+    ("daily report", daily_report),
+    ("monthly report", monthly_report),
+]
+
+
+# ========== التشغيل ==========
+
+def _async_url(url: str) -> str:
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite:///"):
+        return url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    return url
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def run(database_url: str, runs: int, warmup: int, seed: int, only: List[str]) -> Dict[str, Dict]:
+    engine = create_async_engine(_async_url(database_url))
+    sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with sessions() as db:
+        max_user_id = await db.scalar(select(func.max(User.id))) or 0
+        max_telegram_id = await db.scalar(select(func.max(User.telegram_id))) or 0
+        if not max_user_id:
+            raise SystemExit("❌ لا توجد بيانات - شغل scripts.seed_data أولاً")
+        codes = (await db.execute(select(Transaction.transaction_code, Transaction.payment_method).where(
+            Transaction.status == "pending", Transaction.transaction_code.isnot(None)
+        ).limit(1000))).all()
+
+    ctx = BenchContext(max_user_id, max_telegram_id, [tuple(row) for row in codes], seed)
+    results = {}
+
+    for name, case in CASES:
+        if only and not any(part in name for part in only):
+            continue
+
+        timings = []
+        statements = []
+        for iteration in range(warmup + runs):
+            # جلسة جديدة لكل استدعاء كما في المعالجات
+            async with sessions() as db:
+                with track_queries(name, budget=10_000) as stats:
+                    started = time.perf_counter()
+                    await case(db, ctx)
+                    elapsed = time.perf_counter() - started
+            if iteration >= warmup:
+                timings.append(elapsed * 1000)
+                statements.append(stats.count if stats else 0)
+
+        results[name] = {
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(_percentile(timings, 95), 3),
+            "p99_ms": round(_percentile(timings, 99), 3),
+            "mean_ms": round(statistics.mean(timings), 3),
+            "statements": round(statistics.mean(statements), 1)
+        }
+
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس استعلامات الشاشات الرئيسية")
+    parser.add_argument("--database-url", required=True, help="قاعدة البيانات المعبأة بـ scripts.seed_data")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--only", nargs="*", default=[], help="تشغيل الحالات التي يحتوي اسمها هذه النصوص فقط")
+    parser.add_argument("--json", help="حفظ النتائج للمقارنة لاحقاً")
+    parser.add_argument("--compare", help="ملف JSON سابق لعرض الفرق")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.database_url, args.runs, args.warmup, args.seed, args.only))
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print()
+    print(f"{'case':32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'stmts':>6}" + ("  vs baseline p50" if baseline else ""))
+    for name, row in results.items():
+        line = f"{name:32} {row['p50_ms']:9.3f} {row['p95_ms']:9.3f} {row['p99_ms']:9.3f} {row['statements']:6.1f}"
+        if name in baseline and row["p50_ms"]:
+            line += f"  {baseline[name]['p50_ms'] / row['p50_ms']:6.2f}x"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
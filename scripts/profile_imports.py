@@ -0,0 +1,99 @@
+"""
+قياس زمن استيراد نقاط التشغيل (بدء التشغيل البارد) عبر python -X importtime
+
+كل وحدة تُستورد في عملية جديدة عدة مرات ويُعرض الوسيط، مع أثقل الاستيرادات بالزمن التراكمي:
+    python -m scripts.profile_imports
+    python -m scripts.profile_imports --modules main_bot --top 30 --json before.json
+    python -m scripts.profile_imports --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+DEFAULT_MODULES = [
+    "config",
+    "database.models",
+    "main_bot",
+    "webhook.telegram_webhook",
+    "webhook.telegram_front",
+    "webhook.sms_webhook",
+    "webhook.ichancy_webhook",
+    "scripts.backup_manager"
+]
+
+
+def _import_once(module: str) -> List[Tuple[str, int, int]]:
+    """(الوحدة، الزمن الذاتي، الزمن التراكمي) بالميكروثانية لكل استيراد"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"فشل استيراد {module}:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def profile(module: str, runs: int, top: int) -> Dict:
+    totals = []
+    rows = []
+    for _ in range(runs):
+        rows = _import_once(module)
+        entry = [row for row in rows if row[0] == module]
+        totals.append(entry[-1][2] if entry else sum(row[1] for row in rows))
+
+    heaviest = sorted(rows, key=lambda row: row[2], reverse=True)
+    return {
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "modules": len(rows),
+        "top": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(own / 1000, 1)}
+            for name, own, cumulative in [row for row in heaviest if row[0] != module][:top]
+        ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس زمن استيراد نقاط التشغيل")
+    parser.add_argument("--modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="عدد أثقل الاستيرادات المعروضة لكل وحدة")
+    parser.add_argument("--json", help="حفظ النتائج للمقارنة لاحقاً")
+    parser.add_argument("--compare", help="ملف JSON سابق لعرض الفرق")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for module in args.modules:
+        results[module] = row = profile(module, args.runs, args.top)
+        line = f"{module:28} {row['total_ms']:9.1f} ms  {row['modules']:5} وحدة"
+        if module in baseline and row["total_ms"]:
+            line += f"  ({baseline[module]['total_ms'] / row['total_ms']:.2f}x)"
+        print(line)
+        for item in row["top"]:
+            print(f"    {item['module']:48} {item['cumulative_ms']:9.1f} {item['self_ms']:9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+توليد بيانات تجريبية بحجم الإنتاج لكل الجداول (PostgreSQL أو SQLite محلياً)
+
+PostgreSQL: التحميل عبر COPY ... FROM STDIN على دفعات. SQLite: INSERT متعدد الصفوف
+داخل معاملة واحدة. لا يحتاج أي خدمة خارجية، والبيانات نفسها تتكرر مع نفس --seed.
+
+التوزيعات:
+- المستخدمون: 30% قبل فترة المعاملات والباقي ينضمون خلالها، 30% منهم بإحالة.
+- المعاملات: مرتبة زمنياً (كما في الإنتاج)، ونشاط المستخدمين غير متساوٍ (قلة نشطة جداً).
+  المعلقة فقط في آخر يومين، والقديمة مكتملة أو مرفوضة.
+- user_stats و daily_stats تُحسب من المعاملات المولدة نفسها، واللقطات الافتتاحية من users.balance.
+
+    python -m scripts.seed_data --database-url sqlite:///bench.db --users 100000 --transactions 2000000 --reset
+    python -m scripts.seed_data --database-url postgresql://postgres@localhost/bench --users 1000000 --transactions 50000000 --reset
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import create_engine, event, insert, text
+
+from config import Config
+from database.models import (
+    Base, User, Transaction, GiftCode, PaymentMethod, SyriatelCode, Bonus,
+    AdminLog, SystemLog, GiftTransaction, UserStats, DailyStats, BalanceSnapshot
+)
+
+CHUNK_SIZE = 50_000
+
+# (الاسم، الاسم المعروض، النوع، الحد الأدنى، الحد الأقصى، نسبة العمولة)
+PAYMENT_METHODS = [
+    ("syriatel_cash", "سيرياتيل كاش", "both", 1000, 500000, 0.0),
+    ("cham_cash", "شام كاش", "both", 1000, 1000000, 1.0),
+    ("usdt", "USDT", "both", 10000, 5000000, 2.0),
+]
+
+# نوع المعاملة وثقله في التوزيع
+TRANSACTION_TYPES = [("deposit", 55), ("withdraw", 30), ("bonus", 10), ("gift", 5)]
+
+USER_STATS_FIELDS = [
+    "deposits_total", "deposits_count", "withdrawals_total", "withdrawals_count",
+    "bonuses_total", "gifts_sent_total", "gifts_received_total"
+]
+
+
+# ========== التحميل ==========
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def load_rows(bind, table, columns: Sequence[str], rows: Iterable[tuple]) -> int:
+    """تحميل الصفوف على دفعات - COPY في PostgreSQL و INSERT متعدد الصفوف في غيره"""
+    total = 0
+    chunk: List[tuple] = []
+
+    def flush():
+        nonlocal total
+        if not chunk:
+            return
+        if bind.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in chunk:
+                writer.writerow([_csv_value(value) for value in row])
+            buffer.seek(0)
+            raw = bind.connection.dbapi_connection
+            with raw.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+        else:
+            bind.execute(insert(table), [dict(zip(columns, row)) for row in chunk])
+        total += len(chunk)
+        chunk.clear()
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+    flush()
+    return total
+
+
+# ========== المولد ==========
+
+class SeedGenerator:
+    """يولد صفوف كل الجداول بشكل متسق (المفاتيح الأجنبية والملخصات)"""
+
+    def __init__(self, users: int, transactions: int, gifts: int, logs: int, days: int, seed: int):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.transactions = transactions
+        self.gifts = gifts
+        self.logs = logs
+        self.end = datetime.utcnow().replace(microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        self.window = (self.end - self.start).total_seconds()
+
+        # ملخصات تُبنى أثناء توليد المعاملات (الفهرس = users.id)
+        self.user_stats = {field: [0.0] * (users + 1) for field in USER_STATS_FIELDS}
+        self.last_transaction: Dict[int, Tuple[str, float, datetime]] = {}
+        self.daily: Dict[Tuple, List[float]] = {}
+        self.balances = [0.0] * (users + 1)
+
+        self._type_names = [name for name, _ in TRANSACTION_TYPES]
+        self._type_weights = [weight for _, weight in TRANSACTION_TYPES]
+
+    def _user_created_at(self, user_id: int) -> datetime:
+        """المعرفات مرتبة حسب تاريخ الانضمام"""
+        fraction = user_id / self.users
+        if fraction <= 0.3:
+            return self.start - timedelta(days=365 * (1 - fraction / 0.3))
+        return self.start + timedelta(seconds=self.window * (fraction - 0.3) / 0.7)
+
+    def _active_user(self, at_fraction: float) -> int:
+        """مستخدم انضم قبل هذه اللحظة، مع تفضيل قلة نشطة جداً"""
+        joined = max(1, int(self.users * (0.3 + 0.7 * at_fraction)))
+        return 1 + int(joined * (self.rng.random() ** 2.5)) % joined
+
+    def payment_methods(self):
+        for index, (name, display, kind, low, high, fee) in enumerate(PAYMENT_METHODS, start=1):
+            yield (index, name, display, kind, True, low, high, fee, 0.0, None, self.start)
+
+    def users_rows(self):
+        rng = self.rng
+        for user_id in range(1, self.users + 1):
+            created_at = self._user_created_at(user_id)
+            referred_by = rng.randint(1, user_id - 1) if user_id > 1 and rng.random() < 0.3 else None
+            balance = round(min(rng.lognormvariate(9, 1.5), 5_000_000), 2) if rng.random() < 0.7 else 0.0
+            self.balances[user_id] = balance
+            has_ichancy = rng.random() < 0.6
+            yield (
+                user_id,
+                5_000_000_000 + user_id,
+                f"user{user_id}" if rng.random() < 0.8 else None,
+                f"User {user_id}",
+                None,
+                balance,
+                str(10_000_000 + user_id) if has_ichancy else None,
+                f"ich_{user_id}" if has_ichancy else None,
+                f"R{user_id:09d}",
+                referred_by,
+                True,
+                rng.random() < 0.002,
+                created_at,
+                created_at + timedelta(days=rng.random() * 30)
+            )
+
+    def transactions_rows(self):
+        rng = self.rng
+        pending_since = self.end - timedelta(days=2)
+        method_names = [method[0] for method in PAYMENT_METHODS]
+
+        for index in range(self.transactions):
+            fraction = index / self.transactions
+            created_at = self.start + timedelta(seconds=self.window * fraction + rng.random())
+            user_id = self._active_user(fraction)
+            kind = rng.choices(self._type_names, self._type_weights)[0]
+            amount = float(rng.choice((5000, 10000, 25000, 50000, 100000)) * rng.randint(1, 4))
+
+            if kind in ("deposit", "withdraw"):
+                method = rng.choice(method_names)
+                fee = round(amount * 0.01, 2) if method != "syriatel_cash" else 0.0
+                if created_at >= pending_since and rng.random() < 0.2:
+                    status = "pending"
+                else:
+                    status = "rejected" if rng.random() < 0.12 else "completed"
+                code = f"{index:012d}" if method == "syriatel_cash" else f"C{index:011X}"
+            else:
+                method = "gift_code" if kind == "bonus" else "gift"
+                fee, status, code = 0.0, "completed", None
+
+            net_amount = amount - fee
+            completed_at = created_at + timedelta(seconds=rng.randint(5, 3600)) if status == "completed" else None
+            self._account(user_id, kind, status, amount, fee, method, created_at, completed_at)
+
+            yield (
+                user_id, kind, amount, fee, net_amount, method, code, status,
+                None, status == "completed" and rng.random() < 0.7,
+                None, created_at, completed_at
+            )
+
+    def _account(self, user_id, kind, status, amount, fee, method, created_at, completed_at):
+        """تحديث الملخصات كما يفعل database/stats.py (الإجماليات بـ amount مثل record_transaction_completed)"""
+        if status in ("completed", "rejected"):
+            day = (completed_at or created_at).date()
+            row = self.daily.setdefault((day, method, kind), [0, 0.0, 0.0, 0, 0.0])
+            if status == "completed":
+                row[0] += 1
+                row[1] += amount
+                row[2] += fee
+            else:
+                row[3] += 1
+                row[4] += amount
+
+        if status != "completed":
+            return
+
+        stats = self.user_stats
+        if kind == "deposit":
+            stats["deposits_total"][user_id] += amount
+            stats["deposits_count"][user_id] += 1
+        elif kind == "withdraw":
+            stats["withdrawals_total"][user_id] += amount
+            stats["withdrawals_count"][user_id] += 1
+        elif kind == "bonus":
+            stats["bonuses_total"][user_id] += amount
+        else:
+            stats["gifts_received_total"][user_id] += amount
+        self.last_transaction[user_id] = (kind, amount, completed_at)
+
+    def gift_transactions_rows(self):
+        rng = self.rng
+        for index in range(self.gifts):
+            fraction = index / max(self.gifts, 1)
+            sender = self._active_user(fraction)
+            receiver = self._active_user(fraction)
+            if receiver == sender:
+                receiver = sender % self.users + 1
+            amount = float(rng.choice((1000, 5000, 10000, 20000)))
+            fee = amount * 0.05
+            self.user_stats["gifts_sent_total"][sender] += amount
+            self.user_stats["gifts_received_total"][receiver] += amount - fee
+            yield (sender, receiver, amount, fee, self.start + timedelta(seconds=self.window * fraction))
+
+    def user_stats_rows(self):
+        stats = self.user_stats
+        for user_id in range(1, self.users + 1):
+            values = [stats[field][user_id] for field in USER_STATS_FIELDS]
+            last = self.last_transaction.get(user_id)
+            if not any(values) and not last:
+                continue
+            values[1] = int(values[1])
+            values[3] = int(values[3])
+            yield (user_id, *values, *(last or (None, None, None)), self.end)
+
+    def daily_stats_rows(self):
+        for (day, method, kind), row in sorted(self.daily.items()):
+            yield (day, method, kind, int(row[0]), row[1], row[2], int(row[3]), row[4], self.end)
+
+    def snapshots_rows(self):
+        for user_id in range(1, self.users + 1):
+            yield (user_id, self.balances[user_id], 0, self.end)
+
+    def gift_codes_rows(self, count: int):
+        rng = self.rng
+        for index in range(count):
+            max_uses = rng.choice((1, 1, 5, 50))
+            used = rng.randint(0, max_uses)
+            expires = self.end + timedelta(days=rng.randint(-60, 60)) if rng.random() < 0.8 else None
+            yield (f"GIFT{index:08d}", float(rng.choice((1000, 5000, 10000))), 1, max_uses, used,
+                   used < max_uses, expires, self.start + timedelta(seconds=self.window * index / count))
+
+    def syriatel_codes_rows(self, count: int):
+        rng = self.rng
+        for index in range(count):
+            current = float(rng.randint(0, 5400))
+            yield (f"09{index:08d}", current, 0.0, 5400.0, current < 5400, self.end - timedelta(minutes=index), self.start)
+
+    def bonuses_rows(self, count: int):
+        rng = self.rng
+        for index in range(count):
+            conditional = rng.random() < 0.5
+            # بعض البونصات بدون تاريخ انتهاء (دائمة)
+            expires = None if rng.random() < 0.3 else self.end + timedelta(days=rng.randint(-30, 90))
+            yield (
+                f"Bonus {index}",
+                "conditional" if conditional else "normal",
+                float(rng.choice((2, 5, 10))),
+                float(rng.choice((0, 10000, 50000))) if conditional else 0.0,
+                rng.randint(1, len(PAYMENT_METHODS)) if not conditional or rng.random() < 0.5 else None,
+                rng.random() < 0.7,
+                expires,
+                self.start
+            )
+
+    def admin_logs_rows(self):
+        rng = self.rng
+        actions = ("confirm_deposit", "reject_deposit", "add_balance", "ban_user", "view_user")
+        for index in range(self.logs):
+            target = rng.randint(1, self.users)
+            yield (1, rng.choice(actions), target, {"user_id": target, "amount": rng.randint(1, 100) * 1000},
+                   None, self.start + timedelta(seconds=self.window * index / self.logs))
+
+    def system_logs_rows(self):
+        rng = self.rng
+        modules = ("support", "sms", "payments", "backup")
+        for index in range(self.logs):
+            yield (rng.choice(("INFO", "INFO", "INFO", "WARNING", "ERROR")), rng.choice(modules),
+                   f"حدث تجريبي {index}", {"index": index},
+                   self.start + timedelta(seconds=self.window * index / self.logs))
+
+
+# ========== التنفيذ ==========
+
+def prepare_schema(bind_engine, reset: bool, start: datetime):
+    """إنشاء الجداول (وأقسام فترة البيانات إذا كان الجدول مقسماً)"""
+    import database.partitions as partitions
+
+    if reset:
+        Base.metadata.drop_all(bind=bind_engine)
+    Base.metadata.create_all(bind=bind_engine)
+
+    if bind_engine.dialect.name == "postgresql" and Config.TRANSACTIONS_PARTITIONED:
+        with bind_engine.begin() as conn:
+            partitions.ensure_partitions_on(conn, start.date(), Config.PARTITION_MONTHS_AHEAD)
+
+
+def _columns(model, exclude=("id",)) -> List[str]:
+    return [column.name for column in model.__table__.columns if column.name not in exclude]
+
+
+def seed(bind_engine, generator: SeedGenerator, gift_codes: int, syriatel_codes: int, bonuses: int):
+    is_postgres = bind_engine.dialect.name == "postgresql"
+
+    with bind_engine.begin() as conn:
+        if conn.scalar(text("SELECT count(*) FROM users")):
+            raise SystemExit("❌ جدول users غير فارغ - استخدم --reset على قاعدة بيانات تجريبية")
+
+        steps = [
+            (PaymentMethod, _columns(PaymentMethod, ()), generator.payment_methods()),
+            (User, _columns(User, ()), generator.users_rows()),
+            (Transaction, _columns(Transaction), generator.transactions_rows()),
+            (GiftTransaction, _columns(GiftTransaction), generator.gift_transactions_rows()),
+            (GiftCode, _columns(GiftCode), generator.gift_codes_rows(gift_codes)),
+            (SyriatelCode, _columns(SyriatelCode), generator.syriatel_codes_rows(syriatel_codes)),
+            (Bonus, _columns(Bonus), generator.bonuses_rows(bonuses)),
+            (AdminLog, _columns(AdminLog), generator.admin_logs_rows()),
+            (SystemLog, _columns(SystemLog), generator.system_logs_rows()),
+            (UserStats, _columns(UserStats, ()), generator.user_stats_rows()),
+            (DailyStats, _columns(DailyStats, ()), generator.daily_stats_rows()),
+            (BalanceSnapshot, _columns(BalanceSnapshot, ()), generator.snapshots_rows()),
+        ]
+
+        for model, columns, rows in steps:
+            started = time.perf_counter()
+            count = load_rows(conn, model.__table__, columns, rows)
+            elapsed = time.perf_counter() - started
+            print(f"  {model.__tablename__:20} {count:>12,} صف  {elapsed:8.1f}s  ({count / max(elapsed, 1e-9):,.0f}/s)")
+
+        # الإحالات من users.referred_by حتى تطابق المستخدمين تماماً
+        started = time.perf_counter()
+        referrals = conn.execute(text(
+            "INSERT INTO referrals (referrer_id, referred_user_id, is_active, total_burned, bonus_paid, created_at) "
+            "SELECT referred_by, id, id % 3 = 0, (id % 7) * 10000, "
+            "CASE WHEN id % 3 = 0 THEN 2000 ELSE 0 END, created_at "
+            "FROM users WHERE referred_by IS NOT NULL"
+        )).rowcount
+        print(f"  {'referrals':20} {referrals:>12,} صف  {time.perf_counter() - started:8.1f}s")
+
+        if is_postgres:
+            # المعرفات الصريحة لا تحرك التسلسلات
+            for table in ("users", "payment_methods"):
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                ))
+
+    with bind_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="توليد بيانات تجريبية بحجم الإنتاج")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL, help="قاعدة بيانات تجريبية (PostgreSQL أو sqlite:///file.db)")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--transactions", type=int, default=2_000_000)
+    parser.add_argument("--gifts", type=int, default=None, help="افتراضياً 2%% من المعاملات")
+    parser.add_argument("--logs", type=int, default=None, help="لكل جدول سجلات - افتراضياً 1%% من المعاملات")
+    parser.add_argument("--gift-codes", type=int, default=1_000)
+    parser.add_argument("--syriatel-codes", type=int, default=50)
+    parser.add_argument("--bonuses", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365, help="الفترة الزمنية للمعاملات")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="حذف الجداول وإعادة إنشائها أولاً")
+    args = parser.parse_args()
+
+    bind_engine = create_engine(args.database_url)
+    if bind_engine.dialect.name == "sqlite":
+        @event.listens_for(bind_engine, "connect")
+        def _fast_sqlite(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.close()
+
+    generator = SeedGenerator(
+        users=args.users,
+        transactions=args.transactions,
+        gifts=args.gifts if args.gifts is not None else args.transactions // 50,
+        logs=args.logs if args.logs is not None else args.transactions // 100,
+        days=args.days,
+        seed=args.seed
+    )
+
+    print(f"🌱 {args.users:,} مستخدم و {args.transactions:,} معاملة على {bind_engine.dialect.name}...")
+    started = time.perf_counter()
+    prepare_schema(bind_engine, args.reset, generator.start)
+    seed(bind_engine, generator, args.gift_codes, args.syriatel_codes, args.bonuses)
+    print(f"✅ اكتمل خلال {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
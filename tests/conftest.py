@@ -0,0 +1,12 @@
+"""
+إعداد الاختبارات: بدون PostgreSQL ولا Redis
+
+المتغيرات تُضبط قبل استيراد config (يُقرأ مرة واحدة عند الاستيراد).
+"""
+import os
+import sys
+
+os.environ.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("USER_CACHE_ENABLED", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
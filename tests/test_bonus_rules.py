@@ -0,0 +1,89 @@
+"""قواعد البونص المجمعة (utils/bonus_rules.py) مقابل المرور الخطي السابق"""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from scripts.benchmark_bonus_rules import generate_bonuses, linear_bonus
+from utils.bonus_rules import BonusRules
+
+
+def bonus(id, bonus_type, percentage, min_amount=0.0, payment_method_id=None):
+    return SimpleNamespace(
+        id=id,
+        bonus_type=bonus_type,
+        percentage=percentage,
+        min_amount=min_amount,
+        payment_method_id=payment_method_id
+    )
+
+
+def test_normal_applies_to_its_method_only():
+    rules = BonusRules([bonus(1, "normal", 10, payment_method_id=2)])
+    assert rules.bonus_for(1000, 2) == 100
+    assert rules.bonus_for(1000, 3) == 0
+
+
+def test_normal_without_method_matches_only_deposits_without_method():
+    rules = BonusRules([bonus(1, "normal", 10)])
+    assert rules.bonus_for(1000, 1) == 0
+    assert rules.bonus_for(1000, None) == 100
+
+
+def test_oldest_matching_bonus_wins():
+    # الأقدم (أصغر id) يطبق حتى لو كان لغيره نسبة أكبر أو عتبة أعلى
+    rules = BonusRules([
+        bonus(5, "conditional", 20, min_amount=1000, payment_method_id=1),
+        bonus(3, "normal", 5, payment_method_id=1),
+    ])
+    assert rules.bonus_for(5000, 1) == 250
+
+    rules = BonusRules([
+        bonus(2, "conditional", 20, min_amount=1000, payment_method_id=1),
+        bonus(3, "normal", 5, payment_method_id=1),
+    ])
+    assert rules.bonus_for(500, 1) == 25
+    assert rules.bonus_for(5000, 1) == 1000
+
+
+def test_conditional_precedence_by_id_across_thresholds():
+    rules = BonusRules([
+        bonus(1, "conditional", 10, min_amount=5000),
+        bonus(2, "conditional", 15, min_amount=1000),
+    ])
+    assert rules.bonus_for(999, 1) == 0
+    assert rules.bonus_for(1000, 1) == 150
+    assert rules.bonus_for(5000, 1) == 500
+
+
+def test_shared_rules_apply_to_every_method():
+    rules = BonusRules([
+        bonus(1, "conditional", 10, min_amount=1000),
+        bonus(2, "conditional", 5, min_amount=0, payment_method_id=4),
+    ])
+    assert rules.bonus_for(2000, 7) == 200
+    assert rules.bonus_for(2000, None) == 200
+    # القاعدة المشتركة أقدم من قاعدة الطريقة 4
+    assert rules.bonus_for(2000, 4) == 200
+    assert rules.bonus_for(500, 4) == 25
+
+
+def test_amount_below_every_threshold():
+    rules = BonusRules([
+        bonus(1, "conditional", 10, min_amount=1000),
+        bonus(2, "conditional", 20, min_amount=3000, payment_method_id=1),
+    ])
+    assert rules.bonus_for(999.99, 1) == 0
+    assert rules.bonus_for(0, None) == 0
+    assert BonusRules([]).bonus_for(1000, 1) == 0
+
+
+@pytest.mark.parametrize("count", [0, 1, 10, 200])
+def test_matches_linear_scan(count):
+    rng = random.Random(count)
+    bonuses = generate_bonuses(count, methods=5, rng=rng)
+    rules = BonusRules(bonuses)
+    for _ in range(2000):
+        amount = float(rng.randrange(0, 60000, 100))
+        method_id = rng.choice([None, 1, 2, 3, 4, 5, 6])
+        assert rules.bonus_for(amount, method_id) == linear_bonus(bonuses, amount, method_id)
@@ -0,0 +1,106 @@
+"""مفاتيح العمليات وانتقال المعاملات (utils/idempotency.py) على sqlite"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.models import Base, Transaction, User
+from utils.balance import balance_service
+from utils.idempotency import claim_operation, claim_transaction
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def sessions(tmp_path):
+    # ملف وليس :memory: حتى ترى كل جلسة ما التزمت به الأخرى
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.fixture
+async def deposit(sessions):
+    async with sessions() as db:
+        user = User(telegram_id=100, referral_code="r100", first_name="u")
+        db.add(user)
+        await db.flush()
+        transaction = Transaction(
+            user_id=user.id,
+            transaction_type="deposit",
+            amount=50000,
+            net_amount=50000,
+            status="pending",
+            created_at=datetime.utcnow()
+        )
+        db.add(transaction)
+        await db.commit()
+        return transaction
+
+
+async def _approve(db, transaction) -> bool:
+    """مثل موافقة الإدمن: الرصيد يتحرك فقط إذا انتقلت المعاملة من pending"""
+    if not await claim_transaction(db, transaction, "completed", completed_at=datetime.utcnow()):
+        return False
+    await balance_service.credit(db, transaction.user_id, transaction.net_amount, "deposit", transaction)
+    await db.commit()
+    return True
+
+
+@pytest.mark.anyio
+async def test_claim_operation_twice_returns_false(sessions):
+    async with sessions() as db:
+        assert await claim_operation(db, "gift:abc", 100)
+        await db.commit()
+
+    async with sessions() as db:
+        assert not await claim_operation(db, "gift:abc", 100)
+        # مفتاح آخر لا يتأثر
+        assert await claim_operation(db, "gift:def", 100)
+
+
+@pytest.mark.anyio
+async def test_rollback_releases_operation_key(sessions):
+    async with sessions() as db:
+        assert await claim_operation(db, "withdraw:abc", 100)
+        await db.rollback()
+
+    async with sessions() as db:
+        assert await claim_operation(db, "withdraw:abc", 100)
+
+
+@pytest.mark.anyio
+async def test_claim_transaction_once(sessions, deposit):
+    async with sessions() as db:
+        transaction = await db.get(Transaction, deposit.id)
+        assert await _approve(db, transaction)
+        # synchronize_session يحدّث الكائن المحمّل في الجلسة
+        assert transaction.status == "completed"
+        assert await balance_service.ledger_balance(db, deposit.user_id) == 50000
+
+
+@pytest.mark.anyio
+async def test_claim_moved_transaction_leaves_balance(sessions, deposit):
+    # كائنان للمعاملة نفسها وكلاهما يرى pending (إدمنان، أو SMS والتحقق اليدوي)
+    async with sessions() as first_db, sessions() as second_db:
+        first = await first_db.get(Transaction, deposit.id)
+        second = await second_db.get(Transaction, deposit.id)
+        assert first.status == second.status == "pending"
+
+        assert await _approve(first_db, first)
+        assert not await _approve(second_db, second)
+        await second_db.rollback()
+
+    async with sessions() as db:
+        assert await balance_service.ledger_balance(db, deposit.user_id) == 50000
+        assert (await db.get(Transaction, deposit.id)).status == "completed"
+
+        # ولا من حالة أخرى غير المتوقعة
+        assert not await claim_transaction(db, deposit, "rejected")
+        await db.rollback()
+        assert await balance_service.ledger_balance(db, deposit.user_id) == 50000
@@ -0,0 +1,37 @@
+"""مؤشرات ترقيم الصفحات (utils/pagination.py)"""
+from datetime import datetime
+
+import pytest
+
+from utils.pagination import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("created_at, row_id", [
+    (datetime(1970, 1, 1), 0),
+    (datetime(2024, 5, 17, 13, 45, 12, 123456), 98765),
+    (datetime(9999, 12, 31, 23, 59, 59, 999999), 2 ** 63 - 1),
+])
+def test_round_trip(created_at, row_id):
+    cursor = encode_cursor(created_at, row_id)
+    assert decode_cursor(cursor) == (created_at, row_id)
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    ".",
+    "1",
+    "1.",
+    ".1",
+    "1.2.3",
+    "zzzzzzzzzzzzzzzz.1",    # تاريخ خارج نطاق datetime
+    "1." + "z" * 20,         # id أكبر من BIGINT
+    "-1.1",
+    "1.+1",
+    " 1.1",
+    "1_0.1",
+    "1.#",
+    "١.1",                   # أرقام غير ASCII يقبلها int()
+])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,72 @@
+"""ميزانية الاستعلامات (database/query_budget.py) في وضع QUERY_BUDGET_STRICT"""
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from config import Config
+from database.models import User
+from database.query_budget import QueryBudgetExceeded, track_queries, handler_totals
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def strict(monkeypatch):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_ENABLED", True)
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", True)
+    monkeypatch.setattr(Config, "QUERY_REPEAT_THRESHOLD", 5)
+
+
+@pytest.fixture
+async def db():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(User.__table__.create)
+    async with AsyncSession(engine) as session:
+        session.add_all([
+            User(telegram_id=100 + index, referral_code=f"r{index}", first_name="u")
+            for index in range(3)
+        ])
+        await session.commit()
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_within_budget(strict, db):
+    with track_queries("test:within", budget=5) as stats:
+        await db.scalar(select(User).where(User.telegram_id == 100))
+        await db.scalars(select(User).order_by(User.id))
+    assert stats.count == 2
+
+
+@pytest.mark.anyio
+async def test_over_budget_raises(strict, db):
+    with pytest.raises(QueryBudgetExceeded, match="الحد 3"):
+        with track_queries("test:over", budget=3):
+            # معالج بحجم عادي: قراءة المستخدم ثم عدة شاشات مختلفة
+            await db.scalar(select(User).where(User.telegram_id == 100))
+            await db.scalars(select(User).order_by(User.id))
+            await db.scalars(select(User.id).where(User.balance >= 0))
+            await db.scalar(select(User.telegram_id).where(User.id == 1))
+    assert any(row["name"] == "test:over" and row["flagged"] for row in handler_totals.snapshot(100))
+
+
+@pytest.mark.anyio
+async def test_repeated_statement_flagged_as_n_plus_one(strict, db):
+    with pytest.raises(QueryBudgetExceeded, match="N\\+1: تكرر 5 مرة"):
+        with track_queries("test:n_plus_one", budget=100):
+            # نفس العبارة بمعاملات مختلفة داخل حلقة = نفس النص
+            for telegram_id in range(100, 105):
+                await db.scalar(select(User).where(User.telegram_id == telegram_id))
+
+
+@pytest.mark.anyio
+async def test_not_strict_only_logs(monkeypatch, strict, db, caplog):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", False)
+    with track_queries("test:lenient", budget=0):
+        await db.scalar(select(User).where(User.telegram_id == 100))
+    assert "ميزانية الاستعلامات [test:lenient]" in caplog.text
@@ -0,0 +1,199 @@
+"""
+تعديل الأرصدة داخل قاعدة البيانات
+
+كل تعديل قيد في balance_entries (سجل إضافة فقط قابل لإعادة الحساب)، والسجل هو المصدر
+(BALANCE_LEDGER_AUTHORITATIVE، الافتراضي): الإضافة INSERT فقط بدون قفل، والخصم يأخذ قفلاً
+استشارياً على المستخدم ثم يتحقق من (آخر لقطة + القيود بعدها). users.balance نسخة للعرض
+تحدثها اللقطات الدورية (database/ledger.py).
+
+BALANCE_LEDGER_AUTHORITATIVE=false يعيد الوضع السابق للرجوع المؤقت: UPDATE ... SET balance =
+balance + :delta WHERE balance + :delta >= 0 RETURNING balance على صف المستخدم، مع نفس القيد
+حتى يبقى السجل صحيحاً عند العودة.
+"""
+import logging
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
+
+from config import Config
+from database.models import User, BalanceEntry, BalanceSnapshot
+from database.routing import mark_user_write_pending
+from utils.cache import mark_user_changed
+
+logger = logging.getLogger(__name__)
+
+# المفتاح الأول لـ pg_advisory_xact_lock حتى لا تتصادم أقفال الأرصدة مع غيرها
+_LEDGER_LOCK_NAMESPACE = 7301
+
+
+class BalanceService:
+    """نقطة واحدة لكل تغيير في رصيد المستخدم"""
+
+    async def adjust(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        delta: float,
+        entry_type: str,
+        reference=None,
+        allow_negative: bool = False
+    ) -> Optional[float]:
+        """
+        إضافة delta (موجبة أو سالبة) لرصيد المستخدم وإرجاع الرصيد الجديد.
+        يرجع None إذا لم يوجد المستخدم أو كان الرصيد غير كافٍ - بدون أي تعديل.
+        reference: المعاملة المرتبطة (Transaction أو GiftTransaction) بعد flush.
+        """
+        if Config.BALANCE_LEDGER_AUTHORITATIVE:
+            balance = await self._adjust_ledger(db, user_id, delta, allow_negative)
+        else:
+            balance = await self._adjust_row(db, user_id, delta, allow_negative)
+        if balance is None:
+            return None
+
+        await db.execute(insert(BalanceEntry).values(
+            user_id=user_id,
+            amount=delta,
+            entry_type=entry_type,
+            reference_type=reference.__tablename__ if reference is not None else None,
+            reference_id=reference.id if reference is not None else None,
+            created_at=datetime.utcnow()
+        ))
+        if Config.BALANCE_LEDGER_AUTHORITATIVE:
+            balance += delta
+
+        mark_user_write_pending(db, user_id)
+        self._sync_loaded_user(db, user_id, balance)
+        return balance
+
+    async def _adjust_row(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        delta: float,
+        allow_negative: bool
+    ) -> Optional[float]:
+        statement = update(User).where(User.id == user_id).values(
+            balance=User.balance + delta,
+            updated_at=datetime.utcnow()
+        )
+        if delta < 0 and not allow_negative:
+            statement = statement.where(User.balance + delta >= 0)
+
+        row = (await db.execute(
+            statement.returning(User.balance, User.telegram_id),
+            execution_options={"synchronize_session": False}
+        )).first()
+        if row is None:
+            return None
+        mark_user_changed(db, row.telegram_id)
+        return row.balance
+
+    async def _adjust_ledger(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        delta: float,
+        allow_negative: bool
+    ) -> Optional[float]:
+        """الرصيد قبل القيد الجديد - الخصم فقط يقفل المستخدم (حتى نهاية المعاملة)"""
+        if delta < 0 and not allow_negative and db.bind.dialect.name == "postgresql":
+            await db.execute(
+                text("SELECT pg_advisory_xact_lock(:namespace, :user_id)"),
+                {"namespace": _LEDGER_LOCK_NAMESPACE, "user_id": user_id}
+            )
+
+        balance = await self.ledger_balance(db, user_id)
+        if balance is None:
+            return None
+        if delta < 0 and not allow_negative and balance + delta < 0:
+            return None
+        return balance
+
+    async def ledger_balance(self, db: AsyncSession, user_id: int) -> Optional[float]:
+        """آخر لقطة + مجموع القيود بعدها (None إذا لم يوجد المستخدم)"""
+        tail = select(func.coalesce(func.sum(BalanceEntry.amount), 0)).where(
+            BalanceEntry.user_id == User.id,
+            BalanceEntry.id > func.coalesce(BalanceSnapshot.last_entry_id, 0)
+        ).scalar_subquery()
+
+        row = (await db.execute(
+            select(User.id, func.coalesce(BalanceSnapshot.balance, 0) + tail)
+            .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == User.id)
+            .where(User.id == user_id)
+        )).first()
+        return float(row[1]) if row else None
+
+    async def get_balance(self, db: AsyncSession, user: User) -> float:
+        """الرصيد الحالي للعرض - استعلام إضافي فقط عندما يكون السجل هو المصدر"""
+        if not Config.BALANCE_LEDGER_AUTHORITATIVE:
+            return user.balance
+
+        balance = await self.ledger_balance(db, user.id)
+        if balance is not None:
+            set_committed_value(user, "balance", balance)
+        return user.balance
+
+    def _sync_loaded_user(self, db: AsyncSession, user_id: int, balance: float):
+        """مزامنة كائن المستخدم المحمل في الجلسة (إن وجد) دون اعتباره معدلاً"""
+        user = db.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            set_committed_value(user, "balance", balance)
+
+    async def credit(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        amount: float,
+        entry_type: str,
+        reference=None
+    ) -> Optional[float]:
+        """إضافة رصيد - None إذا لم يوجد المستخدم"""
+        return await self.adjust(db, user_id, amount, entry_type, reference)
+
+    async def debit(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        amount: float,
+        entry_type: str,
+        reference=None
+    ) -> Optional[float]:
+        """خصم رصيد - None إذا كان الرصيد غير كافٍ أو لم يوجد المستخدم"""
+        return await self.adjust(db, user_id, -amount, entry_type, reference)
+
+    async def transfer(
+        self,
+        db: AsyncSession,
+        sender_id: int,
+        receiver_id: int,
+        amount: float,
+        net_amount: float,
+        reference=None
+    ) -> Optional[Tuple[float, float]]:
+        """
+        خصم amount من المرسل وإضافة net_amount للمستقبل.
+        الصفوف تُقفل بترتيب المعرف لتجنب deadlock بين تحويلين متعاكسين.
+        يرجع None عند عدم كفاية الرصيد - وعلى المستدعي عمل rollback.
+        """
+        if sender_id < receiver_id:
+            sender_balance = await self.debit(db, sender_id, amount, "gift_sent", reference)
+            if sender_balance is None:
+                return None
+            receiver_balance = await self.credit(db, receiver_id, net_amount, "gift_received", reference)
+        else:
+            receiver_balance = await self.credit(db, receiver_id, net_amount, "gift_received", reference)
+            if receiver_balance is None:
+                return None
+            sender_balance = await self.debit(db, sender_id, amount, "gift_sent", reference)
+
+        if sender_balance is None or receiver_balance is None:
+            return None
+        return sender_balance, receiver_balance
+
+
+# إنشاء instance عام
+balance_service = BalanceService()
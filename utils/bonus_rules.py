@@ -0,0 +1,158 @@
+"""
+قواعد البونص مجمعة في الذاكرة - حساب بونص الإيداع بدون استعلامات
+
+البونصات الفعالة (بما فيها الدائمة بدون expires_at) تُقرأ مرة واحدة وتُجمع في جدول لكل
+payment_method_id: عتبات min_amount مرتبة، وأمام كل عتبة نسبة البونص الذي يطبق على أي
+مبلغ يصلها. البحث bisect على العتبات، فالزمن لا يتغير تقريباً مع عدد البونصات.
+
+نفس قواعد الحساب السابق:
+- normal: لطريقة الدفع المحددة فقط، بدون حد أدنى (الفارغة تطابق إيداعاً بدون طريقة دفع فقط).
+- conditional: إذا بلغ المبلغ min_amount، لطريقة الدفع المحددة أو لكل الطرق إذا كانت فارغة.
+- عند تطابق أكثر من بونص يطبق الأقدم (أصغر id).
+
+الجدول يُعاد بناؤه بعد commit أي تعديل على bonuses في هذه العملية، وبعد BONUS_RULES_TTL
+(تعديلات العمليات الأخرى)، وعند انتهاء أقرب بونص.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.models import Bonus
+
+logger = logging.getLogger(__name__)
+
+# (العتبة، id، النسبة)
+_Rule = Tuple[float, int, float]
+
+
+class _Table:
+    """عتبات مرتبة ونسبة البونص المطبق عند كل عتبة"""
+    __slots__ = ("thresholds", "percentages")
+
+    def __init__(self, rules: List[_Rule]):
+        self.thresholds: List[float] = []
+        self.percentages: List[float] = []
+        best_id = None
+        best_percentage = 0.0
+        for threshold, bonus_id, percentage in sorted(rules):
+            # كل عتبة ترث الأقدم من البونصات التي تطبق عندها
+            if best_id is None or bonus_id < best_id:
+                best_id, best_percentage = bonus_id, percentage
+            self.thresholds.append(threshold)
+            self.percentages.append(best_percentage)
+
+    def percentage(self, amount: float) -> float:
+        index = bisect_right(self.thresholds, amount) - 1
+        return self.percentages[index] if index >= 0 else 0.0
+
+
+class BonusRules:
+    """قواعد البونص المجمعة - بدون قاعدة بيانات (يمكن قياسها وحدها)"""
+
+    def __init__(self, bonuses: Iterable, valid_until: float = float("inf")):
+        per_method: Dict[Optional[int], List[_Rule]] = defaultdict(list)
+        # normal بدون طريقة دفع: تطابق فقط الإيداع بدون طريقة (None == None في الحساب السابق)
+        without_method: List[_Rule] = []
+        for bonus in bonuses:
+            if bonus.bonus_type == "normal":
+                rule = (float("-inf"), bonus.id, bonus.percentage or 0.0)
+                if bonus.payment_method_id is None:
+                    without_method.append(rule)
+                else:
+                    per_method[bonus.payment_method_id].append(rule)
+            elif bonus.bonus_type == "conditional":
+                per_method[bonus.payment_method_id].append((bonus.min_amount or 0.0, bonus.id, bonus.percentage or 0.0))
+
+        shared = per_method.pop(None, [])
+        self._tables = {method_id: _Table(rules + shared) for method_id, rules in per_method.items()}
+        self._tables[None] = _Table(without_method + shared)
+        self._shared = _Table(shared)
+        self.size = sum(len(rules) for rules in per_method.values()) + len(shared) + len(without_method)
+        # time.monotonic() الذي يجب بعده إعادة البناء
+        self.valid_until = valid_until
+
+    def bonus_for(self, amount: float, payment_method_id: Optional[int]) -> float:
+        table = self._tables.get(payment_method_id, self._shared)
+        return round(amount * (table.percentage(amount) / 100), 2)
+
+
+class BonusRuleCache:
+    """آخر BonusRules مبني، مع إعادة البناء عند الإبطال أو انتهاء الصلاحية"""
+
+    def __init__(self):
+        self._rules: Optional[BonusRules] = None
+        self._lock = asyncio.Lock()
+        self.counters = {
+            "hits": 0,
+            "reloads": 0,
+            "invalidations": 0
+        }
+
+    async def get(self, db: AsyncSession) -> BonusRules:
+        rules = self._rules
+        if rules is not None and time.monotonic() < rules.valid_until:
+            self.counters["hits"] += 1
+            return rules
+
+        async with self._lock:
+            # طلب آخر ربما أعاد البناء أثناء الانتظار
+            rules = self._rules
+            if rules is None or time.monotonic() >= rules.valid_until:
+                rules = self._rules = await self._load(db)
+        return rules
+
+    async def _load(self, db: AsyncSession) -> BonusRules:
+        now = datetime.utcnow()
+        bonuses = (await db.scalars(select(Bonus).where(
+            Bonus.is_active == True,
+            or_(Bonus.expires_at.is_(None), Bonus.expires_at > now)
+        ))).all()
+
+        ttl = Config.BONUS_RULES_TTL
+        expiries = [bonus.expires_at for bonus in bonuses if bonus.expires_at is not None]
+        if expiries:
+            ttl = min(ttl, (min(expiries) - now).total_seconds())
+
+        self.counters["reloads"] += 1
+        rules = BonusRules(bonuses, valid_until=time.monotonic() + ttl)
+        logger.debug(f"تم تجميع {rules.size} قاعدة بونص")
+        return rules
+
+    def invalidate(self):
+        self._rules = None
+        self.counters["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        return {**self.counters, "rules": self._rules.size if self._rules is not None else None}
+
+
+# إنشاء instance عام
+bonus_rules = BonusRuleCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_bonus_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Bonus):
+            session.info["bonuses_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_bonus_rules(session):
+    if session.info.pop("bonuses_changed", False):
+        bonus_rules.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_bonus_changes(session):
+    session.info.pop("bonuses_changed", None)
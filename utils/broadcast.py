@@ -0,0 +1,270 @@
+"""
+إرسال رسالة جماعية لكل المستخدمين
+
+المستلمون يُقرؤون بمؤشر من جهة الخادم (stream + yield_per) على نوافذ users.id متتالية،
+فالذاكرة ثابتة مهما كان عدد المستخدمين والمعاملة لا تبقى مفتوحة طوال الإرسال.
+الإرسال عبر طابور الإرسال بأولوية PRIORITY_BULK (ردود المستخدمين تسبقه).
+
+بعد كل دفعة (BROADCAST_BATCH) يُحفظ last_user_id والعدادات، فإعادة التشغيل تستأنف من
+آخر دفعة مكتملة (قد تتكرر الرسالة لمستلمي الدفعة التي انقطعت فقط).
+lease_until يمنع نسختين من إرسال نفس الرسالة عند تشغيل عدة نسخ من البوت.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, or_, select, update
+from telegram.error import Forbidden, TelegramError
+
+from config import Config
+from database.models import AsyncSessionLocal, Broadcast, User
+from utils.send_queue import PRIORITY_ADMIN, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+_RECIPIENTS = (User.is_active.is_not(False), User.is_banned.is_not(True))
+
+
+class BroadcastEngine:
+    """تشغيل الرسائل الجماعية واستئنافها"""
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # المعرف -> (بداية التشغيل الحالي، عدد المعالجين فيه)
+        self._runs: Dict[int, Tuple[float, int]] = {}
+
+    # ========== الإنشاء والتحكم ==========
+
+    async def count_recipients(self, db) -> int:
+        return await db.scalar(select(func.count(User.id)).where(*_RECIPIENTS)) or 0
+
+    async def create(self, admin_id: int, text: str) -> Broadcast:
+        """إنشاء رسالة جماعية بحالة running (يجب استدعاء start بعدها)"""
+        db = AsyncSessionLocal()
+        try:
+            broadcast = Broadcast(admin_id=admin_id, text=text, total=await self.count_recipients(db))
+            db.add(broadcast)
+            await db.commit()
+            return broadcast
+        finally:
+            await db.close()
+
+    def start(self, bot, broadcast_id: int):
+        task = self._tasks.get(broadcast_id)
+        if task is not None and not task.done():
+            return
+        self._tasks[broadcast_id] = asyncio.get_running_loop().create_task(self._run(bot, broadcast_id))
+
+    async def resume(self, bot):
+        """استئناف الرسائل غير المكتملة (عند تشغيل البوت)"""
+        db = AsyncSessionLocal()
+        try:
+            ids = (await db.scalars(select(Broadcast.id).where(Broadcast.status == "running"))).all()
+        finally:
+            await db.close()
+
+        for broadcast_id in ids:
+            logger.info(f"📨 استئناف الرسالة الجماعية #{broadcast_id}")
+            self.start(bot, broadcast_id)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """إيقاف نهائي - النسخة التي ترسل تتوقف عند حفظ الدفعة التالية"""
+        db = AsyncSessionLocal()
+        try:
+            result = await db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status="canceled", finished_at=datetime.utcnow())
+            )
+            await db.commit()
+            return result.rowcount > 0
+        finally:
+            await db.close()
+
+    async def progress(self, broadcast_id: int) -> Optional[Dict]:
+        db = AsyncSessionLocal()
+        try:
+            broadcast = await db.get(Broadcast, broadcast_id)
+        finally:
+            await db.close()
+        if broadcast is None:
+            return None
+
+        processed = broadcast.sent + broadcast.failed + broadcast.blocked
+        run = self._runs.get(broadcast_id)
+        if run is not None:
+            rate = run[1] / max(time.monotonic() - run[0], 0.001)
+        elif broadcast.started_at:
+            end = broadcast.finished_at or datetime.utcnow()
+            rate = processed / max((end - broadcast.started_at).total_seconds(), 0.001)
+        else:
+            rate = 0.0
+
+        return {
+            "id": broadcast.id,
+            "status": broadcast.status,
+            "total": broadcast.total,
+            "processed": processed,
+            "sent": broadcast.sent,
+            "failed": broadcast.failed,
+            "blocked": broadcast.blocked,
+            "rate": round(rate, 1),
+            "eta_seconds": int((broadcast.total - processed) / rate) if rate and broadcast.status == "running" else None
+        }
+
+    async def close(self):
+        """إيقاف الإرسال عند إيقاف البوت وتحرير lease ليستأنف فوراً عند التشغيل"""
+        ids = [broadcast_id for broadcast_id, task in self._tasks.items() if not task.done()]
+        for broadcast_id in ids:
+            self._tasks[broadcast_id].cancel()
+        if ids:
+            await asyncio.gather(*[self._tasks[i] for i in ids], return_exceptions=True)
+            db = AsyncSessionLocal()
+            try:
+                await db.execute(update(Broadcast).where(Broadcast.id.in_(ids)).values(lease_until=None))
+                await db.commit()
+            finally:
+                await db.close()
+        self._tasks.clear()
+
+    # ========== الإرسال ==========
+
+    async def _claim(self, broadcast_id: int) -> Optional[Broadcast]:
+        """حجز الرسالة لهذه النسخة (None إذا كانت مكتملة أو تعمل في نسخة أخرى)"""
+        now = datetime.utcnow()
+        db = AsyncSessionLocal()
+        try:
+            claimed = await db.scalar(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == "running",
+                    or_(Broadcast.lease_until.is_(None), Broadcast.lease_until < now)
+                )
+                .values(
+                    lease_until=now + timedelta(seconds=Config.BROADCAST_LEASE_SECONDS),
+                    started_at=func.coalesce(Broadcast.started_at, now)
+                )
+                .returning(Broadcast.id)
+            )
+            await db.commit()
+            return await db.get(Broadcast, claimed) if claimed else None
+        finally:
+            await db.close()
+
+    async def _checkpoint(self, broadcast_id: int, last_user_id: int, counts: Dict[str, int]) -> str:
+        """حفظ التقدم وتجديد lease - يرجع الحالة الحالية (للتوقف عند الإلغاء)"""
+        db = AsyncSessionLocal()
+        try:
+            status = await db.scalar(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(
+                    last_user_id=last_user_id,
+                    sent=Broadcast.sent + counts["sent"],
+                    failed=Broadcast.failed + counts["failed"],
+                    blocked=Broadcast.blocked + counts["blocked"],
+                    lease_until=datetime.utcnow() + timedelta(seconds=Config.BROADCAST_LEASE_SECONDS)
+                )
+                .returning(Broadcast.status)
+            )
+            await db.commit()
+            return status
+        finally:
+            await db.close()
+
+    async def _send_one(self, bot, telegram_id: int, text: str) -> str:
+        try:
+            await bot.send_message(chat_id=telegram_id, text=text, rate_limit_args=PRIORITY_BULK)
+            return "sent"
+        except Forbidden:
+            return "blocked"
+        except TelegramError as e:
+            logger.debug(f"فشل إرسال الرسالة الجماعية إلى {telegram_id}: {e}")
+            return "failed"
+
+    async def _run(self, bot, broadcast_id: int):
+        broadcast = await self._claim(broadcast_id)
+        if broadcast is None:
+            return
+
+        self._runs[broadcast_id] = (time.monotonic(), 0)
+        last_user_id = broadcast.last_user_id
+        status = "running"
+        try:
+            while status == "running":
+                window_end = last_user_id
+                db = AsyncSessionLocal()
+                try:
+                    result = await db.stream(
+                        select(User.id, User.telegram_id)
+                        .where(User.id > last_user_id, *_RECIPIENTS)
+                        .order_by(User.id)
+                        .limit(Config.BROADCAST_WINDOW),
+                        execution_options={"yield_per": Config.BROADCAST_BATCH}
+                    )
+                    async for batch in result.partitions():
+                        outcomes = await asyncio.gather(*[
+                            self._send_one(bot, row.telegram_id, broadcast.text) for row in batch
+                        ])
+                        counts = {key: outcomes.count(key) for key in ("sent", "failed", "blocked")}
+                        window_end = batch[-1].id
+
+                        status = await self._checkpoint(broadcast_id, window_end, counts)
+                        started, processed = self._runs[broadcast_id]
+                        self._runs[broadcast_id] = (started, processed + len(batch))
+                        if status != "running":
+                            break
+                finally:
+                    await db.close()
+
+                if window_end == last_user_id:
+                    break  # لا مستلمين بعد آخر نقطة
+                last_user_id = window_end
+
+            if status == "running":
+                await self._finish(bot, broadcast_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # lease ينتهي فتستأنف الرسالة عند إعادة التشغيل
+            logger.error(f"❌ توقف إرسال الرسالة الجماعية #{broadcast_id}: {e}")
+        finally:
+            self._runs.pop(broadcast_id, None)
+
+    async def _finish(self, bot, broadcast_id: int):
+        db = AsyncSessionLocal()
+        try:
+            await db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status="completed", finished_at=datetime.utcnow(), lease_until=None)
+            )
+            await db.commit()
+            admin_telegram_id = await db.scalar(
+                select(User.telegram_id).join(Broadcast, Broadcast.admin_id == User.id).where(Broadcast.id == broadcast_id)
+            )
+        finally:
+            await db.close()
+
+        report = await self.progress(broadcast_id)
+        logger.info(f"✅ اكتملت الرسالة الجماعية #{broadcast_id}: {report}")
+        if admin_telegram_id:
+            await bot.send_message(
+                chat_id=admin_telegram_id,
+                text=(
+                    f"✅ <b>اكتملت الرسالة الجماعية #{broadcast_id}</b>\n\n"
+                    f"• تم الإرسال: <b>{report['sent']:,}</b>\n"
+                    f"• حظروا البوت: <b>{report['blocked']:,}</b>\n"
+                    f"• فشل: <b>{report['failed']:,}</b>\n"
+                    f"• المعدل: <b>{report['rate']}</b> رسالة/ثانية"
+                ),
+                parse_mode='HTML',
+                rate_limit_args=PRIORITY_ADMIN
+            )
+
+
+# إنشاء instance عام
+broadcaster = BroadcastEngine()
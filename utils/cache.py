@@ -0,0 +1,300 @@
+"""
+ذاكرة مؤقتة لصفوف المستخدمين حسب telegram_id
+
+L1: قاموس LRU داخل العملية بمهلة قصيرة (USER_CACHE_L1_TTL).
+L2: Redis بمهلة CACHE_TTL مشتركة بين البوت والـ Webhooks.
+
+الإبطال تلقائي بعد commit أي جلسة غيرت مستخدماً (عبر ORM أو balance_service)،
+ويُبث عبر Redis لتمسح باقي العمليات نسختها في L1. إذا تعطل Redis يعمل L1 وحده.
+
+الملء بعد القراءة من قاعدة البيانات مشروط بعدم حدوث إبطال أثناءها: الإبطال يزيد رقم جيل
+المستخدم في Redis (user_gen:<id>)، والملء يُكتب بسكربت Lua فقط إذا بقي الجيل كما قُرئ
+قبل الاستعلام. بدون ذلك قد تُكتب نسخة قديمة بعد حذف المفتاح وتبقى حتى CACHE_TTL.
+الكائن المرجع منفصل عن الجلسة (detached): للعرض والتوجيه فقط، وأي تعديل يحمّل المستخدم من الجلسة.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import DateTime, event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from config import Config
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+_CHANNEL = "user_cache:invalidate"
+
+# SET فقط إذا لم يتغير الجيل منذ قراءته (KEYS: المستخدم، الجيل - ARGV: الجيل، القيمة، المهلة)
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+_COLUMNS = [column.key for column in User.__table__.columns]
+_DATETIME_COLUMNS = {column.key for column in User.__table__.columns if isinstance(column.type, DateTime)}
+
+
+class UserCache:
+    """ذاكرة مؤقتة من مستويين لصفوف users"""
+
+    def __init__(self):
+        self._l1: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._listener: Optional[asyncio.Task] = None
+        self._fill_script = None
+        # يزيد مع كل مسح من L1 - ملء L1 يُلغى إذا تغير أثناء القراءة من قاعدة البيانات
+        self._l1_epoch = 0
+        self.counters = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "skipped_fills": 0,
+            "redis_errors": 0
+        }
+
+    # ========== القراءة ==========
+
+    async def get_user(self, db: AsyncSession, telegram_id: int) -> Optional[User]:
+        """المستخدم حسب telegram_id - قاعدة البيانات فقط إذا لم يوجد في L1 ولا L2"""
+        if not Config.USER_CACHE_ENABLED:
+            return await db.scalar(select(User).where(User.telegram_id == telegram_id))
+
+        data = self._l1_get(telegram_id)
+        if data is not None:
+            self.counters["l1_hits"] += 1
+            return self._to_user(data)
+
+        l1_epoch = self._l1_epoch
+        data, generation = await self._l2_get(telegram_id)
+        if data is not None:
+            self.counters["l2_hits"] += 1
+            if l1_epoch == self._l1_epoch:
+                self._l1_set(telegram_id, data)
+            return self._to_user(data)
+
+        self.counters["misses"] += 1
+        user = await db.scalar(select(User).where(User.telegram_id == telegram_id))
+        if user is not None:
+            data = {key: getattr(user, key) for key in _COLUMNS}
+            if l1_epoch == self._l1_epoch:
+                self._l1_set(telegram_id, data)
+            else:
+                self.counters["skipped_fills"] += 1
+            await self._l2_fill(telegram_id, data, generation)
+        return user
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["l1_hits"] + self.counters["l2_hits"] + self.counters["misses"]
+        hits = self.counters["l1_hits"] + self.counters["l2_hits"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "l1_size": len(self._l1),
+            "redis": self._redis_available()
+        }
+
+    @staticmethod
+    def _to_user(data: Dict[str, Any]) -> User:
+        user = User(**data)
+        make_transient_to_detached(user)
+        return user
+
+    # ========== L1 ==========
+
+    def _l1_get(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._l1.get(telegram_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._l1[telegram_id]
+            return None
+        self._l1.move_to_end(telegram_id)
+        return entry[1]
+
+    def _l1_set(self, telegram_id: int, data: Dict[str, Any]):
+        self._l1[telegram_id] = (time.monotonic() + Config.USER_CACHE_L1_TTL, data)
+        self._l1.move_to_end(telegram_id)
+        while len(self._l1) > Config.USER_CACHE_L1_SIZE:
+            self._l1.popitem(last=False)
+
+    # ========== L2 (Redis) ==========
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    def _client(self):
+        if self._redis is None:
+            from redis.asyncio import Redis
+
+            self._redis = Redis.from_url(
+                Config.REDIS_URL,
+                socket_timeout=Config.USER_CACHE_REDIS_TIMEOUT,
+                socket_connect_timeout=Config.USER_CACHE_REDIS_TIMEOUT
+            )
+            self._fill_script = self._redis.register_script(_FILL_SCRIPT)
+        self._ensure_listener()
+        return self._redis
+
+    def _redis_failed(self, e: Exception):
+        # عدم محاولة Redis لفترة قصيرة حتى لا يتأخر كل طلب بمهلة الاتصال
+        self.counters["redis_errors"] += 1
+        if self._redis_available():
+            logger.warning(f"⚠️ ذاكرة Redis غير متاحة - L1 فقط لمدة 30 ثانية: {e}")
+        self._redis_down_until = time.monotonic() + 30
+
+    async def _l2_get(self, telegram_id: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(القيمة، الجيل الحالي) - الجيل None إذا تعذر Redis فلا يُملأ L2"""
+        if not self._redis_available():
+            return None, None
+        try:
+            raw, generation = await self._client().mget(f"user:{telegram_id}", f"user_gen:{telegram_id}")
+        except Exception as e:
+            self._redis_failed(e)
+            return None, None
+        generation = generation.decode() if generation is not None else ""
+        if raw is None:
+            return None, generation
+
+        data = json.loads(raw)
+        for key in _DATETIME_COLUMNS:
+            if data.get(key):
+                data[key] = datetime.fromisoformat(data[key])
+        return data, generation
+
+    async def _l2_fill(self, telegram_id: int, data: Dict[str, Any], generation: Optional[str]):
+        """كتابة ما قُرئ من قاعدة البيانات إذا لم يُبطل المستخدم منذ قراءة generation"""
+        if generation is None or not self._redis_available():
+            return
+        payload = json.dumps({
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in data.items()
+        })
+        try:
+            # يسجل السكربت مع أول اتصال
+            self._client()
+            filled = await self._fill_script(
+                keys=[f"user:{telegram_id}", f"user_gen:{telegram_id}"],
+                args=[generation, payload, Config.CACHE_TTL]
+            )
+        except Exception as e:
+            self._redis_failed(e)
+            return
+        if not filled:
+            self.counters["skipped_fills"] += 1
+
+    # ========== الإبطال ==========
+
+    def invalidate(self, *telegram_ids: int):
+        """مسح المستخدمين من L1 فوراً ومن L2 وباقي العمليات في الخلفية"""
+        telegram_ids = [telegram_id for telegram_id in telegram_ids if telegram_id is not None]
+        if not telegram_ids:
+            return
+
+        for telegram_id in telegram_ids:
+            self._l1.pop(telegram_id, None)
+        self._l1_epoch += 1
+        self.counters["invalidations"] += len(telegram_ids)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # سكربتات متزامنة: L2 ينتهي بمهلة CACHE_TTL
+            return
+        loop.create_task(self._invalidate_remote(telegram_ids))
+
+    async def _invalidate_remote(self, telegram_ids):
+        if not self._redis_available():
+            return
+        try:
+            client = self._client()
+            async with client.pipeline(transaction=True) as pipe:
+                for telegram_id in telegram_ids:
+                    # الجيل الجديد يمنع ملء L2 بقراءة بدأت قبل هذا الإبطال
+                    pipe.incr(f"user_gen:{telegram_id}")
+                    pipe.expire(f"user_gen:{telegram_id}", Config.CACHE_TTL)
+                pipe.delete(*[f"user:{telegram_id}" for telegram_id in telegram_ids])
+                await pipe.execute()
+            await client.publish(_CHANNEL, ",".join(str(telegram_id) for telegram_id in telegram_ids))
+        except Exception as e:
+            self._redis_failed(e)
+
+    def _ensure_listener(self):
+        if self._listener is not None and not self._listener.done():
+            return
+        self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        """استقبال الإبطال من العمليات الأخرى ومسح L1"""
+        while True:
+            subscribed = False
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(_CHANNEL)
+                    subscribed = True
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is None:
+                            continue
+                        for telegram_id in message["data"].decode().split(","):
+                            self._l1.pop(int(telegram_id), None)
+                        self._l1_epoch += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._redis_failed(e)
+                if subscribed:
+                    # نسخ L1 قد تفوتها رسائل الإبطال أثناء الانقطاع
+                    self._l1.clear()
+                    self._l1_epoch += 1
+                await asyncio.sleep(5)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+            self._fill_script = None
+
+
+# إنشاء instance عام
+user_cache = UserCache()
+
+
+def mark_user_changed(db: AsyncSession, telegram_id: int):
+    """تسجيل تغيير مستخدم بتعديل لا يمر عبر ORM (مثل UPDATE ... RETURNING) - يُبطل بعد commit"""
+    db.info.setdefault("changed_telegram_ids", set()).add(telegram_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            if changed is None:
+                changed = session.info.setdefault("changed_telegram_ids", set())
+            changed.add(obj.telegram_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    changed = session.info.pop("changed_telegram_ids", None)
+    if changed:
+        user_cache.invalidate(*changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_telegram_ids", None)
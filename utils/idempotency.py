@@ -0,0 +1,162 @@
+"""
+منع تنفيذ التحديث أو العملية المالية مرتين
+
+1. تحديثات تيليجرام: update_id يُسجل في ذاكرة العملية (LRU) وفي Redis (SET NX بمهلة
+   UPDATE_DEDUP_TTL)، والتحديث المكرر (إعادة إرسال تيليجرام) يُتجاهل قبل أي استعلام.
+2. العمليات المالية: رمز يُنشأ عند بدء الطلب ويُحفظ في user_data، ومفتاحه يُدرج في
+   idempotency_keys داخل نفس معاملة العملية. الضغط المزدوج أو التحديث المعاد يجد المفتاح
+   موجوداً فلا يُنفذ، وإذا تراجعت المعاملة يُحذف المفتاح معها.
+3. طلبات المعاملات: الانتقال من pending يتم بـ UPDATE مشروط بالحالة (claim_transaction)
+   فلا يُؤكد طلب واحد مرتين من إدمنين أو من SMS والتحقق اليدوي معاً.
+
+    token = new_operation_token(context.user_data, "gift")                  # عند بدء الطلب
+    if not await claim_operation(db, f"gift:{token}", user.telegram_id):   # قبل تحريك الرصيد
+        return  # نُفذ مسبقاً
+"""
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from database.models import get_engine, IdempotencyKey, Transaction
+from database.routing import mark_user_write_pending
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """نافذة update_id المعالجة مؤخراً"""
+
+    def __init__(self):
+        self._recent: "OrderedDict[int, None]" = OrderedDict()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self.counters = {
+            "duplicates": 0,
+            "redis_errors": 0
+        }
+
+    def _client(self):
+        if self._redis is None:
+            from redis.asyncio import Redis
+
+            self._redis = Redis.from_url(
+                Config.REDIS_URL,
+                socket_timeout=Config.USER_CACHE_REDIS_TIMEOUT,
+                socket_connect_timeout=Config.USER_CACHE_REDIS_TIMEOUT
+            )
+        return self._redis
+
+    async def seen(self, update_id: int) -> bool:
+        """True إذا عولج هذا التحديث من قبل (في هذه العملية أو غيرها)، وإلا يُسجل"""
+        if update_id in self._recent:
+            self.counters["duplicates"] += 1
+            return True
+
+        self._recent[update_id] = None
+        while len(self._recent) > Config.UPDATE_DEDUP_LRU_SIZE:
+            self._recent.popitem(last=False)
+
+        if time.monotonic() < self._redis_down_until:
+            return False
+        try:
+            first = await self._client().set(
+                f"tg:update:{update_id}", 1, nx=True, ex=Config.UPDATE_DEDUP_TTL
+            )
+        except Exception as e:
+            # بدون Redis تبقى النافذة المحلية فقط
+            self.counters["redis_errors"] += 1
+            self._redis_down_until = time.monotonic() + 30
+            logger.warning(f"⚠️ Redis غير متاح لمنع تكرار التحديثات: {e}")
+            return False
+
+        if not first:
+            self.counters["duplicates"] += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "window": len(self._recent)}
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+# إنشاء instance عام
+update_deduplicator = UpdateDeduplicator()
+
+
+def new_operation_token(user_data: Dict, name: str) -> str:
+    """رمز جديد لطلب مالي يبدأ الآن (يُحفظ في user_data[<name>_token])"""
+    token = uuid.uuid4().hex
+    user_data[f"{name}_token"] = token
+    return token
+
+
+async def claim_operation(db: AsyncSession, key: str, telegram_id: Optional[int] = None) -> bool:
+    """إدراج مفتاح العملية في المعاملة الحالية - False إذا نُفذت (أو تُنفذ الآن) من قبل
+
+    يجب استدعاؤها قبل تحريك الرصيد وفي نفس الجلسة، فالمفتاح يُحفظ أو يتراجع مع العملية.
+    الطلب المتزامن بنفس المفتاح ينتظر التزام الأول ثم يرجع False.
+    """
+    connection = await db.connection()
+    insert = sqlite.insert if connection.dialect.name == "sqlite" else postgresql.insert
+    claimed = await db.scalar(
+        insert(IdempotencyKey)
+        .values(key=key, telegram_id=telegram_id, created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["key"])
+        .returning(IdempotencyKey.key)
+    )
+    if claimed is None:
+        logger.info(f"🔁 تم تجاهل عملية مكررة: {key}")
+    return claimed is not None
+
+
+async def claim_transaction(
+    db: AsyncSession,
+    transaction: Transaction,
+    status: str,
+    from_status: str = "pending",
+    **values
+) -> bool:
+    """نقل المعاملة من from_status إلى status ذرياً - False إذا سبقنا إليها طلب آخر
+
+    الكائن يُحدّث في الجلسة عند النجاح، ويُستكمل بعدها (الرصيد والإحصائيات) ثم commit.
+    """
+    result = await db.execute(
+        update(Transaction)
+        .where(
+            Transaction.id == transaction.id,
+            # مفتاح التقسيم: يقرأ قسماً واحداً عند تقسيم الجدول
+            Transaction.created_at == transaction.created_at,
+            Transaction.status == from_status
+        )
+        .values(status=status, **values)
+        .execution_options(synchronize_session="evaluate")
+    )
+    if result.rowcount == 0:
+        logger.info(f"🔁 المعاملة {transaction.id} لم تعد {from_status}")
+        return False
+    # UPDATE الأساسي لا يظهر في after_flush، فصاحب المعاملة يُسجل يدوياً لقراءة كتابته
+    mark_user_write_pending(db, transaction.user_id)
+    return True
+
+
+def purge_idempotency_keys(bind=None) -> int:
+    """حذف مفاتيح العمليات الأقدم من IDEMPOTENCY_KEY_RETENTION_DAYS (مهمة صيانة دورية)"""
+    bind = bind or get_engine()
+    cutoff = datetime.utcnow() - timedelta(days=Config.IDEMPOTENCY_KEY_RETENTION_DAYS)
+    with bind.begin() as conn:
+        deleted = conn.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff)).rowcount
+    if deleted:
+        logger.info(f"🧹 تم حذف {deleted} مفتاح عملية منتهي")
+    return deleted
@@ -0,0 +1,35 @@
+"""
+لوحات المفاتيح الثابتة - تُبنى مرة واحدة عند الاستيراد
+
+كائنات telegram غير قابلة للتعديل، فمشاركتها بين كل الرسائل آمنة.
+نصوص الأزرار هنا هي نفسها مفاتيح التوجيه في utils/router.py.
+"""
+from telegram import ReplyKeyboardMarkup, KeyboardButton
+
+# ========== القائمة الرئيسية ==========
+BTN_ICHANCY = "👤 Ichancy"
+BTN_DEPOSIT = "💳 شحن رصيد"
+BTN_WITHDRAW = "💰 سحب رصيد"
+BTN_REFERRALS = "👥 نظام الاحالات"
+BTN_GIFT_CODE = "🎁 كود هدية"
+BTN_GIFT_BALANCE = "🎁 اهداء رصيد"
+BTN_CONTACT = "📞 تواصل معنا"
+BTN_SUPPORT = "🆘 تواصل مع الدعم"
+BTN_HISTORY = "📋 السجل"
+BTN_TUTORIALS = "📚 الشروحات"
+BTN_BETS = "⚡ سجل الرهانات"
+BTN_SETTINGS = "⚙️ الإعدادات"
+
+MAIN_MENU_LAYOUT = [
+    [BTN_ICHANCY, BTN_DEPOSIT],
+    [BTN_WITHDRAW, BTN_REFERRALS],
+    [BTN_GIFT_CODE, BTN_GIFT_BALANCE],
+    [BTN_CONTACT, BTN_SUPPORT],
+    [BTN_HISTORY, BTN_TUTORIALS],
+    [BTN_BETS, BTN_SETTINGS]
+]
+
+MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton(label) for label in row] for row in MAIN_MENU_LAYOUT],
+    resize_keyboard=True
+)
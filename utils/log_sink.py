@@ -0,0 +1,129 @@
+"""
+كتابة سجلات الإدمن والنظام على دفعات
+
+بدلاً من جلسة و commit لكل سجل، تُجمع الصفوف في الذاكرة وتُكتب بعبارة INSERT
+متعددة الصفوف كل LOG_FLUSH_INTERVAL_MS أو عند تجمع LOG_FLUSH_BATCH صف.
+يجب استدعاء close() عند إيقاف العملية لكتابة ما تبقى.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from config import Config
+from database.models import async_engine, AdminLog, SystemLog
+
+logger = logging.getLogger(__name__)
+
+
+class LogSink:
+    """مخزن مؤقت غير متزامن لجداول السجلات"""
+
+    def __init__(self):
+        self._buffers: Dict[Any, List[Dict[str, Any]]] = {
+            AdminLog.__table__: [],
+            SystemLog.__table__: []
+        }
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._closing = False
+        self.dropped = 0
+
+    def admin(
+        self,
+        admin_id: int,
+        action_type: str,
+        details: Optional[Dict] = None,
+        target_id: Optional[int] = None,
+        ip_address: Optional[str] = None
+    ):
+        """إضافة سجل إجراء إدمن (بدون انتظار قاعدة البيانات)"""
+        self._add(AdminLog.__table__, {
+            "admin_id": admin_id,
+            "action_type": action_type,
+            "target_id": target_id,
+            "details": details,
+            "ip_address": ip_address,
+            "created_at": datetime.utcnow()
+        })
+
+    def system(self, log_level: str, module: str, message: str, data: Optional[Dict] = None):
+        """إضافة سجل نظام (بدون انتظار قاعدة البيانات)"""
+        self._add(SystemLog.__table__, {
+            "log_level": log_level,
+            "module": module,
+            "message": message,
+            "data": data,
+            "created_at": datetime.utcnow()
+        })
+
+    def pending(self) -> int:
+        return sum(len(rows) for rows in self._buffers.values())
+
+    def _add(self, table, row: Dict[str, Any]):
+        rows = self._buffers[table]
+        rows.append(row)
+
+        # حماية الذاكرة إذا تعطلت قاعدة البيانات لفترة طويلة
+        if len(rows) > Config.LOG_BUFFER_MAX:
+            del rows[0]
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"⚠️ مخزن السجلات ممتلئ - تم إسقاط {self.dropped} سجل")
+
+        self._ensure_started()
+        if len(rows) >= Config.LOG_FLUSH_BATCH:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        interval = Config.LOG_FLUSH_INTERVAL_MS / 1000
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """كتابة كل ما في المخزن - الصفوف تعود للمخزن إذا فشلت الكتابة"""
+        if self._flush_lock is None:
+            return
+
+        async with self._flush_lock:
+            for table, rows in self._buffers.items():
+                if not rows:
+                    continue
+                batch = rows[:]
+                rows.clear()
+                try:
+                    async with async_engine.begin() as conn:
+                        await conn.execute(insert(table), batch)
+                except Exception as e:
+                    logger.error(f"❌ فشل كتابة {len(batch)} سجل في {table.name}: {e}")
+                    rows[:0] = batch[-Config.LOG_BUFFER_MAX:]
+
+    async def close(self):
+        """إيقاف الكتابة الدورية وكتابة المتبقي (عند إيقاف البوت)"""
+        # بدون cancel حتى لا تُقطع دفعة أثناء كتابتها
+        if self._task is not None and not self._task.done():
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+        self._task = None
+        self._closing = False
+        await self.flush()
+
+
+# إنشاء instance عام
+log_sink = LogSink()
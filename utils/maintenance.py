@@ -0,0 +1,158 @@
+"""
+مهام الصيانة الدورية داخل عملية البوت
+
+تبدأ من IChancyBot.on_startup (polling و webhook وعمال الأقسام) وتتوقف في on_stop.
+المهام المتزامنة (محرك قاعدة البيانات المتزامن) تعمل في خيط منفصل عبر asyncio.to_thread
+فلا تحجب حلقة الأحداث.
+
+كل العمليات (عمال الأقسام ونسخ الـ Webhook) تستدعي start، لكن المهام تعمل في عملية واحدة
+فقط: صاحبة القفل الاستشاري (7302, 0) في PostgreSQL. MAINTENANCE_JOBS_ENABLED=false يستثني
+العملية من المنافسة على القفل.
+"""
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_DAY = 24 * 60 * 60
+
+# المفتاح الأول لـ pg_try_advisory_lock (utils/balance.py يستخدم 7301)
+_LOCK_NAMESPACE = 7302
+_LEADER_RETRY_SECONDS = 30
+
+
+async def _balance_snapshots():
+    """لقطات الأرصدة في خيط منفصل ثم إبطال كاش من تحدث users.balance لديهم
+
+    التحديث بـ Core على اتصال متزامن لا يمر بأحداث الجلسة التي تبطل الكاش تلقائياً.
+    """
+    from database.ledger import take_balance_snapshots
+    from utils.cache import user_cache
+
+    refreshed: List[int] = []
+    await asyncio.to_thread(take_balance_snapshots, None, refreshed)
+    user_cache.invalidate(*refreshed)
+
+
+def _jobs() -> List[Tuple[str, float, Callable]]:
+    """(الاسم، كل كم ثانية، الدالة)"""
+    from utils.idempotency import purge_idempotency_keys
+    from utils.syriatel_allocator import syriatel_allocator, purge_syriatel_reservations
+
+    jobs = [
+        ("balance_snapshots", Config.BALANCE_SNAPSHOT_INTERVAL_MINUTES * 60, _balance_snapshots),
+        ("syriatel_release_expired", 60, syriatel_allocator.release_expired),
+        ("syriatel_purge_reservations", _DAY, purge_syriatel_reservations),
+        ("idempotency_purge_keys", _DAY, purge_idempotency_keys),
+    ]
+
+    if Config.TRANSACTIONS_PARTITIONED:
+        from database.partitions import ensure_future_partitions, archive_old_partitions
+
+        jobs.append(("partitions_ensure", _DAY, ensure_future_partitions))
+        jobs.append(("partitions_archive", _DAY, archive_old_partitions))
+
+    return jobs
+
+
+class MaintenanceJobs:
+    """تشغيل مهام الصيانة كل فترة في عملية واحدة فقط حتى الإيقاف
+
+    كل العمليات تحاول أخذ قفل استشاري على اتصال مخصص، ومن يأخذه يشغل كل المهام ما دام
+    الاتصال قائماً. إذا توقفت العملية أو انقطع اتصالها يتحرر القفل وتأخذه عملية أخرى خلال
+    _LEADER_RETRY_SECONDS. بدون PostgreSQL (تطوير محلي) تعمل المهام مباشرة.
+    """
+
+    def __init__(self):
+        self._leader: Optional[asyncio.Task] = None
+        self.is_leader = False
+
+    def start(self):
+        if not Config.MAINTENANCE_JOBS_ENABLED or self._leader is not None:
+            return
+        self._leader = asyncio.get_running_loop().create_task(self._lead())
+
+    async def _lead(self):
+        from database.models import async_engine
+
+        while True:
+            conn = None
+            try:
+                if async_engine.dialect.name == "postgresql":
+                    conn = await async_engine.connect()
+                    # بدون معاملة مفتوحة طوال فترة القيادة
+                    await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    if not await conn.scalar(
+                        text("SELECT pg_try_advisory_lock(:namespace, 0)"),
+                        {"namespace": _LOCK_NAMESPACE}
+                    ):
+                        await self._release(conn)
+                        conn = None
+                        await asyncio.sleep(_LEADER_RETRY_SECONDS)
+                        continue
+
+                await self._run_jobs(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ توقفت مهام الصيانة في هذه العملية: {e}")
+                await asyncio.sleep(_LEADER_RETRY_SECONDS)
+            finally:
+                if conn is not None:
+                    await self._release(conn)
+
+    async def _run_jobs(self, conn):
+        """تشغيل المهام حتى الإلغاء أو انقطاع اتصال القفل"""
+        loop = asyncio.get_running_loop()
+        tasks = [loop.create_task(self._run(name, interval, job)) for name, interval, job in _jobs()]
+        self.is_leader = True
+        logger.info(f"🛠️ هذه العملية تشغل {len(tasks)} مهمة صيانة")
+        try:
+            while True:
+                await asyncio.sleep(_LEADER_RETRY_SECONDS)
+                if conn is not None:
+                    # القفل مرتبط بالاتصال: فشل هذا يعني أنه تحرر وقد تأخذه عملية أخرى
+                    await conn.scalar(text("SELECT 1"))
+        finally:
+            self.is_leader = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _release(conn):
+        # إلغاء الاتصال بدل إعادته للمجمع حتى لا يبقى القفل معه
+        try:
+            await conn.invalidate()
+        except Exception:
+            pass
+        await conn.close()
+
+    async def _run(self, name: str, interval: float, job: Callable):
+        # كل المهام تعمل عند بدء القيادة أيضاً: إعادة التشغيل المتكررة لا تؤجل المهام اليومية للأبد
+        while True:
+            try:
+                if asyncio.iscoroutinefunction(job):
+                    await job()
+                else:
+                    await asyncio.to_thread(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ فشلت مهمة الصيانة {name}: {e}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._leader is not None:
+            self._leader.cancel()
+            await asyncio.gather(self._leader, return_exceptions=True)
+            self._leader = None
+
+
+# إنشاء instance عام
+maintenance = MaintenanceJobs()
@@ -0,0 +1,107 @@
+"""
+ترقيم الصفحات بالمؤشر (keyset pagination) على (created_at, id)
+
+كل صفحة تبدأ من آخر صف في الصفحة السابقة بدلاً من OFFSET، فتكلفتها ثابتة مهما كان العمق.
+المؤشر نص قصير (أحرف وأرقام ونقطة) ليتسع داخل callback_data (64 بايت).
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Transaction
+
+NEXT = "n"
+PREV = "p"
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# أكبر BIGINT في PostgreSQL
+_MAX_ID = 2 ** 63 - 1
+
+
+def _to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if number == 0:
+            return result
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """(created_at, id) -> مؤشر نصي"""
+    micros = (created_at - _EPOCH) // _MICROSECOND
+    return f"{_to_base36(micros)}.{_to_base36(row_id)}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """مؤشر نصي -> (created_at, id) - يرفع ValueError إذا كان غير صالح"""
+    parts = cursor.split(".")
+    # int() يقبل أيضاً الإشارة والمسافات و _ ، والمؤشر الذي نُصدره أحرف وأرقام فقط
+    if len(parts) != 2 or not all(part.isascii() and part.isalnum() for part in parts):
+        raise ValueError(f"مؤشر غير صالح: {cursor!r}")
+    micros, row_id = (int(part, 36) for part in parts)
+    if row_id > _MAX_ID:
+        raise ValueError(f"مؤشر غير صالح: {cursor!r}")
+    try:
+        return _EPOCH + micros * _MICROSECOND, row_id
+    except OverflowError:
+        # تاريخ خارج نطاق datetime (مؤشر مُعدّل يدوياً)
+        raise ValueError(f"مؤشر غير صالح: {cursor!r}") from None
+
+
+class Page:
+    """صفحة من النتائج مع مؤشرات الصفحة التالية والسابقة (None إذا لم توجد)"""
+
+    def __init__(self, items: List, next_cursor: Optional[str], prev_cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+async def fetch_transactions_page(
+    db: AsyncSession,
+    query,
+    cursor: Optional[str] = None,
+    direction: str = NEXT,
+    page_size: int = 20,
+    newest_first: bool = True
+) -> Page:
+    """
+    جلب صفحة من استعلام معاملات مرتب على (created_at, id).
+    NEXT تتقدم في اتجاه الترتيب، و PREV تعود للخلف من المؤشر.
+    """
+    key = tuple_(Transaction.created_at, Transaction.id)
+    # الرجوع للخلف = نفس الاستعلام بترتيب معكوس ثم قلب النتائج
+    forward = direction != PREV
+    descending = newest_first if forward else not newest_first
+
+    if cursor:
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if descending else key > position)
+
+    if descending:
+        query = query.order_by(Transaction.created_at.desc(), Transaction.id.desc())
+    else:
+        query = query.order_by(Transaction.created_at.asc(), Transaction.id.asc())
+
+    # صف إضافي لمعرفة وجود صفحة بعدها دون COUNT
+    rows = list((await db.scalars(query.limit(page_size + 1))).all())
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if not forward:
+        rows.reverse()
+
+    if not rows:
+        return Page([], None, None)
+
+    first = encode_cursor(rows[0].created_at, rows[0].id)
+    last = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    if forward:
+        return Page(rows, last if has_more else None, first if cursor else None)
+    return Page(rows, last, first if has_more else None)
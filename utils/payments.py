@@ -7,11 +7,16 @@ from typing import Dict, List, Optional, Tuple
 from decimal import Decimal, ROUND_HALF_UP
 import asyncio
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from database.models import (
     User, Transaction, PaymentMethod, 
-    SyriatelCode, Bonus, GiftCode
+    SyriatelCode, GiftCode, GiftTransaction
 )
+from database.stats import record_transaction_completed, record_gift
+from utils.balance import balance_service
+from utils.idempotency import claim_operation
+from utils.bonus_rules import bonus_rules
 from config import Config
 from utils.security import SecurityUtils
 
@@ -24,7 +29,7 @@ class PaymentProcessor:
     
     async def process_deposit(
         self,
-        db: Session,
+        db: AsyncSession,
         user_id: int,
         amount: float,
         payment_method_id: int,
@@ -34,15 +39,15 @@ class PaymentProcessor:
         """معالجة عملية إيداع"""
         try:
             # الحصول على المستخدم
-            user = db.query(User).filter(User.id == user_id).first()
+            user = await db.get(User, user_id)
             if not user:
                 return False, "المستخدم غير موجود", None
             
             # الحصول على طريقة الدفع
-            method = db.query(PaymentMethod).filter(
+            method = await db.scalar(select(PaymentMethod).where(
                 PaymentMethod.id == payment_method_id,
                 PaymentMethod.is_active == True
-            ).first()
+            ))
             
             if not method:
                 return False, "طريقة الدفع غير متاحة", None
@@ -78,17 +83,18 @@ class PaymentProcessor:
             )
             
             db.add(transaction)
-            db.flush()  # للحصول على ID
+            await db.flush()  # للحصول على ID
             
             # تحديث رصيد المستخدم (مؤقتاً)
-            user.balance += total_amount
+            await balance_service.credit(db, user_id, total_amount, "deposit", transaction)
             
             # إذا كانت العملية مؤكدة فوراً
             if transaction_code and self.verify_transaction_code(transaction_code, method.name):
                 transaction.status = "completed"
                 transaction.auto_verified = True
                 transaction.completed_at = datetime.utcnow()
-                db.commit()
+                await record_transaction_completed(db, transaction)
+                await db.commit()
                 
                 # إشعار المستخدم
                 await self.notify_deposit_success(user, transaction, bonus)
@@ -96,7 +102,7 @@ class PaymentProcessor:
                 return True, f"تم الإيداع بنجاح! +{bonus:,.0f} مكافأة", transaction
             else:
                 transaction.status = "pending"
-                db.commit()
+                await db.commit()
                 
                 # إشعار الإدمن بطلب إيداع جديد
                 await self.notify_admin_pending_deposit(transaction)
@@ -104,13 +110,13 @@ class PaymentProcessor:
                 return True, "تم إرسال طلب الإيداع. في انتظار الموافقة.", transaction
                 
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في process_deposit: {e}")
             return False, "حدث خطأ في النظام", None
     
     async def process_withdrawal(
         self,
-        db: Session,
+        db: AsyncSession,
         user_id: int,
         amount: float,
         payment_method_id: int,
@@ -119,18 +125,10 @@ class PaymentProcessor:
     ) -> Tuple[bool, str, Optional[Transaction]]:
         """معالجة عملية سحب"""
         try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return False, "المستخدم غير موجود", None
-            
-            # التحقق من الرصيد
-            if user.balance < amount:
-                return False, "رصيدك غير كافي", None
-            
-            method = db.query(PaymentMethod).filter(
+            method = await db.scalar(select(PaymentMethod).where(
                 PaymentMethod.id == payment_method_id,
                 PaymentMethod.is_active == True
-            ).first()
+            ))
             
             if not method:
                 return False, "طريقة السحب غير متاحة", None
@@ -161,13 +159,18 @@ class PaymentProcessor:
             )
             
             db.add(transaction)
+            await db.flush()
             
-            # خصم الرصيد مؤقتاً
-            user.balance -= amount
+            # خصم الرصيد مؤقتاً - التحقق من الرصيد والخصم في عبارة واحدة
+            if await balance_service.debit(db, user_id, amount, "withdraw", transaction) is None:
+                await db.rollback()
+                if not await db.get(User, user_id):
+                    return False, "المستخدم غير موجود", None
+                return False, "رصيدك غير كافي", None
             
             # السحب دائماً يحتاج موافقة يدوية
             transaction.status = "pending"
-            db.commit()
+            await db.commit()
             
             # إشعار الإدمن بطلب سحب جديد
             await self.notify_admin_pending_withdrawal(transaction, account_info)
@@ -175,7 +178,7 @@ class PaymentProcessor:
             return True, "تم إرسال طلب السحب. في انتظار الموافقة.", transaction
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في process_withdrawal: {e}")
             return False, "حدث خطأ في النظام", None
     
@@ -195,34 +198,15 @@ class PaymentProcessor:
     
     async def calculate_bonus(
         self, 
-        db: Session, 
+        db: AsyncSession, 
         amount: float, 
         payment_method_id: int, 
         user_id: int
     ) -> float:
-        """حساب البونص"""
+        """حساب البونص (من القواعد المجمعة - بدون استعلام إلا عند إعادة التجميع)"""
         try:
-            bonus_amount = 0
-            
-            # البحث عن بونصات فعالة
-            bonuses = db.query(Bonus).filter(
-                Bonus.is_active == True,
-                Bonus.expires_at > datetime.utcnow()
-            ).all()
-            
-            for bonus in bonuses:
-                # البونص العادي
-                if bonus.bonus_type == "normal" and bonus.payment_method_id == payment_method_id:
-                    bonus_amount = amount * (bonus.percentage / 100)
-                    break
-                
-                # البونص المشروط
-                elif bonus.bonus_type == "conditional" and amount >= bonus.min_amount:
-                    if bonus.payment_method_id is None or bonus.payment_method_id == payment_method_id:
-                        bonus_amount = amount * (bonus.percentage / 100)
-                        break
-            
-            return round(bonus_amount, 2)
+            rules = await bonus_rules.get(db)
+            return rules.bonus_for(amount, payment_method_id)
             
         except Exception as e:
             logger.error(f"خطأ في calculate_bonus: {e}")
@@ -241,16 +225,16 @@ class PaymentProcessor:
     
     async def get_suitable_syriatel_code(
         self, 
-        db: Session, 
+        db: AsyncSession, 
         amount: float
     ) -> Optional[SyriatelCode]:
         """الحصول على كود سيرياتيل مناسب للمبلغ"""
         try:
             # البحث عن كود متاح
-            code = db.query(SyriatelCode).filter(
+            code = await db.scalar(select(SyriatelCode).where(
                 SyriatelCode.is_active == True,
-                (SyriatelCode.max_balance - SyriatelCode.current_balance) >= amount
-            ).order_by(SyriatelCode.current_balance).first()
+                (SyriatelCode.max_balance - SyriatelCode.current_balance - SyriatelCode.reserved_balance) >= amount
+            ).order_by(SyriatelCode.current_balance).limit(1))
             
             return code
         except Exception as e:
@@ -259,13 +243,13 @@ class PaymentProcessor:
     
     async def update_syriatel_code_balance(
         self, 
-        db: Session, 
+        db: AsyncSession, 
         code_id: int, 
         amount: float
     ) -> bool:
         """تحديث رصيد كود سيرياتيل"""
         try:
-            code = db.query(SyriatelCode).filter(SyriatelCode.id == code_id).first()
+            code = await db.get(SyriatelCode, code_id)
             if not code:
                 return False
             
@@ -276,49 +260,46 @@ class PaymentProcessor:
             if code.current_balance >= code.max_balance:
                 code.is_active = False
             
-            db.commit()
+            await db.commit()
             return True
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في update_syriatel_code_balance: {e}")
             return False
     
-    async def reset_syriatel_codes(self, db: Session) -> int:
+    async def reset_syriatel_codes(self, db: AsyncSession) -> int:
         """تصفير جميع أكواد سيرياتيل"""
         try:
-            count = db.query(SyriatelCode).filter(
+            result = await db.execute(update(SyriatelCode).where(
                 SyriatelCode.is_active == True
-            ).update({
+            ).values({
                 "current_balance": 0,
                 "is_active": True,
                 "last_used": None
-            })
+            }))
+            count = result.rowcount
             
-            db.commit()
+            await db.commit()
             logger.info(f"تم تصفير {count} كود سيرياتيل")
             return count
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في reset_syriatel_codes: {e}")
             return 0
     
     async def process_gift_code(
         self,
-        db: Session,
+        db: AsyncSession,
         user_id: int,
         code: str
     ) -> Tuple[bool, str, Optional[float]]:
         """معالجة كود هدية"""
         try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return False, "المستخدم غير موجود", None
-            
             # البحث عن الكود
-            gift_code = db.query(GiftCode).filter(
+            gift_code = await db.scalar(select(GiftCode).where(
                 GiftCode.code == code.upper(),
                 GiftCode.is_active == True
-            ).first()
+            ))
             
             if not gift_code:
                 return False, "كود الهدية غير صالح", None
@@ -336,9 +317,6 @@ class PaymentProcessor:
             if gift_code.used_count >= gift_code.max_uses:
                 gift_code.is_active = False
             
-            # تحديث رصيد المستخدم
-            user.balance += gift_code.amount
-            
             # تسجيل المعاملة
             transaction = Transaction(
                 user_id=user_id,
@@ -355,31 +333,40 @@ class PaymentProcessor:
             )
             
             db.add(transaction)
-            db.commit()
+            await db.flush()
+            
+            # تحديث رصيد المستخدم
+            if await balance_service.credit(db, user_id, gift_code.amount, "bonus", transaction) is None:
+                await db.rollback()
+                return False, "المستخدم غير موجود", None
+            
+            await record_transaction_completed(db, transaction)
+            await db.commit()
             
             return True, f"تم إضافة {gift_code.amount:,.0f} ليرة إلى رصيدك", gift_code.amount
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في process_gift_code: {e}")
             return False, "حدث خطأ في النظام", None
     
     async def process_gift_balance(
         self,
-        db: Session,
+        db: AsyncSession,
         sender_id: int,
         receiver_telegram_id: int,
-        amount: float
+        amount: float,
+        operation_key: Optional[str] = None
     ) -> Tuple[bool, str]:
-        """معالجة إهداء رصيد"""
+        """معالجة إهداء رصيد (operation_key يمنع تنفيذ نفس الطلب مرتين)"""
         try:
             # التحقق من المرسل
-            sender = db.query(User).filter(User.id == sender_id).first()
-            if not sender or sender.balance < amount:
+            sender = await db.get(User, sender_id)
+            if not sender:
                 return False, "رصيدك غير كافي"
             
             # البحث عن المستقبل
-            receiver = db.query(User).filter(User.telegram_id == receiver_telegram_id).first()
+            receiver = await db.scalar(select(User).where(User.telegram_id == receiver_telegram_id))
             if not receiver:
                 return False, "المستخدم المستقبل غير موجود"
             
@@ -387,17 +374,15 @@ class PaymentProcessor:
             if sender.id == receiver.id:
                 return False, "لا يمكن إهداء الرصيد لنفسك"
             
+            if operation_key and not await claim_operation(db, operation_key, sender.telegram_id):
+                await db.rollback()
+                return False, "تم تنفيذ هذا الإهداء مسبقاً"
+            
             # حساب العمولة
             fee_percentage = self.get_gift_fee_percentage()
             fee = amount * (fee_percentage / 100)
             net_amount = amount - fee
             
-            # خصم من المرسل
-            sender.balance -= amount
-            
-            # إضافة للمستقبل
-            receiver.balance += net_amount
-            
             # تسجيل المعاملة
             gift_transaction = GiftTransaction(
                 sender_id=sender.id,
@@ -408,7 +393,17 @@ class PaymentProcessor:
             )
             
             db.add(gift_transaction)
-            db.commit()
+            await db.flush()
+            
+            # خصم من المرسل وإضافة للمستقبل (فحص الرصيد ذري)
+            if await balance_service.transfer(
+                db, sender.id, receiver.id, amount, net_amount, gift_transaction
+            ) is None:
+                await db.rollback()
+                return False, "رصيدك غير كافي"
+            
+            await record_gift(db, sender.id, receiver.id, amount, net_amount)
+            await db.commit()
             
             # إشعار كلا المستخدمين
             await self.notify_gift_sent(sender, receiver, amount, net_amount)
@@ -417,7 +412,7 @@ class PaymentProcessor:
             return True, f"تم إرسال {net_amount:,.0f} ليرة للمستخدم (خصم {fee:,.0f} ليرة عمولة)"
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"خطأ في process_gift_balance: {e}")
             return False, "حدث خطأ في النظام"
     
@@ -0,0 +1,268 @@
+"""
+حفظ حالة المحادثات و user_data في Redis (مشتركة بين نسخ البوت وتبقى بعد إعادة التشغيل)
+
+user_data يحمل حالة العمليات الجارية (deposit_method و deposit_amount و syriatel_code_id ...)
+وحالة ConversationHandler تحدد المعالج التالي، فبدون هذا تضيع عند إعادة التشغيل أو عند
+وصول تحديث المستخدم التالي لنسخة أخرى.
+
+- قبل كل تحديث: قراءة حالة صاحبه فقط (مفتاح user_data + مفتاح كل محادثة) في رحلة واحدة.
+- بعد التحديث: كتابة ما تغير فقط في رحلة واحدة (أغلب التحديثات لا تغير شيئاً فلا تكتب).
+- كل مفتاح بمهلة PERSISTENCE_TTL تتجدد عند الكتابة، فحالة المستخدمين غير النشطين تُحذف وحدها.
+- إذا تعطل Redis تعمل كل نسخة بذاكرتها فقط حتى يعود.
+
+التحميل يتم في process_update وليس refresh_user_data لأن ConversationHandler يختار
+المعالج حسب الحالة قبل استدعاء refresh_user_data.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from telegram.ext._conversationhandler import PendingState
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_USER_KEY = "ptb:user:{}"
+_CONVERSATION_KEY = "ptb:conv:{}:{}"
+
+
+class RedisPersistence(BasePersistence):
+    """BasePersistence فوق Redis - user_data وحالات المحادثات فقط"""
+
+    def __init__(self):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=Config.PERSISTENCE_UPDATE_INTERVAL
+        )
+        self._redis = None
+        self._redis_down_until = 0.0
+        # آخر قيمة قُرئت أو كُتبت لكل مفتاح - لتخطي كتابة ما لم يتغير
+        self._known: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        # مستخدمون فشل حفظ حالتهم - نسختنا أحدث من Redis فلا تُستبدل عند التحميل
+        self._unsaved = set()
+        self.counters = {
+            "loads": 0,
+            "writes": 0,
+            "skipped_writes": 0,
+            "redis_errors": 0
+        }
+
+    # ========== Redis ==========
+
+    def _client(self):
+        if self._redis is None:
+            from redis.asyncio import Redis
+
+            self._redis = Redis.from_url(
+                Config.REDIS_URL,
+                socket_timeout=Config.PERSISTENCE_REDIS_TIMEOUT,
+                socket_connect_timeout=Config.PERSISTENCE_REDIS_TIMEOUT
+            )
+        return self._redis
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e: Exception):
+        self.counters["redis_errors"] += 1
+        if self._redis_available():
+            logger.warning(f"⚠️ Redis غير متاح - حالة المحادثات في ذاكرة هذه النسخة فقط لمدة 30 ثانية: {e}")
+        self._redis_down_until = time.monotonic() + 30
+        # بعد الانقطاع لا نثق بما نعرفه عن محتوى Redis
+        self._known.clear()
+
+    def _remember(self, key: str, payload: Optional[str]):
+        self._known[key] = payload
+        self._known.move_to_end(key)
+        while len(self._known) > Config.PERSISTENCE_KNOWN_KEYS:
+            self._known.popitem(last=False)
+
+    async def _write(self, items: List[Tuple[str, Optional[str]]], only_known: bool = False) -> bool:
+        """كتابة المفاتيح المتغيرة فقط في رحلة واحدة (None = حذف) - False إذا تعذرت الكتابة"""
+        changed = []
+        for key, payload in items:
+            if key in self._known and self._known[key] == payload:
+                self.counters["skipped_writes"] += 1
+            elif only_known and key not in self._known:
+                # لا نعرف ما في Redis - قد تكون نسخة أخرى كتبت أحدث منا
+                self.counters["skipped_writes"] += 1
+            else:
+                changed.append((key, payload))
+        if not changed:
+            return True
+        if not self._redis_available():
+            return False
+
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            for key, payload in changed:
+                if payload is None:
+                    pipe.delete(key)
+                else:
+                    pipe.set(key, payload, ex=Config.PERSISTENCE_TTL)
+            await pipe.execute()
+        except Exception as e:
+            self._redis_failed(e)
+            return False
+
+        self.counters["writes"] += len(changed)
+        for key, payload in changed:
+            self._remember(key, payload)
+        return True
+
+    @staticmethod
+    def _dump(data: Any) -> Optional[str]:
+        if data is None or data == {}:
+            return None
+        return json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+    # ========== التحميل والحفظ لكل تحديث ==========
+
+    @staticmethod
+    def _conversations(application, update: Update) -> List[Tuple[str, Any, Any]]:
+        """(اسم المحادثة، مفتاح هذا التحديث، قاموس حالاتها) لكل ConversationHandler محفوظ"""
+        out = []
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if not (isinstance(handler, ConversationHandler) and handler.persistent):
+                    continue
+                try:
+                    # نفس المفتاح الذي يستخدمه ConversationHandler (per_chat/per_user/per_message)
+                    key = handler._get_key(update)
+                except RuntimeError:
+                    continue
+                out.append((handler.name, key, handler._conversations))
+        return out
+
+    async def load_update(self, application, update: Update):
+        """جلب حالة صاحب التحديث من Redis قبل معالجته"""
+        user = update.effective_user
+        if user is None or user.id in self._unsaved or not self._redis_available():
+            return
+
+        conversations = self._conversations(application, update)
+        keys = [_USER_KEY.format(user.id)] + [
+            _CONVERSATION_KEY.format(name, json.dumps(list(key))) for name, key, _ in conversations
+        ]
+        try:
+            values = await self._client().mget(keys)
+        except Exception as e:
+            self._redis_failed(e)
+            return
+
+        self.counters["loads"] += 1
+        values = [value.decode() if value is not None else None for value in values]
+        for key, value in zip(keys, values):
+            self._remember(key, value)
+
+        user_data = application.user_data[user.id]
+        user_data.clear()
+        if values[0] is not None:
+            user_data.update(json.loads(values[0]))
+
+        for (name, key, states), value in zip(conversations, values[1:]):
+            if value is None:
+                # بدون تتبع: الحذف ليس تغييراً يجب كتابته
+                states.data.pop(key, None)
+            else:
+                states.update_no_track({key: json.loads(value)})
+
+    async def save_update(self, application, update: Update):
+        """كتابة حالة صاحب التحديث بعد معالجته (ما تغير فقط)"""
+        user = update.effective_user
+        if user is None:
+            return
+
+        items = []
+        try:
+            items.append((_USER_KEY.format(user.id), self._dump(application.user_data.get(user.id))))
+        except (TypeError, ValueError) as e:
+            logger.error(f"❌ user_data للمستخدم {user.id} غير قابلة للحفظ: {e}")
+
+        for name, key, states in self._conversations(application, update):
+            state = states.get(key)
+            if isinstance(state, PendingState):
+                # معالج غير متزامن لم ينته - يحفظه update_persistence الدوري
+                continue
+            items.append((_CONVERSATION_KEY.format(name, json.dumps(list(key))), self._dump(state)))
+
+        if await self._write(items):
+            self._unsaved.discard(user.id)
+        else:
+            self._unsaved.add(user.id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "unsaved_users": len(self._unsaved), "redis": self._redis_available()}
+
+    # ========== BasePersistence ==========
+    # الحالة تُحمّل لكل تحديث في load_update، فلا شيء يُحمّل عند التشغيل.
+    # update_* يستدعيها update_persistence الدوري: تغييرات خارج معالجة التحديثات فقط،
+    # وما حُفظ بعد التحديث يُتخطى لأنه لم يتغير.
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]) -> None:
+        try:
+            payload = self._dump(new_state)
+        except (TypeError, ValueError):
+            return
+        await self._write([(_CONVERSATION_KEY.format(name, json.dumps(list(key))), payload)], only_known=True)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        try:
+            payload = self._dump(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"❌ user_data للمستخدم {user_id} غير قابلة للحفظ: {e}")
+            return
+        await self._write([(_USER_KEY.format(user_id), payload)], only_known=True)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._write([(_USER_KEY.format(user_id), None)])
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+# إنشاء instance عام
+redis_persistence = RedisPersistence()
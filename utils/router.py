@@ -0,0 +1,105 @@
+"""
+جدول توجيه الرسائل والـ Callbacks
+
+نص أزرار لوحة المفاتيح: قاموس (O(1)).
+callback_data: قاموس للقيم الثابتة + شجرة بادئات (trie) لقيم مثل history_deposits_n_<cursor>،
+وتُختار أطول بادئة مسجلة. callback_data لا يتجاوز 64 بايت فالبحث لا يتجاوز 64 خطوة.
+
+التسجيل من UserHandlers / AdminHandlers عبر register_routes(router):
+    router.text("📋 السجل", self.show_transaction_history)              # (update, context, user)
+    router.callback("list_referrals", self.show_referral_list)            # (update, context, user)
+    router.callback_prefix("history_", self.on_history)                   # (update, context, user, data)
+    router.callback("admin_users", ..., admin_only=True)
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class Route:
+    __slots__ = ("handler", "admin_only", "with_data")
+
+    def __init__(self, handler: Handler, admin_only: bool, with_data: bool):
+        self.handler = handler
+        self.admin_only = admin_only
+        self.with_data = with_data
+
+
+class _TrieNode:
+    __slots__ = ("children", "route")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.route: Optional[Route] = None
+
+
+class Router:
+    """توجيه التحديثات إلى المعالجات المسجلة"""
+
+    def __init__(self):
+        self._text: Dict[str, Route] = {}
+        self._callbacks: Dict[str, Route] = {}
+        self._prefixes = _TrieNode()
+
+    # ========== التسجيل ==========
+
+    def text(self, label: str, handler: Handler, admin_only: bool = False):
+        self._check_new(label, label in self._text)
+        self._text[label] = Route(handler, admin_only, with_data=False)
+
+    def callback(self, data: str, handler: Handler, admin_only: bool = False):
+        self._check_new(data, data in self._callbacks)
+        self._callbacks[data] = Route(handler, admin_only, with_data=False)
+
+    def callback_prefix(self, prefix: str, handler: Handler, admin_only: bool = False):
+        node = self._prefixes
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        self._check_new(prefix, node.route is not None)
+        node.route = Route(handler, admin_only, with_data=True)
+
+    @staticmethod
+    def _check_new(key: str, exists: bool):
+        # التسجيل مرتين خطأ برمجي يُكتشف عند التشغيل
+        if exists:
+            raise ValueError(f"المسار مسجل مسبقاً: {key}")
+
+    # ========== البحث ==========
+
+    def match_callback(self, data: str) -> Optional[Route]:
+        """القيمة الثابتة أولاً ثم أطول بادئة مطابقة"""
+        route = self._callbacks.get(data)
+        if route is not None:
+            return route
+
+        node = self._prefixes
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route is not None:
+                route = node.route
+        return route
+
+    async def dispatch_text(self, text: str, update, context, user) -> Tuple[bool, Any]:
+        """(وُجد مسار؟، نتيجة المعالج)"""
+        return await self._call(self._text.get(text), text, update, context, user)
+
+    async def dispatch_callback(self, data: str, update, context, user) -> Tuple[bool, Any]:
+        """(وُجد مسار؟، نتيجة المعالج)"""
+        return await self._call(self.match_callback(data), data, update, context, user)
+
+    async def _call(self, route: Optional[Route], key: str, update, context, user) -> Tuple[bool, Any]:
+        if route is None:
+            return False, None
+        if route.admin_only and user.telegram_id not in Config.ADMIN_IDS:
+            logger.warning(f"⚠️ محاولة وصول لمسار إدمن {key!r} من {user.telegram_id}")
+            return False, None
+        if route.with_data:
+            return True, await route.handler(update, context, user, key)
+        return True, await route.handler(update, context, user)
@@ -0,0 +1,265 @@
+"""
+طابور الإرسال إلى تيليجرام مع حدود المعدل
+
+يُركب كـ rate_limiter للتطبيق، فكل طلب Bot API يحمل chat_id (send_message و reply_text
+و edit_message_text ...) ينتظر دوره هنا قبل الإرسال:
+- دلو رموز عام SEND_GLOBAL_RATE رسالة/ثانية، ودلو لكل محادثة (المجموعات والقنوات أبطأ).
+- مسارات أولوية: ردود المستخدمين ثم إشعارات الإدارة ثم الرسائل الجماعية.
+- عند 429 (RetryAfter) يتوقف كل الإرسال للمدة المطلوبة ثم يُعاد الطلب تلقائياً.
+
+الأولوية عبر rate_limit_args:
+    await context.bot.send_message(chat_id, text, rate_limit_args=PRIORITY_ADMIN)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+_LANE_NAMES = ("user", "admin", "bulk")
+
+# عدد الطلبات التي يُفحص أولها في كل مسار بحثاً عن محادثة جاهزة
+_SCAN_LIMIT = 200
+
+
+class _Bucket:
+    """دلو رموز: rate رمز/ثانية بسعة burst"""
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("chat_key", "future", "enqueued_at")
+
+    def __init__(self, chat_key, future: asyncio.Future):
+        self.chat_key = chat_key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class SendQueue(BaseRateLimiter):
+    """جدولة طلبات الإرسال حسب الأولوية وحدود تيليجرام"""
+
+    def __init__(self):
+        self._lanes: Tuple[Deque[_Waiter], ...] = tuple(deque() for _ in _LANE_NAMES)
+        self._global: Optional[_Bucket] = None
+        self._chats: Dict[Any, _Bucket] = {}
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {
+            "sent": 0,
+            "flood_waits": 0,
+            "retries": 0,
+            "failed": 0,
+            "wait_ms_total": 0.0
+        }
+
+    async def initialize(self) -> None:
+        rate = Config.SEND_GLOBAL_RATE
+        if Config.BOT_MODE == "shard_worker":
+            # حد تيليجرام لكل البوت - يُقسم بالتساوي بين العمال
+            rate /= Config.SHARD_COUNT
+        self._global = _Bucket(rate, rate)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # الطلبات المنتظرة تُرسل مباشرة بدل أن تعلق
+        for lane in self._lanes:
+            while lane:
+                waiter = lane.popleft()
+                if not waiter.future.done():
+                    waiter.future.set_result(None)
+
+    # ========== الطلبات ==========
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict, List[Dict]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict, List[Dict]]:
+        chat_id = data.get("chat_id")
+        priority = rate_limit_args if rate_limit_args is not None else PRIORITY_USER
+
+        attempt = 0
+        while True:
+            if chat_id is not None and self._task is not None:
+                await self._acquire(chat_id, priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.counters["flood_waits"] += 1
+                self._pause(e.retry_after)
+                if attempt >= Config.SEND_MAX_RETRIES:
+                    self.counters["failed"] += 1
+                    raise
+                attempt += 1
+                self.counters["retries"] += 1
+                logger.warning(f"⚠️ 429 من تيليجرام ({endpoint}) - إيقاف الإرسال {e.retry_after} ثانية")
+                if self._task is None:
+                    await asyncio.sleep(e.retry_after)
+                continue
+
+            if chat_id is not None:
+                self.counters["sent"] += 1
+            return result
+
+    async def _acquire(self, chat_id, priority: int):
+        waiter = _Waiter(chat_id, asyncio.get_running_loop().create_future())
+        self._lanes[min(max(priority, 0), len(self._lanes) - 1)].append(waiter)
+        self._wakeup.set()
+        # إلغاء المهمة يلغي future فيتخطاه المجدول
+        await waiter.future
+        self.counters["wait_ms_total"] += (time.monotonic() - waiter.enqueued_at) * 1000
+
+    def _pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ========== الجدولة ==========
+
+    def _chat_bucket(self, chat_id) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # المعرفات السالبة و @username مجموعات أو قنوات
+            if isinstance(chat_id, str) or chat_id < 0:
+                rate = Config.SEND_GROUP_RATE_PER_MINUTE / 60
+                bucket = _Bucket(rate, 1)
+            else:
+                bucket = _Bucket(Config.SEND_CHAT_RATE, Config.SEND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self, now: float) -> Tuple[Optional[Deque[_Waiter]], Optional[_Waiter], float]:
+        """أول طلب جاهز حسب الأولوية، أو أقرب وقت يصبح فيه أحدها جاهزاً"""
+        soonest = 1.0
+        for lane in self._lanes:
+            for index, waiter in enumerate(lane):
+                if index >= _SCAN_LIMIT:
+                    break
+                if waiter.future.done():
+                    continue
+                bucket = self._chat_bucket(waiter.chat_key)
+                bucket.refill(now)
+                wait = bucket.wait_time()
+                if wait == 0:
+                    return lane, waiter, 0.0
+                soonest = min(soonest, wait)
+        return None, None, soonest
+
+    async def _dispatch(self):
+        while True:
+            try:
+                if not any(self._lanes):
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._global.refill(now)
+                if self._global.tokens < 1:
+                    await asyncio.sleep(self._global.wait_time())
+                    continue
+
+                lane, waiter, wait = self._next_ready(now)
+                if waiter is None:
+                    self._drop_cancelled()
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                lane.remove(waiter)
+                self._global.tokens -= 1
+                self._chats[waiter.chat_key].tokens -= 1
+                waiter.future.set_result(None)
+                self._trim_buckets(now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ خطأ في طابور الإرسال: {e}")
+                await asyncio.sleep(0.1)
+
+    def _drop_cancelled(self):
+        for lane in self._lanes:
+            for waiter in [w for w in lane if w.future.done()]:
+                lane.remove(waiter)
+
+    def _trim_buckets(self, now: float):
+        # دلاء المحادثات الممتلئة لا تحمل أي حالة - حذفها يبقي القاموس صغيراً
+        if len(self._chats) <= 10000:
+            return
+        waiting = {waiter.chat_key for lane in self._lanes for waiter in lane}
+        for chat_id, bucket in list(self._chats.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst and chat_id not in waiting:
+                del self._chats[chat_id]
+
+    # ========== المقاييس ==========
+
+    def stats(self) -> Dict[str, Any]:
+        sent = self.counters["sent"]
+        return {
+            "depth": {name: len(lane) for name, lane in zip(_LANE_NAMES, self._lanes)},
+            "sent": sent,
+            "flood_waits": self.counters["flood_waits"],
+            "retries": self.counters["retries"],
+            "failed": self.counters["failed"],
+            "avg_wait_ms": round(self.counters["wait_ms_total"] / sent, 1) if sent else 0.0,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+
+
+# إنشاء instance عام
+send_queue = SendQueue()
+
+
+async def send_to_many(bot, chat_ids: Iterable, text: str, priority: int = PRIORITY_ADMIN, **kwargs) -> int:
+    """إرسال نفس الرسالة لعدة محادثات معاً (الطابور ينظم المعدل) - يرجع عدد الناجحة"""
+    chat_ids = list(chat_ids)
+    results = await asyncio.gather(*[
+        bot.send_message(chat_id=chat_id, text=text, rate_limit_args=priority, **kwargs)
+        for chat_id in chat_ids
+    ], return_exceptions=True)
+
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"فشل الإرسال إلى {chat_id}: {result}")
+    return sum(1 for result in results if not isinstance(result, Exception))
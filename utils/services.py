@@ -0,0 +1,80 @@
+"""
+سجل خدمات التطبيق - كل خدمة تُنشأ مرة واحدة عند أول طلب
+
+المعالجات تصل للبوت والخدمات المشتركة من هنا بدل إنشاء نسخ جديدة في كل استدعاء
+(IChancyBot() كان يُنشئ UserHandlers و AdminHandlers و PaymentProcessor لكل عرض للقائمة).
+الاستيراد يتم داخل المُنشئ فلا تُحمّل الوحدات الثقيلة ولا تحدث استيرادات دائرية عند الاستيراد.
+
+    from utils.services import services
+    await services.bot.show_main_menu(update, context, user)
+"""
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    """singletons التطبيق"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """تسجيل مُنشئ الخدمة (لا يُستدعى حتى أول طلب)"""
+        self._factories[name] = factory
+
+    def provide(self, name: str, instance: Any) -> Any:
+        """تسجيل نسخة أُنشئت مسبقاً (مثل البوت عند تشغيل main_bot مباشرة)"""
+        self._instances[name] = instance
+        return instance
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is None:
+            instance = self._instances[name] = self._factories[name]()
+            logger.debug(f"تم إنشاء الخدمة {name}")
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(f"خدمة غير مسجلة: {name}") from None
+
+
+def _bot():
+    from main_bot import IChancyBot
+    return IChancyBot()
+
+
+def _user_handlers():
+    from handlers.user_handlers import user_handlers
+    return user_handlers
+
+
+def _admin_handlers():
+    from handlers.admin_handlers import admin_handlers
+    return admin_handlers
+
+
+def _payment_processor():
+    from utils.payments import payment_processor
+    return payment_processor
+
+
+def _ichancy():
+    from webhook.ichancy_client import ichancy_webhook
+    return ichancy_webhook
+
+
+# إنشاء instance عام
+services = ServiceRegistry()
+services.register("bot", _bot)
+services.register("user_handlers", _user_handlers)
+services.register("admin_handlers", _admin_handlers)
+services.register("payment_processor", _payment_processor)
+services.register("ichancy", _ichancy)
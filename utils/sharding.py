@@ -0,0 +1,203 @@
+"""
+توزيع تحديثات تيليجرام على عدة عمليات (BOT_MODE=shard_front / shard_worker)
+
+الواجهة (webhook/telegram_front.py) تستقبل التحديث وتضعه كما هو في قائمة Redis للقسم
+telegram_id % SHARD_COUNT، وكل عامل يشغل Application كاملاً ويقرأ قائمته فقط.
+كل تحديثات المستخدم الواحد تصل لنفس العامل بالترتيب (داخله PerUserUpdateProcessor يحفظ الترتيب)،
+فيمكن تشغيل عامل لكل نواة وعلى عدة أجهزة تشترك في نفس Redis.
+
+التحديث لا يُحذف عند سحبه: ينتقل ذرياً إلى قائمة المعالجة للقسم (tg:shard:<n>:processing)
+ويُحذف منها بعد انتهاء معالجته. عند بدء العامل يُعاد ما بقي فيها إلى رأس القائمة، فلا يضيع تحديث
+إذا توقف العامل أو انهار أثناء المعالجة (التكرار الناتج يمنعه update_deduplicator). عامل واحد لكل قسم.
+
+SHARD_COUNT مطلوب في وضعي الأقسام، ويُحفظ في Redis (tg:shard:count) عند أول تشغيل:
+الواجهة والعمال يرفضون البدء إذا اختلفت قيمتهم عنه، حتى لا يُوزع نفس المستخدم على قسمين.
+تغيير SHARD_COUNT يعيد توزيع المستخدمين: أوقف الواجهة حتى تفرغ القوائم، ثم احذف tg:shard:count وغيره.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_QUEUE_KEY = "tg:shard:{}"
+_PROCESSING_KEY = "tg:shard:{}:processing"
+_COUNT_KEY = "tg:shard:count"
+
+# إضافة التحديث فقط إذا لم تمتلئ قائمة القسم (رحلة واحدة وبدون سباق بين نسخ الواجهة)
+_PUSH_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[2]) then
+    return -1
+end
+return redis.call('RPUSH', KEYS[1], ARGV[1])
+"""
+
+# نقل حتى ARGV[1] تحديث من رأس القائمة إلى قائمة المعالجة في خطوة واحدة
+_MOVE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+# إعادة قائمة المعالجة إلى رأس القائمة بنفس الترتيب (أقدم من كل ما بعدها)
+_REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('LPUSH', KEYS[1], items[i])
+end
+redis.call('DEL', KEYS[2])
+return #items
+"""
+
+
+def shard_key(data: Dict[str, Any]) -> int:
+    """معرف المستخدم صاحب التحديث (أو المحادثة إذا لم يوجد) من JSON الخام"""
+    for field, payload in data.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        sender = payload.get("from") or payload.get("user")
+        if sender:
+            return sender["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return data.get("update_id", 0)
+
+
+def shard_for(data: Dict[str, Any], shards: int) -> int:
+    return shard_key(data) % shards
+
+
+class ShardQueue:
+    """قوائم التحديثات في Redis - قائمة لكل قسم"""
+
+    def __init__(self):
+        self._redis = None
+        self._push = None
+        self._move = None
+        self._requeue = None
+
+    def _client(self):
+        if self._redis is None:
+            from redis.asyncio import Redis
+
+            self._redis = Redis.from_url(Config.SHARD_REDIS_URL)
+            self._push = self._redis.register_script(_PUSH_SCRIPT)
+            self._move = self._redis.register_script(_MOVE_SCRIPT)
+            self._requeue = self._redis.register_script(_REQUEUE_SCRIPT)
+        return self._redis
+
+    async def check_shard_count(self):
+        """التأكد أن SHARD_COUNT مضبوط ومطابق لما تستخدمه باقي العمليات"""
+        if Config.SHARD_COUNT <= 0:
+            raise RuntimeError("SHARD_COUNT مطلوب في وضع الأقسام (نفس القيمة في الواجهة وكل العمال)")
+        client = self._client()
+        await client.set(_COUNT_KEY, Config.SHARD_COUNT, nx=True)
+        stored = int(await client.get(_COUNT_KEY))
+        if stored != Config.SHARD_COUNT:
+            raise RuntimeError(
+                f"SHARD_COUNT={Config.SHARD_COUNT} يختلف عن {stored} المستخدم في Redis ({_COUNT_KEY})"
+            )
+
+    async def push(self, raw: bytes, data: Dict[str, Any]) -> Optional[int]:
+        """وضع التحديث في قائمة قسمه - None إذا كانت ممتلئة"""
+        shard = shard_for(data, Config.SHARD_COUNT)
+        self._client()
+        length = await self._push(keys=[_QUEUE_KEY.format(shard)], args=[raw, Config.SHARD_QUEUE_MAX])
+        return None if length < 0 else shard
+
+    async def pop(self, shard: int, timeout: float = 1.0, limit: Optional[int] = None) -> List[bytes]:
+        """نقل حتى limit تحديث إلى قائمة المعالجة، وانتظار حتى timeout إذا كانت القائمة فارغة
+
+        كل تحديث يبقى في قائمة المعالجة حتى ack.
+        """
+        client = self._client()
+        keys = [_QUEUE_KEY.format(shard), _PROCESSING_KEY.format(shard)]
+        items = await self._move(keys=keys, args=[limit or Config.SHARD_POP_BATCH])
+        if items:
+            return items
+        item = await client.blmove(keys[0], keys[1], timeout, "LEFT", "RIGHT")
+        return [item] if item is not None else []
+
+    async def ack(self, shard: int, raw: bytes):
+        """انتهت معالجة التحديث - حذفه من قائمة المعالجة"""
+        await self._client().lrem(_PROCESSING_KEY.format(shard), 1, raw)
+
+    async def requeue(self, shard: int) -> int:
+        """إعادة تحديثات لم تكتمل معالجتها (توقف العامل السابق) إلى رأس القائمة"""
+        self._client()
+        return await self._requeue(keys=[_QUEUE_KEY.format(shard), _PROCESSING_KEY.format(shard)])
+
+    async def depths(self) -> List[int]:
+        pipe = self._client().pipeline(transaction=False)
+        for shard in range(Config.SHARD_COUNT):
+            pipe.llen(_QUEUE_KEY.format(shard))
+        return await pipe.execute()
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+async def _process(application, queue: ShardQueue, shard: int, raw: bytes, update: Update):
+    """نفس مسار update_queue في التطبيق (عبر update_processor للحفاظ على ترتيب المستخدم) ثم ack"""
+    try:
+        await application.update_processor.process_update(update, application.process_update(update))
+    finally:
+        try:
+            await queue.ack(shard, raw)
+        except Exception as e:
+            # يبقى في قائمة المعالجة ويُعاد عند التشغيل التالي (ويتخطاه update_deduplicator)
+            logger.error(f"❌ تعذر تأكيد تحديث في القسم {shard}: {e}")
+
+
+async def consume(application, shard: int, stop: asyncio.Event):
+    """معالجة تحديثات القسم حتى stop - كل تحديث يُحذف من Redis بعد انتهاء معالجته"""
+    queue = ShardQueue()
+    in_flight = set()
+    await queue.check_shard_count()
+    requeued = await queue.requeue(shard)
+    if requeued:
+        logger.warning(f"🔁 أعيد {requeued} تحديث لم تكتمل معالجته في القسم {shard}")
+    logger.info(f"📥 العامل يقرأ القسم {shard} من {Config.SHARD_COUNT}")
+    try:
+        while not stop.is_set():
+            # لا نسحب أكثر مما يستطيع العامل معالجته - الباقي ينتظر في Redis
+            room = Config.TELEGRAM_UPDATE_QUEUE_MAX - len(in_flight)
+            if room <= 0:
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                items = await queue.pop(shard, limit=min(room, Config.SHARD_POP_BATCH))
+            except Exception as e:
+                logger.error(f"❌ تعذرت القراءة من قائمة القسم {shard}: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for raw in items:
+                try:
+                    update = Update.de_json(json.loads(raw), application.bot)
+                except ValueError as e:
+                    logger.error(f"❌ تحديث غير صالح في القسم {shard}: {e}")
+                    await queue.ack(shard, raw)
+                    continue
+                task = application.create_task(_process(application, queue, shard, raw, update), update=update)
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+    finally:
+        # إكمال التحديثات الجارية وتأكيدها قبل إغلاق الاتصال
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        await queue.close()
+
+
+# إنشاء instance عام
+shard_queue = ShardQueue()
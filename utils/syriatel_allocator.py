@@ -0,0 +1,141 @@
+"""
+تخصيص أكواد سيرياتيل لطلبات الشحن
+
+عرض الكود للمستخدم يحجز المبلغ في reserved_balance مع صف في syriatel_reservations
+مهلته SYRIATEL_RESERVATION_MINUTES، ولا يُمس current_balance حتى يصل التحويل فعلاً
+(رسالة SMS)، فلا يُحسب المبلغ مرتين. الحجز يُحرر عند الإلغاء أو طلب مبلغ جديد أو انتهاء المهلة،
+فالطلبات المتروكة لا تستهلك سعة الأكواد.
+
+- أفضل ملاءمة: الكود الذي تبقى فيه أقل سعة تكفي المبلغ، فتبقى السعات الكبيرة للمبالغ الكبيرة.
+- SELECT ... FOR UPDATE SKIP LOCKED: الطلبات المتزامنة تأخذ أكواداً مختلفة بدل انتظار بعضها،
+  وشرط السعة من أعمدة الصف نفسه فيُعاد فحصه على آخر نسخة بعد القفل.
+- الحجز يُنفذ في جلسة المستدعي (مع مفتاح العملية) ويُلتزم معها.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from database.models import AsyncSessionLocal, get_engine, SyriatelCode, SyriatelReservation
+
+logger = logging.getLogger(__name__)
+
+_FREE = SyriatelCode.max_balance - SyriatelCode.current_balance - SyriatelCode.reserved_balance
+
+
+class SyriatelAllocator:
+    """حجز سعة أكواد سيرياتيل وتحريرها"""
+
+    async def reserve(self, db: AsyncSession, telegram_id: int, amount: float) -> Optional[SyriatelCode]:
+        """حجز كود للمبلغ (يحرر حجز المستخدم السابق) - None إذا لم يتسع أي كود
+
+        يجب استدعاء commit بعدها، وحتى ذلك يبقى الكود مقفولاً ويتخطاه باقي الطلبات.
+        """
+        await self._release(db, SyriatelReservation.telegram_id == telegram_id, "released")
+
+        code = await self._pick(db, amount)
+        if code is None and await self._release(db, SyriatelReservation.expires_at < datetime.utcnow(), "expired"):
+            # سعة تحررت من حجوزات انتهت ولم تمر عليها مهمة الصيانة بعد (utils/maintenance.py)
+            code = await self._pick(db, amount)
+        if code is None:
+            return None
+
+        now = datetime.utcnow()
+        code.reserved_balance += amount
+        code.last_used = now
+        db.add(SyriatelReservation(
+            code_id=code.id,
+            telegram_id=telegram_id,
+            amount=amount,
+            expires_at=now + timedelta(minutes=Config.SYRIATEL_RESERVATION_MINUTES),
+            created_at=now
+        ))
+        return code
+
+    async def release(self, db: AsyncSession, telegram_id: int) -> int:
+        """إلغاء طلب الشحن الجاري للمستخدم (يلتزم المستدعي)"""
+        return await self._release(db, SyriatelReservation.telegram_id == telegram_id, "released")
+
+    async def consume(self, db: AsyncSession, code: SyriatelCode, telegram_id: int) -> bool:
+        """وصل التحويل إلى الكود: الحجز يصبح consumed ويخرج من reserved_balance
+
+        المبلغ الفعلي يضاف إلى current_balance من المستدعي كما في رسالة SMS.
+        """
+        reservation = await db.scalar(
+            select(SyriatelReservation)
+            .where(
+                SyriatelReservation.telegram_id == telegram_id,
+                SyriatelReservation.code_id == code.id,
+                SyriatelReservation.status == "active"
+            )
+            .order_by(SyriatelReservation.id.desc())
+            .limit(1)
+        )
+        if reservation is None:
+            return False
+        return await self._release(db, SyriatelReservation.id == reservation.id, "consumed") > 0
+
+    async def release_expired(self) -> int:
+        """تحرير الحجوزات التي انتهت مهلتها (مهمة صيانة دورية)"""
+        db = AsyncSessionLocal()
+        try:
+            released = await self._release(db, SyriatelReservation.expires_at < datetime.utcnow(), "expired")
+            await db.commit()
+        finally:
+            await db.close()
+        if released:
+            logger.info(f"⏱️ تم تحرير {released} حجز كود سيرياتيل منتهي")
+        return released
+
+    async def _pick(self, db: AsyncSession, amount: float) -> Optional[SyriatelCode]:
+        return await db.scalar(
+            select(SyriatelCode)
+            .where(SyriatelCode.is_active == True, _FREE >= amount)
+            .order_by(_FREE, SyriatelCode.last_used.asc().nulls_first(), SyriatelCode.id)
+            .limit(1)
+            .with_for_update(skip_locked=True, of=SyriatelCode)
+        )
+
+    async def _release(self, db: AsyncSession, condition, status: str) -> int:
+        """نقل الحجوزات النشطة المطابقة إلى status وإرجاع مبالغها لسعة أكوادها"""
+        rows = (await db.execute(
+            update(SyriatelReservation)
+            .where(SyriatelReservation.status == "active", condition)
+            .values(status=status)
+            .returning(SyriatelReservation.code_id, SyriatelReservation.amount)
+            .execution_options(synchronize_session=False)
+        )).all()
+
+        per_code = defaultdict(float)
+        for code_id, amount in rows:
+            per_code[code_id] += amount
+        for code_id, amount in per_code.items():
+            await db.execute(
+                update(SyriatelCode)
+                .where(SyriatelCode.id == code_id)
+                .values(reserved_balance=SyriatelCode.reserved_balance - amount)
+                .execution_options(synchronize_session="fetch")
+            )
+        return len(rows)
+
+
+def purge_syriatel_reservations(bind=None) -> int:
+    """حذف الحجوزات المنتهية الأقدم من SYRIATEL_RESERVATION_RETENTION_DAYS (مهمة صيانة دورية)"""
+    bind = bind or get_engine()
+    cutoff = datetime.utcnow() - timedelta(days=Config.SYRIATEL_RESERVATION_RETENTION_DAYS)
+    with bind.begin() as conn:
+        deleted = conn.execute(
+            delete(SyriatelReservation)
+            .where(SyriatelReservation.status != "active", SyriatelReservation.created_at < cutoff)
+        ).rowcount
+    if deleted:
+        logger.info(f"🧹 تم حذف {deleted} حجز كود سيرياتيل قديم")
+    return deleted
+
+
+# إنشاء instance عام
+syriatel_allocator = SyriatelAllocator()
@@ -0,0 +1,75 @@
+"""
+معالجة التحديثات بالتوازي مع الحفاظ على ترتيب تحديثات كل مستخدم
+
+تحديثات المستخدم الواحد تُعالج واحداً تلو الآخر (حالة ConversationHandler و user_data
+تبقى متسقة)، وتحديثات المستخدمين المختلفين تُعالج معاً حتى MAX_CONCURRENT.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    max_pending: التحديثات المقبولة معاً (بما فيها المنتظرة خلف تحديث سابق لنفس المستخدم)
+    workers: التحديثات التي تُنفذ فعلاً في نفس الوقت
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        super().__init__(max(workers, max_pending))
+        self.workers = workers
+        self._workers: Optional[asyncio.Semaphore] = None
+        # المفتاح -> [القفل، عدد التحديثات التي تستخدمه]
+        self._locks: Dict[int, List[Any]] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        # المهام تُنشأ بترتيب وصول التحديثات، والقفل يُمنح بترتيب الطلب (FIFO)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # مقعد التنفيذ بعد القفل: تحديثات مستخدم ينتظر دوره لا تحجز مقاعد الآخرين
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "users_in_progress": len(self._locks),
+            "queued_behind_same_user": sum(count - 1 for _, count in self._locks.values())
+        }
+
+    async def initialize(self) -> None:
+        self._workers = asyncio.Semaphore(self.workers)
+
+    async def shutdown(self) -> None:
+        if self._locks:
+            logger.warning(f"⚠️ إيقاف المعالج مع {len(self._locks)} مستخدم لم تكتمل تحديثاته")
+        self._locks.clear()
@@ -0,0 +1,209 @@
+"""
+عميل منصة Ichancy - منفصل عن تطبيق الـ Webhook حتى لا يحمّل البوت FastAPI
+"""
+import logging
+import asyncio
+from datetime import datetime
+from typing import Dict, Any
+
+from config import Config
+from utils.security import SecurityUtils
+
+logger = logging.getLogger(__name__)
+
+class IchancyWebhook:
+    def __init__(self):
+        self._client = None
+        self.session_cache = {}
+    
+    @property
+    def client(self):
+        """عميل HTTP للمنصة - يُنشأ عند أول طلب (إنشاؤه يحمّل شهادات TLS)"""
+        if self._client is None:
+            import httpx
+            
+            self._client = httpx.AsyncClient(
+                base_url=Config.ICHANCY_API_URL,
+                timeout=30.0
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def create_account(
+        self, 
+        telegram_id: int,
+        first_name: str,
+        last_name: str = ""
+    ) -> Dict[str, Any]:
+        """إنشاء حساب على Ichancy"""
+        try:
+            # محاكاة API حتى يتم ربط API الحقيقي
+            # هذا كود مؤقت - سيتم استبداله بالاتصال الحقيقي
+            
+            import random
+            import string
+            
+            # إنشاء بيانات حساب وهمية
+            account_id = ''.join(random.choices(string.digits, k=8))
+            username = f"{first_name.lower()}_{random.randint(1000, 9999)}"
+            password = SecurityUtils.generate_password()
+            
+            # في الإصدار الحقيقي، هنا سيتم:
+            # 1. تسجيل الدخول إلى لوحة تحكم Ichancy
+            # 2. ملء نموذج إنشاء حساب
+            # 3. استخراج بيانات الحساب
+            
+            return {
+                "success": True,
+                "account_id": account_id,
+                "username": username,
+                "password": password,
+                "created_at": datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"خطأ في create_account: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def deposit_to_account(
+        self,
+        account_id: str,
+        amount: float
+    ) -> Dict[str, Any]:
+        """شحن رصيد لحساب Ichancy"""
+        try:
+            # محاكاة API
+            # في الإصدار الحقيقي، هنا سيتم:
+            # 1. تسجيل الدخول إلى لوحة تحكم Ichancy
+            # 2. البحث عن الحساب
+            # 3. إضافة الرصيد
+            
+            logger.info(f"Depositing {amount} to account {account_id}")
+            
+            # محاكاة التأخير
+            await asyncio.sleep(1)
+            
+            return {
+                "success": True,
+                "account_id": account_id,
+                "amount": amount,
+                "new_balance": 0,  # سيتم تحديثه من الاستعلام عن الرصيد
+                "transaction_id": f"D{int(datetime.now().timestamp())}",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"خطأ في deposit_to_account: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def withdraw_from_account(
+        self,
+        account_id: str,
+        amount: float
+    ) -> Dict[str, Any]:
+        """سحب رصيد من حساب Ichancy"""
+        try:
+            # محاكاة API
+            logger.info(f"Withdrawing {amount} from account {account_id}")
+            
+            await asyncio.sleep(1)
+            
+            return {
+                "success": True,
+                "account_id": account_id,
+                "amount": amount,
+                "transaction_id": f"W{int(datetime.now().timestamp())}",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"خطأ في withdraw_from_account: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def get_account_balance(
+        self,
+        account_id: str
+    ) -> Dict[str, Any]:
+        """الحصول على رصيد حساب Ichancy"""
+        try:
+            # محاكاة API
+            # في الواقع، هنا سيتم استخراج الرصيد من لوحة التحكم
+            
+            import random
+            
+            # محاكاة رصيد عشوائي
+            balance = random.uniform(0, 10000)
+            
+            return {
+                "success": True,
+                "account_id": account_id,
+                "balance": round(balance, 2),
+                "currency": "SYP",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"خطأ في get_account_balance: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def delete_account(
+        self,
+        account_id: str
+    ) -> Dict[str, Any]:
+        """حذف حساب Ichancy"""
+        try:
+            # محاكاة API
+            logger.info(f"Deleting account {account_id}")
+            
+            await asyncio.sleep(1)
+            
+            return {
+                "success": True,
+                "account_id": account_id,
+                "deleted": True,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"خطأ في delete_account: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def login_to_panel(self) -> bool:
+        """تسجيل الدخول إلى لوحة تحكم Ichancy"""
+        try:
+            # هذا الكود سيكون مختلفاً تماماً في التنفيذ الحقيقي
+            # قد يستخدم selenium أو requests مع session
+            
+            if Config.ICHANCY_USERNAME and Config.ICHANCY_PASSWORD:
+                # محاكاة تسجيل الدخول الناجح
+                self.session_cache['logged_in'] = True
+                self.session_cache['login_time'] = datetime.utcnow()
+                return True
+            
+            return False
+            
+        except Exception as e:
+            logger.error(f"خطأ في login_to_panel: {e}")
+            return False
+
+# إنشاء نسخة من الـ Webhook
+ichancy_webhook = IchancyWebhook()
@@ -5,210 +5,30 @@ import logging
 import json
 import asyncio
 from datetime import datetime
-from typing import Dict, Any, Optional
 
 from fastapi import FastAPI, Request, HTTPException, Header, Depends
 from fastapi.responses import JSONResponse
-import httpx
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import SessionLocal, User
-from config import Config
-from utils.security import SecurityUtils
+from database.models import get_async_db, async_engine, User
+from database.pool import pool_status
+from database.query_budget import install_http_middleware, handler_totals
+from config import Config, setup_logging
+import utils.cache  # noqa: F401 - إبطال ذاكرة المستخدمين بعد تعديل حساب Ichancy
+from webhook.ichancy_client import ichancy_webhook
 
 logger = logging.getLogger(__name__)
 app = FastAPI(title="Ichancy Webhook API")
+install_http_middleware(app)
 
-class IchancyWebhook:
-    def __init__(self):
-        self.client = httpx.AsyncClient(
-            base_url=Config.ICHANCY_API_URL,
-            timeout=30.0
-        )
-        self.session_cache = {}
-    
-    async def create_account(
-        self, 
-        telegram_id: int,
-        first_name: str,
-        last_name: str = ""
-    ) -> Dict[str, Any]:
-        """إنشاء حساب على Ichancy"""
-        try:
-            # محاكاة API حتى يتم ربط API الحقيقي
-            # هذا كود مؤقت - سيتم استبداله بالاتصال الحقيقي
-            
-            import random
-            import string
-            
-            # إنشاء بيانات حساب وهمية
-            account_id = ''.join(random.choices(string.digits, k=8))
-            username = f"{first_name.lower()}_{random.randint(1000, 9999)}"
-            password = SecurityUtils.generate_password()
-            
-            # في الإصدار الحقيقي، هنا سيتم:
-            # 1. تسجيل الدخول إلى لوحة تحكم Ichancy
-            # 2. ملء نموذج إنشاء حساب
-            # 3. استخراج بيانات الحساب
-            
-            return {
-                "success": True,
-                "account_id": account_id,
-                "username": username,
-                "password": password,
-                "created_at": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"خطأ في create_account: {e}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    async def deposit_to_account(
-        self,
-        account_id: str,
-        amount: float
-    ) -> Dict[str, Any]:
-        """شحن رصيد لحساب Ichancy"""
-        try:
-            # محاكاة API
-            # في الإصدار الحقيقي، هنا سيتم:
-            # 1. تسجيل الدخول إلى لوحة تحكم Ichancy
-            # 2. البحث عن الحساب
-            # 3. إضافة الرصيد
-            
-            logger.info(f"Depositing {amount} to account {account_id}")
-            
-            # محاكاة التأخير
-            await asyncio.sleep(1)
-            
-            return {
-                "success": True,
-                "account_id": account_id,
-                "amount": amount,
-                "new_balance": 0,  # سيتم تحديثه من الاستعلام عن الرصيد
-                "transaction_id": f"D{int(datetime.now().timestamp())}",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"خطأ في deposit_to_account: {e}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    async def withdraw_from_account(
-        self,
-        account_id: str,
-        amount: float
-    ) -> Dict[str, Any]:
-        """سحب رصيد من حساب Ichancy"""
-        try:
-            # محاكاة API
-            logger.info(f"Withdrawing {amount} from account {account_id}")
-            
-            await asyncio.sleep(1)
-            
-            return {
-                "success": True,
-                "account_id": account_id,
-                "amount": amount,
-                "transaction_id": f"W{int(datetime.now().timestamp())}",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"خطأ في withdraw_from_account: {e}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    async def get_account_balance(
-        self,
-        account_id: str
-    ) -> Dict[str, Any]:
-        """الحصول على رصيد حساب Ichancy"""
-        try:
-            # محاكاة API
-            # في الواقع، هنا سيتم استخراج الرصيد من لوحة التحكم
-            
-            import random
-            
-            # محاكاة رصيد عشوائي
-            balance = random.uniform(0, 10000)
-            
-            return {
-                "success": True,
-                "account_id": account_id,
-                "balance": round(balance, 2),
-                "currency": "SYP",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"خطأ في get_account_balance: {e}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    async def delete_account(
-        self,
-        account_id: str
-    ) -> Dict[str, Any]:
-        """حذف حساب Ichancy"""
-        try:
-            # محاكاة API
-            logger.info(f"Deleting account {account_id}")
-            
-            await asyncio.sleep(1)
-            
-            return {
-                "success": True,
-                "account_id": account_id,
-                "deleted": True,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"خطأ في delete_account: {e}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    async def login_to_panel(self) -> bool:
-        """تسجيل الدخول إلى لوحة تحكم Ichancy"""
-        try:
-            # هذا الكود سيكون مختلفاً تماماً في التنفيذ الحقيقي
-            # قد يستخدم selenium أو requests مع session
-            
-            if Config.ICHANCY_USERNAME and Config.ICHANCY_PASSWORD:
-                # محاكاة تسجيل الدخول الناجح
-                self.session_cache['logged_in'] = True
-                self.session_cache['login_time'] = datetime.utcnow()
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"خطأ في login_to_panel: {e}")
-            return False
+@app.on_event("startup")
+async def configure_logging():
+    setup_logging()
 
-# إنشاء نسخة من الـ Webhook
-ichancy_webhook = IchancyWebhook()
-
-# تبعيات FastAPI
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("shutdown")
+async def close_client():
+    await ichancy_webhook.close()
 
 # التحقق من التوكن
 async def verify_webhook_token(x_token: str = Header(...)):
@@ -221,7 +41,7 @@ async def verify_webhook_token(x_token: str = Header(...)):
 async def create_account_endpoint(
     request: Request,
     token_valid: bool = Depends(verify_webhook_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """إنشاء حساب جديد على Ichancy"""
     try:
@@ -235,7 +55,7 @@ async def create_account_endpoint(
             raise HTTPException(status_code=400, detail="telegram_id مطلوب")
         
         # البحث عن المستخدم
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        user = await db.scalar(select(User).where(User.telegram_id == telegram_id))
         if not user:
             raise HTTPException(status_code=404, detail="المستخدم غير موجود")
         
@@ -246,7 +66,7 @@ async def create_account_endpoint(
             # تحديث بيانات المستخدم
             user.ichancy_account_id = result["account_id"]
             user.ichancy_username = result["username"]
-            db.commit()
+            await db.commit()
             
             return JSONResponse({
                 "success": True,
@@ -273,7 +93,7 @@ async def create_account_endpoint(
 async def deposit_endpoint(
     request: Request,
     token_valid: bool = Depends(verify_webhook_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """شحن رصيد لحساب Ichancy"""
     try:
@@ -286,7 +106,7 @@ async def deposit_endpoint(
             raise HTTPException(status_code=400, detail="account_id و amount مطلوبان")
         
         # البحث عن المستخدم
-        user = db.query(User).filter(User.ichancy_account_id == account_id).first()
+        user = await db.scalar(select(User).where(User.ichancy_account_id == account_id))
         if not user:
             raise HTTPException(status_code=404, detail="الحساب غير موجود")
         
@@ -320,7 +140,7 @@ async def deposit_endpoint(
 async def withdraw_endpoint(
     request: Request,
     token_valid: bool = Depends(verify_webhook_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """سحب رصيد من حساب Ichancy"""
     try:
@@ -333,7 +153,7 @@ async def withdraw_endpoint(
             raise HTTPException(status_code=400, detail="account_id و amount مطلوبان")
         
         # البحث عن المستخدم
-        user = db.query(User).filter(User.ichancy_account_id == account_id).first()
+        user = await db.scalar(select(User).where(User.ichancy_account_id == account_id))
         if not user:
             raise HTTPException(status_code=404, detail="الحساب غير موجود")
         
@@ -367,12 +187,12 @@ async def withdraw_endpoint(
 async def get_balance_endpoint(
     account_id: str,
     token_valid: bool = Depends(verify_webhook_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """الحصول على رصيد حساب Ichancy"""
     try:
         # البحث عن المستخدم
-        user = db.query(User).filter(User.ichancy_account_id == account_id).first()
+        user = await db.scalar(select(User).where(User.ichancy_account_id == account_id))
         if not user:
             raise HTTPException(status_code=404, detail="الحساب غير موجود")
         
@@ -404,12 +224,12 @@ async def get_balance_endpoint(
 async def delete_account_endpoint(
     account_id: str,
     token_valid: bool = Depends(verify_webhook_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """حذف حساب Ichancy"""
     try:
         # البحث عن المستخدم
-        user = db.query(User).filter(User.ichancy_account_id == account_id).first()
+        user = await db.scalar(select(User).where(User.ichancy_account_id == account_id))
         if not user:
             raise HTTPException(status_code=404, detail="الحساب غير موجود")
         
@@ -420,7 +240,7 @@ async def delete_account_endpoint(
             # تحديث بيانات المستخدم
             user.ichancy_account_id = None
             user.ichancy_username = None
-            db.commit()
+            await db.commit()
             
             return JSONResponse({
                 "success": True,
@@ -444,7 +264,9 @@ async def health_check():
     return JSONResponse({
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "service": "ichancy-webhook"
+        "service": "ichancy-webhook",
+        "db_pool": pool_status(async_engine),
+        "query_budget": handler_totals.snapshot()
     })
 
 @app.post("/api/ichancy/bulk_check_balance")
@@ -7,15 +7,30 @@ from datetime import datetime
 from typing import Dict, Any, List, Optional
 import asyncio
 
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Depends
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import SessionLocal, Transaction, SyriatelCode
-from config import Config
+from database.models import AsyncSessionLocal, get_async_db, async_engine, Transaction, SyriatelCode, User
+from database.pool import pool_status
+from database.query_budget import install_http_middleware, handler_totals
+from database.stats import record_transaction_completed
+from database.routing import get_async_read_db
+from utils.pagination import fetch_transactions_page
+from config import Config, setup_logging
 from utils.payments import payment_processor
+from utils.balance import balance_service
+from utils.idempotency import claim_transaction
+from utils.syriatel_allocator import syriatel_allocator
 
 logger = logging.getLogger(__name__)
 app = FastAPI(title="SMS Webhook API")
+install_http_middleware(app)
+
+@app.on_event("startup")
+async def configure_logging():
+    setup_logging()
 
 class SMSProcessor:
     def __init__(self):
@@ -96,32 +111,42 @@ class SMSProcessor:
                 }
             
             # البحث عن معاملة تطابق رقم العملية
-            db = SessionLocal()
+            db = AsyncSessionLocal()
             try:
-                transaction = db.query(Transaction).filter(
+                transaction = await db.scalar(select(Transaction).where(
                     Transaction.transaction_code == parsed_data["transaction_code"],
                     Transaction.payment_method == parsed_data["provider"],
                     Transaction.status == "pending"
-                ).first()
+                ).limit(1))
+                
+                # نفس الرسالة قد تصل مرتين أو يتحقق الإدمن من الطلب في نفس الوقت
+                if transaction and not await claim_transaction(
+                    db, transaction, "completed", auto_verified=True, completed_at=timestamp
+                ):
+                    return {
+                        "success": True,
+                        "processed": False,
+                        "reason": "المعاملة تمت معالجتها مسبقاً",
+                        "transaction_id": transaction.id
+                    }
                 
                 if transaction:
-                    # تحديث المعاملة
-                    transaction.status = "completed"
-                    transaction.auto_verified = True
-                    transaction.completed_at = timestamp
-                    
                     # إذا كان سيرياتيل، تحديث الكود
                     if parsed_data["provider"] == "syriatel_cash":
-                        syriatel_code = db.query(SyriatelCode).filter(
+                        syriatel_code = await db.scalar(select(SyriatelCode).where(
                             SyriatelCode.code == sender
-                        ).first()
+                        ))
                         
                         if syriatel_code:
                             syriatel_code.current_balance += parsed_data["amount"]
                             if syriatel_code.current_balance >= syriatel_code.max_balance:
                                 syriatel_code.is_active = False
+                            # الحجز الذي أُنشئ عند عرض الكود يخرج من السعة المحجوزة
+                            telegram_id = await db.scalar(select(User.telegram_id).where(User.id == transaction.user_id))
+                            await syriatel_allocator.consume(db, syriatel_code, telegram_id)
                     
-                    db.commit()
+                    await record_transaction_completed(db, transaction)
+                    await db.commit()
                     
                     # إشعار المستخدم
                     await self.notify_user_transaction(transaction)
@@ -145,7 +170,7 @@ class SMSProcessor:
                     }
                     
             finally:
-                db.close()
+                await db.close()
                 
         except Exception as e:
             logger.error(f"خطأ في process_sms: {e}")
@@ -298,7 +323,7 @@ async def test_parse_sms(
 @app.post("/api/sms/manual_verify")
 async def manual_verify_transaction(
     request: Request,
-    db: Session = Depends(lambda: SessionLocal())
+    db: AsyncSession = Depends(get_async_db)
 ):
     """التحقق اليدوي من معاملة"""
     try:
@@ -311,11 +336,11 @@ async def manual_verify_transaction(
             raise HTTPException(status_code=400, detail="transaction_code و provider مطلوبان")
         
         # البحث عن المعاملة
-        transaction = db.query(Transaction).filter(
+        transaction = await db.scalar(select(Transaction).where(
             Transaction.transaction_code == transaction_code,
             Transaction.payment_method == provider,
             Transaction.status == "pending"
-        ).first()
+        ).limit(1))
         
         if not transaction:
             return {
@@ -323,55 +348,65 @@ async def manual_verify_transaction(
                 "error": "لم يتم العثور على معاملة تطابق البيانات"
             }
         
-        # تحديث المعاملة
-        transaction.status = "completed"
-        transaction.auto_verified = False  # لأنها يدوية
-        transaction.completed_at = datetime.utcnow()
+        # تحديث المعاملة (ذرياً - قد تكون رسالة SMS أكدتها للتو)
+        if not await claim_transaction(
+            db, transaction, "completed", auto_verified=False, completed_at=datetime.utcnow()
+        ):
+            return {
+                "success": False,
+                "error": "المعاملة تمت معالجتها مسبقاً"
+            }
         
         # تحديث رصيد المستخدم
-        user = transaction.user
-        user.balance += transaction.net_amount
+        await balance_service.credit(db, transaction.user_id, transaction.net_amount, "deposit", transaction)
         
-        db.commit()
+        await record_transaction_completed(db, transaction)
+        await db.commit()
         
         return {
             "success": True,
             "message": "تم التحقق من المعاملة بنجاح",
             "transaction_id": transaction.id,
-            "user_id": user.id,
+            "user_id": transaction.user_id,
             "amount": transaction.net_amount
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"خطأ في manual_verify_transaction: {e}")
         raise HTTPException(status_code=500, detail="خطأ داخلي")
-    finally:
-        db.close()
 
 @app.get("/api/sms/pending_transactions")
 async def get_pending_transactions(
     provider: Optional[str] = None,
     hours: int = 24,
-    db: Session = Depends(lambda: SessionLocal())
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """الحصول على المعاملات المعلقة"""
+    """الحصول على المعاملات المعلقة (الأحدث أولاً، والصفحة التالية عبر next_cursor)"""
     try:
         from datetime import timedelta
         
         cutoff_time = datetime.utcnow() - timedelta(hours=hours)
         
-        query = db.query(Transaction).filter(
+        query = select(Transaction).where(
             Transaction.status == "pending",
             Transaction.created_at >= cutoff_time
-        )
+        ).options(selectinload(Transaction.user))
         
         if provider:
-            query = query.filter(Transaction.payment_method == provider)
+            query = query.where(Transaction.payment_method == provider)
         
-        transactions = query.order_by(Transaction.created_at.desc()).limit(100).all()
+        try:
+            page = await fetch_transactions_page(
+                db, query, cursor=cursor, page_size=max(1, min(limit, 100))
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor غير صالح")
+        transactions = page.items
         
         result = []
         for t in transactions:
@@ -389,14 +424,15 @@ async def get_pending_transactions(
         return {
             "success": True,
             "count": len(result),
-            "transactions": result
+            "transactions": result,
+            "next_cursor": page.next_cursor
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"خطأ في get_pending_transactions: {e}")
         raise HTTPException(status_code=500, detail="خطأ داخلي")
-    finally:
-        db.close()
 
 @app.get("/health")
 async def health_check():
@@ -404,7 +440,9 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "service": "sms-webhook"
+        "service": "sms-webhook",
+        "db_pool": pool_status(async_engine),
+        "query_budget": handler_totals.snapshot()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+"""
+واجهة استقبال تحديثات تيليجرام في وضع الأقسام (BOT_MODE=shard_front)
+
+لا تعالج التحديثات: تتحقق من X-Telegram-Bot-Api-Secret-Token وتضع JSON الخام في قائمة
+قسم صاحب التحديث (utils/sharding.py) وترد 200. العمال (BOT_MODE=shard_worker) يعالجونها.
+"""
+import hmac
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import FastAPI, Request, Response, HTTPException, Header
+from telegram import Bot, Update
+
+from config import Config, setup_logging
+from utils.sharding import shard_queue
+
+logger = logging.getLogger(__name__)
+app = FastAPI(title="Telegram Front API")
+
+counters = {
+    "accepted": 0,
+    "rejected_full": 0,
+    "redis_errors": 0
+}
+
+
+@app.on_event("startup")
+async def register_webhook():
+    """تسجيل الـ Webhook لدى تيليجرام"""
+    setup_logging()
+    if not Config.TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("TELEGRAM_WEBHOOK_SECRET مطلوب في وضع الأقسام")
+    await shard_queue.check_shard_count()
+
+    try:
+        async with Bot(Config.BOT_TOKEN) as bot:
+            await bot.set_webhook(
+                url=Config.WEBHOOK_URL,
+                secret_token=Config.TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=Config.TELEGRAM_WEBHOOK_MAX_CONNECTIONS
+            )
+        logger.info(f"✅ تم تسجيل الـ Webhook: {Config.WEBHOOK_HOST} ({Config.SHARD_COUNT} أقسام)")
+    except Exception as e:
+        logger.error(f"❌ فشل تسجيل الـ Webhook: {e}")
+
+
+@app.on_event("shutdown")
+async def close_queue():
+    await shard_queue.close()
+
+
+@app.post(Config.WEBHOOK_PATH)
+async def receive_update(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None)
+):
+    """استقبال تحديث من تيليجرام وتوجيهه لقسمه"""
+    if not x_telegram_bot_api_secret_token or not hmac.compare_digest(
+        x_telegram_bot_api_secret_token, Config.TELEGRAM_WEBHOOK_SECRET
+    ):
+        raise HTTPException(status_code=403, detail="توكن غير صالح")
+
+    raw = await request.body()
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON غير صالح")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="JSON غير صالح")
+
+    # تيليجرام يعيد إرسال التحديث لاحقاً إذا لم يكن الرد 2xx
+    try:
+        shard = await shard_queue.push(raw, data)
+    except Exception as e:
+        counters["redis_errors"] += 1
+        logger.error(f"❌ تعذر وضع التحديث في قائمة القسم: {e}")
+        raise HTTPException(status_code=503, detail="غير متاح")
+
+    if shard is None:
+        counters["rejected_full"] += 1
+        logger.warning("⚠️ قائمة القسم ممتلئة - طلب إعادة الإرسال")
+        raise HTTPException(status_code=503, detail="مشغول")
+
+    counters["accepted"] += 1
+    return Response(status_code=200)
+
+
+@app.get("/health")
+async def health_check():
+    """فحص صحة الخادم"""
+    try:
+        depths = await shard_queue.depths()
+    except Exception as e:
+        return {"status": "unhealthy", "error": str(e)}
+
+    return {
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "service": "telegram-front",
+        "shards": Config.SHARD_COUNT,
+        "queue_depths": depths,
+        **counters
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=Config.TELEGRAM_WEBHOOK_PORT,
+        log_config=None
+    )
@@ -0,0 +1,120 @@
+"""
+Webhook لاستقبال تحديثات تيليجرام (BOT_MODE=webhook)
+
+كل طلب يُتحقق من X-Telegram-Bot-Api-Secret-Token ثم يوضع التحديث في update_queue
+ويُرد 200 فوراً، ومعالجة التحديثات تتم في الخلفية عبر Application كما في polling.
+يمكن تشغيل عدة نسخ خلف موزع الحمل (تيليجرام يرسل كل تحديث مرة واحدة لنسخة واحدة).
+"""
+import hmac
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import FastAPI, Request, Response, HTTPException, Header
+from telegram import Update
+
+from database.models import async_engine
+from database.pool import pool_status
+from database.query_budget import handler_totals
+from config import Config, setup_logging
+from utils.services import services
+from utils.cache import user_cache
+from utils.send_queue import send_queue
+from utils.persistence import redis_persistence
+from utils.idempotency import update_deduplicator
+
+logger = logging.getLogger(__name__)
+app = FastAPI(title="Telegram Webhook API")
+# بدون install_http_middleware: الطلب هنا لا يلمس قاعدة البيانات، والمسار قد يحتوي التوكن
+
+bot = services.bot
+application = bot.build_application()
+
+
+@app.on_event("startup")
+async def start_application():
+    """تهيئة التطبيق وتسجيل الـ Webhook لدى تيليجرام"""
+    setup_logging()
+    if not Config.TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("TELEGRAM_WEBHOOK_SECRET مطلوب في وضع webhook")
+
+    await application.initialize()
+    # post_init و post_stop تُستدعى تلقائياً في run_polling فقط
+    await bot.on_startup(application)
+    await application.start()
+
+    try:
+        # نفس القيم من كل نسخة، فالتكرار عند تشغيل عدة نسخ لا يضر
+        await application.bot.set_webhook(
+            url=Config.WEBHOOK_URL,
+            secret_token=Config.TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=Config.TELEGRAM_WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"✅ تم تسجيل الـ Webhook: {Config.WEBHOOK_HOST}")
+    except Exception as e:
+        logger.error(f"❌ فشل تسجيل الـ Webhook: {e}")
+
+
+@app.on_event("shutdown")
+async def stop_application():
+    """إنهاء معالجة التحديثات المستلمة ثم الإيقاف (بدون حذف الـ Webhook - قد تعمل نسخ أخرى)"""
+    await application.stop()
+    await bot.on_stop(application)
+    await application.shutdown()
+    await bot.on_shutdown(application)
+
+
+@app.post(Config.WEBHOOK_PATH)
+async def receive_update(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None)
+):
+    """استقبال تحديث من تيليجرام"""
+    if not x_telegram_bot_api_secret_token or not hmac.compare_digest(
+        x_telegram_bot_api_secret_token, Config.TELEGRAM_WEBHOOK_SECRET
+    ):
+        raise HTTPException(status_code=403, detail="توكن غير صالح")
+
+    # تيليجرام يعيد إرسال التحديث لاحقاً إذا لم يكن الرد 2xx
+    if application.update_queue.qsize() >= Config.TELEGRAM_UPDATE_QUEUE_MAX:
+        logger.warning("⚠️ طابور التحديثات ممتلئ - طلب إعادة الإرسال")
+        raise HTTPException(status_code=503, detail="مشغول")
+
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON غير صالح")
+
+    update = Update.de_json(data, application.bot)
+    if update is not None:
+        application.update_queue.put_nowait(update)
+    return Response(status_code=200)
+
+
+@app.get("/health")
+async def health_check():
+    """فحص صحة الخادم"""
+    return {
+        "status": "healthy" if application.running else "starting",
+        "timestamp": datetime.utcnow().isoformat(),
+        "service": "telegram-webhook",
+        "update_queue": application.update_queue.qsize(),
+        "updates": application.update_processor.stats(),
+        "user_cache": user_cache.stats(),
+        "send_queue": send_queue.stats(),
+        "persistence": redis_persistence.stats() if application.persistence else None,
+        "dedup": update_deduplicator.stats(),
+        "db_pool": pool_status(async_engine),
+        "query_budget": handler_totals.snapshot()
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=Config.TELEGRAM_WEBHOOK_PORT,
+        log_config=None
+    )